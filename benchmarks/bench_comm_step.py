@@ -0,0 +1,58 @@
+"""
+    Benchmark of the overhead per step of LSS2CommNetwork with the stand-in FMU LSS2_SimICT.
+
+    LSS2CommNetwork runs in Python 2 (like FMI++ for Cygwin, see lss2_comm_ns3_fmu.sh), hence this
+    script is started by bench_suite.py with a Python 2 interpreter (option --python2) and prints
+    the result (seconds per step) as JSON to its last line of output.
+
+    Usage:
+        python2 benchmarks/bench_comm_step.py --fmu_dir=build/fmus --steps=10000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time as timer
+
+sys.path.insert( 0, os.path.abspath( os.path.join( os.path.dirname( __file__ ), os.pardir ) ) )
+
+from lss2_comm_ns3_fmu import LSS2CommNetwork
+
+
+def bench_comm_step( fmu_dir, steps, devices ):
+    '''LSS2CommNetwork: step and get_data (all received messages), each device sends a message every 60 steps.'''
+    sim = LSS2CommNetwork()
+    sim.init( 'CommSim-0', work_dir=fmu_dir, model_name='LSS2_SimICT', instance_name='Comm1', n_devices=devices )
+    eid = sim.create( 1, 'LSS2CommNetwork' )[0]['eid']
+    outputs = { eid: [ 'device{0}_receive'.format( k ) for k in range( 1, devices + 1 ) ] + [ 'pending_messages' ] }
+
+    start = timer.time()
+    for t in range( steps ):
+        inputs = { eid: dict( ( 'device{0}_send'.format( k ), { 'PeriodicSender-0.Sender_{0}'.format( k ): 1. + 0.01*t } )
+            for k in range( 1, devices + 1 ) if t % 60 == k ) }
+        sim.step( t, inputs )
+        sim.get_data( outputs )
+    return ( timer.time() - start ) / steps
+
+
+def main():
+    parser = argparse.ArgumentParser( description='Benchmark of the overhead per step of LSS2CommNetwork' )
+    parser.add_argument( '--fmu_dir', type=str, help='directory with the stand-in FMU LSS2_SimICT.fmu', required=True )
+    parser.add_argument( '--steps', type=int, help='number of steps', default=10000 )
+    parser.add_argument( '--devices', type=int, help='number of communicating devices', default=7 )
+    args = parser.parse_args()
+
+    # LSS2CommNetwork prints each delivered message.
+    stdout = sys.stdout
+    sys.stdout = open( os.devnull, 'w' )
+    try:
+        result = bench_comm_step( args.fmu_dir, args.steps, args.devices )
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    print( json.dumps( { 'seconds_per_step': result } ) )
+
+
+if __name__ == '__main__':
+    main()
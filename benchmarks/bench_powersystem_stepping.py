@@ -0,0 +1,167 @@
+"""
+    Benchmark the number of mosaik round trips of LSS2PowerSystem.
+
+    The simulator is run once with the original fixed-increment stepping (one step per
+    mosaik tick) and once with the event-driven stepping (one step per load flow period,
+    plus wake-ups for incoming tap positions). The PowerFactory FMU is replaced by a
+    stand-in object, i.e., the numbers only reflect the cost of the co-simulation glue.
+
+    Usage:
+        python benchmarks/bench_powersystem_stepping.py --hours=24 --mt_per_sec=10
+"""
+
+import argparse
+import os
+import sys
+import time as timer
+
+sys.path.insert( 0, os.path.abspath( os.path.join( os.path.dirname( __file__ ), os.pardir ) ) )
+
+import mosaik
+import mosaik_api_v3
+
+from lss2_powersystem_pf_fmu import LSS2PowerSystem
+
+
+# Counters for step calls, indexed by simulator variant.
+ROUND_TRIPS = {}
+
+SIM_CONFIG = {
+    'LoadFlowSim': {
+        'python': '__main__:CountingPowerSystem'
+    },
+    'LegacyLoadFlowSim': {
+        'python': '__main__:LegacyPowerSystem'
+    },
+    'TapSim': {
+        'python': '__main__:TapSource'
+    },
+}
+
+# Status fmiOK of the FMI 1.0 standard (returned by the stand-in FMU).
+FMI_OK = 0
+
+OUTPUT_NAMES = [ 'ElmTerm_bus_{}_m:u'.format( b ) for b in [ '1_60', '2_32', '3_32', '4_19', '5_15', '6_15', '7_10' ] ]
+
+
+class StandInPowerSystemFMU(object):
+    '''Replaces the PowerFactory FMU, all calls return immediately.'''
+
+    def instantiate( self, *args ): return FMI_OK
+    def initialize( self, *args ): return FMI_OK
+    def doStep( self, *args ): return FMI_OK
+    def setIntegerValue( self, name, val ): return FMI_OK
+    def getRealValue( self, name ): return 1.
+
+
+class CountingPowerSystem(LSS2PowerSystem):
+    '''LSS2PowerSystem using a stand-in FMU, counts the steps it receives from mosaik.'''
+
+    variant = 'event-driven'
+
+    def init( self, sid, step_size, seconds_per_mosaik_timestep=1, **kwargs ):
+        self.step_size = step_size
+        self.sec_per_mt = seconds_per_mosaik_timestep
+        self.var_table = {
+            'input': { 'ElmTr2.trafo1.nntap': 'Integer' },
+            'output': { n: 'Real' for n in OUTPUT_NAMES }
+            }
+        self.translation_table = {
+            'input': { 'ElmTr2_trafo1_nntap': 'ElmTr2.trafo1.nntap' },
+            'output': { n: n for n in OUTPUT_NAMES }
+            }
+        self.adjust_var_table()
+        self.output_attrs = self.get_output_attrs()
+        self.counts = ROUND_TRIPS.setdefault( self.variant, { 'step': 0 } )
+        return self.meta
+
+    def create( self, num, model ):
+        entities = []
+        for i in range(num):
+            eid = '{}_{}'.format( model, i )
+            self._entities[eid] = StandInPowerSystemFMU()
+            self.subscriptions[eid] = set()
+            self.fmutimes[eid] = 0
+            entities.append( { 'eid': eid, 'type': model, 'rel': [] } )
+        return entities
+
+    def step( self, time, inputs, max_advance=None ):
+        self.counts['step'] += 1
+        return super().step( time, inputs, max_advance )
+
+
+class LegacyPowerSystem(CountingPowerSystem):
+    '''Same as above, but stepped in every mosaik tick like the original implementation.'''
+
+    variant = 'fixed-increment'
+
+    def next_step_time( self, time ):
+        return time + 1
+
+
+class TapSource(mosaik_api_v3.Simulator):
+    '''Sends a new tap position periodically (like LSS2PeriodicController).'''
+
+    def __init__( self ):
+        super().__init__( {
+            'type': 'hybrid',
+            'models': { 'TapSource': { 'public': True, 'params': [ 'period', 'phase_shift' ], 'attrs': [ 'tap' ] } }
+            } )
+        self.tap = None
+
+    def create( self, num, model, period, phase_shift ):
+        self.period = period
+        self.next_send_time = phase_shift
+        return [ { 'eid': 'TapSource_0', 'type': model } ]
+
+    def step( self, time, inputs, max_advance=None ):
+        if time == self.next_send_time:
+            self.tap = 0
+            self.next_send_time += self.period
+            return time + 1
+        self.tap = None
+        return self.next_send_time
+
+    def get_data( self, outputs ):
+        return { 'TapSource_0': { 'tap': self.tap } if self.tap is not None else {} }
+
+
+def run( sim_name, stop, mt_per_sec ):
+    world = mosaik.World( SIM_CONFIG )
+
+    loadflow_sim = world.start( sim_name, step_size=1*mt_per_sec, seconds_per_mosaik_timestep=1./mt_per_sec )
+    loadflow = loadflow_sim.LSS2PowerSystem.create(1)[0]
+
+    tap_sim = world.start( 'TapSim' )
+    tap_source = tap_sim.TapSource( period=60*mt_per_sec, phase_shift=1*mt_per_sec )
+
+    world.connect( tap_source, loadflow, 'tap', time_shifted=True, initial_data={ 'tap': 0 } )
+
+    start = timer.perf_counter()
+    world.run( until=stop, print_progress=False )
+    return timer.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser( description='Benchmark mosaik round trips of LSS2PowerSystem' )
+    parser.add_argument( '--hours', type=float, help='simulated time in hours', default=24 )
+    parser.add_argument( '--mt_per_sec', type=int, help='mosaik time steps per second', default=10 )
+    args = parser.parse_args()
+
+    stop = int( args.hours*3600*args.mt_per_sec )
+
+    wall_times = {
+        'fixed-increment': run( 'LegacyLoadFlowSim', stop, args.mt_per_sec ),
+        'event-driven': run( 'LoadFlowSim', stop, args.mt_per_sec )
+        }
+
+    print( '{:<16} {:>12} {:>12}'.format( 'stepping', 'steps', 'wall time/s' ) )
+    for variant, wall_time in wall_times.items():
+        print( '{:<16} {:>12} {:>12.2f}'.format( variant, ROUND_TRIPS[variant]['step'], wall_time ) )
+
+    reduction = ROUND_TRIPS['fixed-increment']['step'] / ROUND_TRIPS['event-driven']['step']
+    print( 'reduction of mosaik round trips: {:.1f}x'.format( reduction ) )
+
+
+if __name__ == '__main__':
+    main()
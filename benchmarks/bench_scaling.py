@@ -0,0 +1,282 @@
+"""
+    Scaling benchmark of synthetic LSS2-style scenarios.
+
+    Each scenario has M feeders, each with a power system with N measurement points, N periodic
+    senders (one per measurement point), a communication network with N devices and a controller.
+    All voltages, tap positions and pending messages are recorded by the collector. Each scenario
+    is run in a fresh process, which reports the wall time, the number of steps and the mean step
+    time per simulator and the peak memory (resident set size) of the process.
+
+    The PowerFactory FMU is replaced by a stand-in object (used by the original LSS2PowerSystem
+    adapter) and the ns-3 network by a stand-in simulator that delivers each message after a
+    fixed delay, i.e., the numbers reflect the cost of the co-simulation glue (mosaik, adapters,
+    senders, controller and collector).
+
+    Usage:
+        python benchmarks/bench_scaling.py --points 7 48 192 1000 --feeders 1 4 16 --hours=1
+"""
+
+import argparse
+import collections
+import csv
+import heapq
+import math
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time as timer
+
+sys.path.insert( 0, os.path.abspath( os.path.join( os.path.dirname( __file__ ), os.pardir ) ) )
+
+import mosaik
+import mosaik_api_v3
+
+from collector import Collector
+from lss2_controller_backends import INPUT_NAMES
+from lss2_periodic_controller_matlab_fmu import LSS2PeriodicController
+from lss2_powersystem_pf_fmu import LSS2PowerSystem
+from periodic_sender import PeriodicSender
+
+
+# Status fmiOK of the FMI 1.0 standard (returned by the stand-in FMU).
+FMI_OK = 0
+
+# Number of steps and time spent in step and get_data, indexed by simulator.
+STATS = collections.defaultdict( lambda: { 'step': 0, 'step_time': 0., 'get_data': 0, 'get_data_time': 0. } )
+
+
+def timed( cls, name ):
+    '''Returns a subclass of a simulator class that accumulates the time spent in step and get_data.'''
+
+    class TimedSimulator(cls):
+
+        def step( self, time, inputs, max_advance=None ):
+            start = timer.perf_counter()
+            next_step = super().step( time, inputs, max_advance )
+            stats = STATS[name]
+            stats['step'] += 1
+            stats['step_time'] += timer.perf_counter() - start
+            return next_step
+
+        def get_data( self, outputs ):
+            start = timer.perf_counter()
+            data = super().get_data( outputs )
+            stats = STATS[name]
+            stats['get_data'] += 1
+            stats['get_data_time'] += timer.perf_counter() - start
+            return data
+
+    TimedSimulator.__name__ = cls.__name__
+    return TimedSimulator
+
+
+class StandInPowerSystemFMU(object):
+    '''Replaces the PowerFactory FMU: the voltages vary slowly over time and drop with each tap step.'''
+
+    def __init__( self, index ):
+        self.index = index
+        self.time = 0.
+        self.tap = 0
+
+    def instantiate( self, *args ): return FMI_OK
+    def initialize( self, *args ): return FMI_OK
+
+    def doStep( self, t, dt, new_step ):
+        self.time = t + dt
+        return FMI_OK
+
+    def setIntegerValue( self, name, val ):
+        self.tap = val
+        return FMI_OK
+
+    def getRealValue( self, name ):
+        j = self.index[name]
+        return 1. + 0.06*math.sin( self.time/900. + j ) - 0.025*self.tap
+
+
+class StandInPowerSystem(LSS2PowerSystem):
+    '''LSS2PowerSystem using stand-in FMUs with *n_points* bus voltages (attributes U_m0, U_m1, ...).'''
+
+    def init( self, sid, step_size, n_points, seconds_per_mosaik_timestep=1, time_resolution=1. ):
+        output_names = [ 'ElmTerm_bus_m{}_m:u'.format( j ) for j in range( n_points ) ]
+        self.step_size = step_size
+        self.sec_per_mt = seconds_per_mosaik_timestep
+        self.var_table = {
+            'input': { 'ElmTr2.trafo1.nntap': 'Integer' },
+            'output': { n: 'Real' for n in output_names }
+            }
+        self.translation_table = {
+            'input': { 'ElmTr2_trafo1_nntap': 'ElmTr2.trafo1.nntap' },
+            'output': { n: n for n in output_names }
+            }
+        self.adjust_var_table()
+        self.output_attrs = self.get_output_attrs()
+        self.meta['models']['LSS2PowerSystem']['attrs'] += sorted( self.output_attrs.keys() )
+        self.point_index = { n: j for j, n in enumerate( output_names ) }
+        return self.meta
+
+    def new_fmu( self ):
+        return StandInPowerSystemFMU( self.point_index )
+
+
+class StandInCommNetwork(mosaik_api_v3.Simulator):
+    '''Replaces the ns-3 network: messages sent by device j (attribute dev<j>_send) are delivered after
+    *delay* mosaik time steps. Delivered messages are output as dict (attribute *received*, mapping the
+    message names to their values) and the number of messages in transit as *pending_messages*.'''
+
+    def __init__( self ):
+        super().__init__( { 'type': 'hybrid', 'models': {} } )
+        self.eids = []
+        self.queue = []             # (delivery time, message count, entity, name, value)
+        self.pending = {}           # number of messages in transit per entity
+        self.received = {}          # messages delivered in the current step per entity
+        self.count = 0
+
+    def init( self, sid, n_devices, delay, message_names, time_resolution=1. ):
+        sends = [ 'dev{}_send'.format( j ) for j in range( n_devices ) ]
+        self.meta['models']['StandInCommNetwork'] = {
+            'public': True, 'params': [], 'attrs': sends + [ 'received', 'pending_messages' ],
+            'trigger': sends, 'non-persistent': [ 'received' ],
+            }
+        self.delay = delay
+        self.message_names = { send: name for send, name in zip( sends, message_names ) }
+        return self.meta
+
+    def create( self, num, model ):
+        eids = [ '{}_{}'.format( model, len( self.eids ) + i ) for i in range( num ) ]
+        for eid in eids:
+            self.pending[eid] = 0
+            self.received[eid] = {}
+        self.eids.extend( eids )
+        return [ { 'eid': eid, 'type': model } for eid in eids ]
+
+    def step( self, time, inputs, max_advance=None ):
+        for eid in self.received: self.received[eid] = {}
+        for eid, attrs in inputs.items():
+            for send, values in attrs.items():
+                for value in values.values():
+                    if value is None: continue
+                    self.count += 1
+                    heapq.heappush( self.queue, ( time + self.delay, self.count, eid, self.message_names[send], value ) )
+                    self.pending[eid] += 1
+
+        while self.queue and self.queue[0][0] <= time:
+            _, _, eid, name, value = heapq.heappop( self.queue )
+            self.received[eid][name] = value
+            self.pending[eid] -= 1
+
+        return self.queue[0][0] if self.queue else None
+
+    def get_data( self, outputs ):
+        data = {}
+        for eid, attrs in outputs.items():
+            data[eid] = {}
+            for attr in attrs:
+                if attr == 'pending_messages':
+                    data[eid][attr] = self.pending[eid]
+                elif attr == 'received' and self.received[eid]:
+                    data[eid][attr] = self.received[eid]
+        return data
+
+
+PowerSystem = timed( StandInPowerSystem, 'PowerSystem' )
+CommNetwork = timed( StandInCommNetwork, 'CommNetwork' )
+Controller = timed( LSS2PeriodicController, 'Controller' )
+Sender = timed( PeriodicSender, 'PeriodicSender' )
+Monitor = timed( Collector, 'Collector' )
+
+SIM_CONFIG = { name: { 'python': '{}:{}'.format( __name__, name ) }
+    for name in [ 'PowerSystem', 'CommNetwork', 'Controller', 'Sender', 'Monitor' ] }
+
+
+def run_scenario( n_points, n_feeders, args, output_file ):
+    mt_per_sec = args.mt_per_sec
+    stop = int( args.hours*3600*mt_per_sec )
+    world = mosaik.World( SIM_CONFIG, skip_greetings=True )
+
+    # Measurement point j is read by controller input u_line<j % 7 + 1>.
+    message_names = [ INPUT_NAMES[j % len( INPUT_NAMES )] for j in range( n_points ) ]
+    voltages = [ 'U_m{}'.format( j ) for j in range( n_points ) ]
+
+    loadflows = world.start( 'PowerSystem', step_size=mt_per_sec, n_points=n_points,
+        seconds_per_mosaik_timestep=1./mt_per_sec ).LSS2PowerSystem.create( n_feeders )
+    comm_networks = world.start( 'CommNetwork', n_devices=n_points, delay=max( 1, int( args.delay*mt_per_sec ) ),
+        message_names=message_names ).StandInCommNetwork.create( n_feeders )
+    ctrls = world.start( 'Controller', dead_time=1, seconds_per_mosaik_timestep=1./mt_per_sec,
+        backend='numpy' ).LSS2PeriodicController.create( n_feeders, period=args.period, phase_shift=1. )
+    senders = world.start( 'Sender', seed=1 ).PeriodicSender.create( n_points*n_feeders,
+        period=int( args.period*mt_per_sec ), jitter=int( args.jitter*mt_per_sec ) )
+    monitor = world.start( 'Monitor', step_size=mt_per_sec, seconds_per_mosaik_timestep=1./mt_per_sec,
+        print_results=False, h5_storename=output_file, mode=args.collector_mode ).Monitor()
+
+    for f in range( n_feeders ):
+        for j, voltage in enumerate( voltages ):
+            sender = senders[f*n_points + j]
+            world.connect( loadflows[f], sender, ( voltage, 'in' ) )
+            world.connect( sender, comm_networks[f], ( 'out', 'dev{}_send'.format( j ) ) )
+        world.connect( comm_networks[f], ctrls[f], ( 'received', 'readings' ) )
+        world.connect( ctrls[f], loadflows[f], ( 'tap', 'tap' ), time_shifted=True )
+
+        world.connect( loadflows[f], monitor, *voltages, 'current_tap' )
+        world.connect( comm_networks[f], monitor, 'pending_messages' )
+
+    start = timer.perf_counter()
+    world.run( until=stop, print_progress=False )
+    return timer.perf_counter() - start
+
+
+def run_point( n_points, n_feeders, args ):
+    '''Runs one scenario (in a fresh process) and returns its measurements.'''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        wall_time = run_scenario( n_points, n_feeders, args, os.path.join( tmp_dir, 'results.h5' ) )
+    peak_memory = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss / 1024. # in MB (Linux: ru_maxrss in kB)
+    return { 'points': n_points, 'feeders': n_feeders, 'wall_time': wall_time, 'peak_memory': peak_memory,
+        'stats': { name: dict( stats ) for name, stats in STATS.items() } }
+
+
+def main():
+    parser = argparse.ArgumentParser( description='Benchmark the scaling of synthetic LSS2-style scenarios' )
+    parser.add_argument( '--points', type=int, nargs='+', help='numbers of measurement points (and senders and comm devices) per feeder', default=[ 7, 48, 192 ] )
+    parser.add_argument( '--feeders', type=int, nargs='+', help='numbers of feeders', default=[ 1, 4 ] )
+    parser.add_argument( '--hours', type=float, help='simulated time in hours', default=1 )
+    parser.add_argument( '--mt_per_sec', type=int, help='mosaik time steps per second', default=1 )
+    parser.add_argument( '--period', type=float, help='sending period of the senders (and control period) in seconds', default=60 )
+    parser.add_argument( '--jitter', type=float, help='maximum random delay of each transmission in seconds', default=0 )
+    parser.add_argument( '--delay', type=float, help='delay of each message in the communication network in seconds', default=0.1 )
+    parser.add_argument( '--collector_mode', type=str, choices=[ 'dense', 'events' ], default='dense' )
+    parser.add_argument( '--csv', type=str, help='write the measurements to this file', default=None )
+    args = parser.parse_args()
+
+    sims = [ 'PowerSystem', 'PeriodicSender', 'CommNetwork', 'Controller', 'Collector' ]
+    print( '{:>7} {:>7} {:>10} {:>9}  {}'.format( 'points', 'feeders', 'wall [s]', 'peak [MB]',
+        '  '.join( '{:>22}'.format( sim + ' [ms]' ) for sim in sims ) ) )
+
+    rows = []
+    context = multiprocessing.get_context( 'spawn' )
+    for n_feeders in args.feeders:
+        for n_points in args.points:
+            with context.Pool( 1 ) as pool:
+                result = pool.apply( run_point, ( n_points, n_feeders, args ) )
+
+            row = { 'points': n_points, 'feeders': n_feeders, 'wall_time': result['wall_time'], 'peak_memory': result['peak_memory'] }
+            cells = []
+            for sim in sims:
+                stats = result['stats'].get( sim, { 'step': 0, 'step_time': 0. } )
+                mean = 1e3*stats['step_time']/stats['step'] if stats['step'] else 0.
+                row[sim + '_steps'] = stats['step']
+                row[sim + '_step_time'] = mean
+                cells.append( '{:>22}'.format( '{:d} x {:.3f}'.format( stats['step'], mean ) ) )
+            rows.append( row )
+            print( '{:>7} {:>7} {:>10.2f} {:>9.1f}  {}'.format( n_points, n_feeders, row['wall_time'], row['peak_memory'], '  '.join( cells ) ), flush=True )
+
+    if args.csv is not None:
+        with open( args.csv, 'w', newline='' ) as f:
+            writer = csv.DictWriter( f, fieldnames=list( rows[0].keys() ) )
+            writer.writeheader()
+            writer.writerows( rows )
+
+
+if __name__ == '__main__':
+    main()
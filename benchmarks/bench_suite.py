@@ -0,0 +1,192 @@
+"""
+    Hermetic benchmark suite of the LSS2 simulators.
+
+    The simulators are run with the stand-in FMUs (see build_standin_fmus.py), which are built
+    from their C sources into a temporary directory, i.e., neither PowerFactory, MATLAB nor ns-3
+    are needed. The suite measures the overhead per step of the adapters (mosaik API calls of one
+    simulator, driven directly without mosaik) and the wall time of complete scenarios. Each
+    benchmark is repeated and the median is reported. LSS2CommNetwork runs in Python 2, its
+    benchmark (see bench_comm_step.py) is run with the interpreter given by option --python2 and
+    skipped if there is none.
+
+    The results can be stored as baseline (--save_baseline). Subsequent runs are compared to the
+    baseline and results that are slower by more than the tolerance are flagged as regressions
+    (the exit status is 1 in this case). Baselines are only meaningful on the machine they have
+    been recorded on.
+
+    Usage:
+        python benchmarks/bench_suite.py --save_baseline
+        python benchmarks/bench_suite.py --tolerance=0.2
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time as timer
+
+sys.path.insert( 0, os.path.abspath( os.path.join( os.path.dirname( __file__ ), os.pardir ) ) )
+
+import build_standin_fmus
+import lss2_scenario
+from lss2_periodic_controller_matlab_fmu import LSS2PeriodicController
+from lss2_powersystem_pf_fmu import LSS2PowerSystem
+
+
+BENCH_DIR = os.path.dirname( os.path.abspath( __file__ ) )
+BASELINE = os.path.join( BENCH_DIR, 'baseline.json' )
+
+
+def bench_powersystem_step( fmu_dir, args ):
+    '''LSS2PowerSystem: step (load flow calculation) and get_data (all voltages), a new tap every 60 steps.'''
+    sim = LSS2PowerSystem()
+    sim.init( 'LoadFlowSim-0', work_dir=fmu_dir, model_name='LSS2_PowerSystem', instance_name='LoadFlow1', step_size=1 )
+    eid = sim.create( 1, 'LSS2PowerSystem' )[0]['eid']
+    outputs = { eid: sorted( sim.output_attrs ) + [ 'current_tap' ] }
+    sim.get_data( outputs )
+
+    start = timer.perf_counter()
+    for t in range( args.steps ):
+        inputs = { eid: { 'tap': { 'ControllerSim-0.Controller_0': t // 60 % 3 } } } if t % 60 == 1 else {}
+        sim.step( t, inputs )
+        sim.get_data( outputs )
+    return ( timer.perf_counter() - start ) / args.steps
+
+
+def bench_controller_step( fmu_dir, args ):
+    '''LSS2PeriodicController (backend matlab_fmu): readings in each step, a tap decision every 60 steps.'''
+    sim = LSS2PeriodicController()
+    sim.init( 'ControllerSim-0', work_dir=fmu_dir, model_name='LSS2_Controller', instance_name='Controller1',
+        dead_time=1, backend='matlab_fmu' )
+    eid = sim.create( 1, 'LSS2PeriodicController', period=60., phase_shift=1. )[0]['eid']
+    outputs = { eid: [ 'tap' ] }
+
+    start = timer.perf_counter()
+    for t in range( args.steps ):
+        readings = { 'u_line{}'.format( k ): 1. + 0.01*( ( t + k ) % 7 ) for k in range( 1, 8 ) }
+        sim.step( t, { eid: { 'readings': { 'PeriodicSender-0.Sender_0': readings } } } )
+        sim.get_data( outputs )
+    return ( timer.perf_counter() - start ) / args.steps
+
+
+def bench_comm_step( fmu_dir, args ):
+    '''LSS2CommNetwork: step and get_data (all received messages), each of 7 devices sends a message every 60 steps.'''
+    output = subprocess.run( [ args.python2, os.path.join( BENCH_DIR, 'bench_comm_step.py' ), '--fmu_dir', fmu_dir,
+        '--steps', str( args.steps ) ], check=True, stdout=subprocess.PIPE, universal_newlines=True ).stdout
+    return json.loads( output.splitlines()[-1] )['seconds_per_step']
+
+
+def bench_scenario_nocomm( fmu_dir, args ):
+    '''Scenario lss2_nocomm (ideal communication, controller backend matlab_fmu), one simulated hour.'''
+    config = lss2_scenario.load_config( os.path.join( lss2_scenario.BASE_DIR, 'scenarios', 'lss2_nocomm.json' ), [
+        ( 'fmu_dir', fmu_dir ), ( 'time.stop', 3600 ), ( 'controller.verbose', False ), ( 'feeders', args.feeders ) ] )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = timer.perf_counter()
+        lss2_scenario.run( config, output_file=os.path.join( tmp_dir, 'results.h5' ), mosaik_port=args.mosaik_port )
+        return timer.perf_counter() - start
+
+
+# Name -> (function, unit of the result, scale of the result for the report).
+BENCHMARKS = {
+    'powersystem_step': ( bench_powersystem_step, 'us/step', 1e6 ),
+    'controller_step': ( bench_controller_step, 'us/step', 1e6 ),
+    'comm_step': ( bench_comm_step, 'us/step', 1e6 ),
+    'scenario_nocomm': ( bench_scenario_nocomm, 's', 1. ),
+}
+
+
+def machine():
+    return { 'node': platform.node(), 'machine': platform.machine(), 'python': platform.python_version() }
+
+
+def copy_fmus( fmu_dir ):
+    '''Returns a new subdirectory of *fmu_dir* with copies of the FMU files. The adapters extract the FMUs
+    into their working directory, which must not overwrite the shared libraries loaded by a previous run.'''
+    work_dir = tempfile.mkdtemp( dir=fmu_dir )
+    for name in os.listdir( fmu_dir ):
+        if name.endswith( '.fmu' ): shutil.copy( os.path.join( fmu_dir, name ), work_dir )
+    return work_dir
+
+
+def run_benchmarks( names, fmu_dir, args ):
+    results = {}
+    for name in names:
+        func, unit, scale = BENCHMARKS[name]
+        func( copy_fmus( fmu_dir ), args ) # Warm-up (imports, caches).
+        values = [ func( copy_fmus( fmu_dir ), args )*scale for _ in range( args.repeat ) ]
+        results[name] = { 'value': statistics.median( values ), 'min': min( values ), 'unit': unit }
+    return results
+
+
+def compare( results, baseline, tolerance ):
+    '''Prints the results next to the baseline and returns the names of the regressions.'''
+    regressions = []
+    print( '{:<20} {:>12} {:>12} {:>8}  {}'.format( 'benchmark', 'median', 'baseline', 'ratio', 'unit' ) )
+    for name, result in results.items():
+        reference = baseline.get( 'results', {} ).get( name )
+        if reference is None:
+            print( '{:<20} {:>12.3f} {:>12} {:>8}  {}'.format( name, result['value'], '-', '-', result['unit'] ) )
+            continue
+        ratio = result['value'] / reference['value']
+        flag = ''
+        if ratio > 1. + tolerance:
+            flag = '  REGRESSION'
+            regressions.append( name )
+        print( '{:<20} {:>12.3f} {:>12.3f} {:>8.2f}  {}{}'.format( name, result['value'], reference['value'], ratio, result['unit'], flag ) )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser( description='Run the hermetic benchmark suite of the LSS2 simulators' )
+    parser.add_argument( '--benchmarks', type=str, nargs='+', choices=sorted( BENCHMARKS ), help='benchmarks to run (default: all)', default=list( BENCHMARKS ) )
+    parser.add_argument( '--repeat', type=int, help='number of repetitions of each benchmark', default=5 )
+    parser.add_argument( '--steps', type=int, help='number of steps of the adapter benchmarks', default=10000 )
+    parser.add_argument( '--feeders', type=int, help='number of feeders of the scenario benchmarks', default=1 )
+    parser.add_argument( '--python2', type=str, help='Python 2 interpreter of the LSS2CommNetwork benchmark', default='python2' )
+    parser.add_argument( '--mosaik_port', type=int, help='port of the mosaik server', default=5555 )
+    parser.add_argument( '--baseline', type=str, help='baseline file', default=BASELINE )
+    parser.add_argument( '--save_baseline', action='store_true', help='store the results as baseline' )
+    parser.add_argument( '--tolerance', type=float, help='relative slowdown flagged as regression', default=0.2 )
+    parser.add_argument( '--json', type=str, help='write the results to this file', default=None )
+    args = parser.parse_args()
+
+    if 'comm_step' in args.benchmarks and shutil.which( args.python2 ) is None:
+        print( 'Warning: benchmark comm_step is skipped, Python 2 interpreter {0} not found.'.format( args.python2 ) )
+        args.benchmarks.remove( 'comm_step' )
+
+    with tempfile.TemporaryDirectory() as fmu_dir:
+        build_standin_fmus.build( fmu_dir )
+        results = run_benchmarks( args.benchmarks, fmu_dir, args )
+
+    report = { 'machine': machine(), 'results': results }
+    if args.json is not None:
+        with open( args.json, 'w' ) as f:
+            json.dump( report, f, indent=2 )
+
+    baseline = {}
+    if os.path.exists( args.baseline ):
+        with open( args.baseline ) as f:
+            baseline = json.load( f )
+        if baseline.get( 'machine' ) != report['machine']:
+            print( 'Warning: baseline was recorded on a different machine ({0}).'.format( baseline.get( 'machine' ) ) )
+
+    regressions = compare( results, baseline, args.tolerance )
+
+    if args.save_baseline:
+        # Benchmarks that have not been run keep their previous baseline.
+        merged = dict( baseline.get( 'results', {} ), **results )
+        with open( args.baseline, 'w' ) as f:
+            json.dump( { 'machine': report['machine'], 'results': merged }, f, indent=2 )
+        print( 'Baseline saved to {0}'.format( args.baseline ) )
+    elif regressions:
+        print( 'Regressions (more than {0:.0%} slower than baseline): {1}'.format( args.tolerance, ', '.join( regressions ) ) )
+        sys.exit( 1 )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+    Builds the stand-in FMUs (FMI 1.0 for co-simulation, Linux) from the C sources in subfolder
+    *standin_fmus*. They have the same model names and variable interfaces as the FMUs exported
+    from PowerFactory, MATLAB and ns-3, i.e., the LSS2 simulators can be run with them (see
+    bench_suite.py) without any of these tools.
+
+    Usage:
+        python benchmarks/build_standin_fmus.py --out_dir=build/fmus
+"""
+
+import argparse
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import uuid
+import zipfile
+import xml.etree.ElementTree as ETree
+
+
+SOURCE_DIR = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), 'standin_fmus' )
+PF_FMU_DIR = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), os.pardir, 'fmus', 'pf_network_fmu' )
+
+MAX_DEVICE_COUNT = 100
+
+
+def read_names( filename ):
+    '''Returns the variable names listed in a PowerFactory FMU input/output file (comments start with ';').'''
+    names = []
+    with open( filename ) as f:
+        for line in f:
+            name = line.split( ';' )[0].strip()
+            if name: names.append( name )
+    return names
+
+
+def powersystem_variables():
+    # Same interface as the PowerFactory FMU (see fmus/pf_network_fmu/inputs.txt and outputs.txt).
+    inputs = read_names( os.path.join( PF_FMU_DIR, 'inputs.txt' ) )
+    outputs = read_names( os.path.join( PF_FMU_DIR, 'outputs.txt' ) )
+    variables = [ ( name, 'input', 'Integer', k, 0 ) for k, name in enumerate( inputs ) ]
+    variables += [ ( name, 'output', 'Real', k, 1. ) for k, name in enumerate( outputs ) ]
+    return variables, { 'N_OUTPUTS': len( outputs ) }
+
+
+def controller_variables():
+    # Same interface as the controller FMU exported from MATLAB (see fmus/matlab_controller_fmu/LSS2_Controller.m).
+    names = [ 'u_line{}'.format( k ) for k in range( 1, 8 ) ] + [ 'vup', 'vlow' ]
+    variables = [ ( name, 'input', 'Real', k, 1. ) for k, name in enumerate( names ) ]
+    variables.append( ( 'tap', 'output', 'Integer', 0, 0 ) )
+    return variables, {}
+
+
+def comm_variables():
+    # Same interface as the ns-3 FMU (see fmus/ns3_comm_fmu/LSS2.cc and create_fmu.sh).
+    variables = [
+        ( 'verbose', 'parameter', 'Integer', 0, 0 ),
+        ( 'interfere', 'parameter', 'Integer', 1, 1 ),
+        ( 'divide_by', 'parameter', 'Integer', 2, 0 ),
+        ( 'n_devices', 'parameter', 'Integer', 3, 20 ),
+        ( 'random_seed', 'parameter', 'Integer', 4, 1 ),
+        ( 'min_jitter', 'parameter', 'Real', 0, 0. ),
+        ( 'max_jitter', 'parameter', 'Real', 1, 0.01 ),
+        ( 'default_event_step_size', 'parameter', 'Real', 2, 0. ),
+        ( 'max_device_delay', 'output', 'Real', 3, 0. ),
+        ( 'next_event_time', 'output', 'Real', 4, 0. ),
+        ]
+    for k in range( MAX_DEVICE_COUNT ):
+        variables.append( ( 'device{}_data_send'.format( k ), 'input', 'Integer', 5 + k, 0 ) )
+        variables.append( ( 'device{}_data_receive'.format( k ), 'output', 'Integer', 5 + MAX_DEVICE_COUNT + k, 0 ) )
+    return variables, { 'MAX_DEVICE_COUNT': MAX_DEVICE_COUNT }
+
+
+# Model name -> function returning the variables (name, causality, type, value reference, start value)
+# and the preprocessor definitions of the model source.
+MODELS = {
+    'LSS2_PowerSystem': powersystem_variables,
+    'LSS2_Controller': controller_variables,
+    'LSS2_SimICT': comm_variables,
+}
+
+
+def model_description( model_name, variables ):
+    '''Returns the model description (FMI 1.0 for co-simulation) of a stand-in FMU.'''
+    root = ETree.Element( 'fmiModelDescription', {
+        'fmiVersion': '1.0', 'modelName': model_name, 'modelIdentifier': model_name,
+        'guid': '{{{}}}'.format( uuid.uuid5( uuid.NAMESPACE_URL, 'lss2-standin/' + model_name ) ),
+        'description': 'Stand-in for benchmarks (see benchmarks/standin_fmus)',
+        'generationTool': 'build_standin_fmus.py', 'numberOfContinuousStates': '0', 'numberOfEventIndicators': '0',
+        } )
+    model_variables = ETree.SubElement( root, 'ModelVariables' )
+    for name, causality, var_type, value_reference, start in variables:
+        attrs = { 'name': name, 'valueReference': str( value_reference ) }
+        if causality == 'parameter':
+            # In FMI 1.0, parameters have causality 'internal'.
+            attrs.update( variability='parameter', causality='internal' )
+        else:
+            attrs.update( variability='discrete', causality=causality )
+        var = ETree.SubElement( model_variables, 'ScalarVariable', attrs )
+        ETree.SubElement( var, var_type, { 'start': str( start ) } )
+
+    # The original FMUs are tool coupling FMUs (the FMI adapter of the Python 2 version requires this element).
+    tool = ETree.SubElement( ETree.SubElement( root, 'Implementation' ), 'CoSimulation_Tool' )
+    ETree.SubElement( tool, 'Capabilities', {
+        'canHandleVariableCommunicationStepSize': 'true', 'canHandleEvents': 'true', 'canRejectSteps': 'false',
+        'canInterpolateInputs': 'false', 'maxOutputDerivativeOrder': '0', 'canRunAsynchronuously': 'false',
+        'canSignalEvents': 'false', 'canBeInstantiatedOnlyOncePerProcess': 'false',
+        'canNotUseMemoryManagementFunctions': 'true',
+        } )
+    ETree.SubElement( tool, 'Model', { 'entryPoint': 'fmu://resources', 'manualStart': 'false',
+        'type': 'application/x-lss2-standin' } )
+
+    ETree.indent( root )
+    return ETree.tostring( root, encoding='unicode', xml_declaration=True )
+
+
+def platform_dir():
+    if not sys.platform.startswith( 'linux' ):
+        raise RuntimeError( 'The stand-in FMUs can only be built on Linux (platform: {0}).'.format( sys.platform ) )
+    return 'linux64' if 8 == struct.calcsize( 'P' ) else 'linux32'
+
+
+def build_fmu( model_name, out_dir, cc=None ):
+    '''Compiles the source of a stand-in FMU and packs it into <out_dir>/<model_name>.fmu.'''
+    variables, defines = MODELS[model_name]()
+    cc = cc or os.environ.get( 'CC', 'cc' )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        binary_dir = os.path.join( tmp_dir, 'binaries', platform_dir() )
+        os.makedirs( binary_dir )
+        os.makedirs( os.path.join( tmp_dir, 'resources' ) )
+        library = os.path.join( binary_dir, model_name + '.so' )
+
+        command = [ cc, '-shared', '-fPIC', '-O2', '-std=gnu99', '-fvisibility=hidden',
+            '-DMODEL_IDENTIFIER={0}'.format( model_name ) ]
+        command += [ '-D{0}={1}'.format( name, value ) for name, value in sorted( defines.items() ) ]
+        command += [ '-I', SOURCE_DIR, '-o', library, os.path.join( SOURCE_DIR, model_name + '.c' ), '-lm' ]
+        result = subprocess.run( command, capture_output=True, text=True )
+        if result.returncode != 0:
+            raise RuntimeError( 'Failed to compile {0}:\n{1}'.format( model_name, result.stderr ) )
+
+        with open( os.path.join( tmp_dir, 'modelDescription.xml' ), 'w' ) as f:
+            f.write( model_description( model_name, variables ) )
+
+        fmu_path = os.path.join( out_dir, model_name + '.fmu' )
+        with zipfile.ZipFile( fmu_path + '.tmp', 'w', zipfile.ZIP_DEFLATED ) as fmu:
+            for path, _, files in os.walk( tmp_dir ):
+                for name in files:
+                    filename = os.path.join( path, name )
+                    fmu.write( filename, os.path.relpath( filename, tmp_dir ) )
+        os.replace( fmu_path + '.tmp', fmu_path )
+
+    return fmu_path
+
+
+def build( out_dir, models=None, cc=None ):
+    '''Builds the stand-in FMUs (all by default) and returns the paths of the FMU files. Previously
+    extracted FMUs in *out_dir* are removed, so that the adapters extract the new ones.'''
+    os.makedirs( out_dir, exist_ok=True )
+    fmus = []
+    for model_name in models or sorted( MODELS ):
+        shutil.rmtree( os.path.join( out_dir, model_name ), ignore_errors=True )
+        fmus.append( build_fmu( model_name, out_dir, cc ) )
+    return fmus
+
+
+def main():
+    parser = argparse.ArgumentParser( description='Build the stand-in FMUs for benchmarks' )
+    parser.add_argument( '--out_dir', type=str, help='output directory', default=os.path.join( 'build', 'fmus' ) )
+    parser.add_argument( '--models', type=str, nargs='+', choices=sorted( MODELS ), default=None )
+    parser.add_argument( '--cc', type=str, help='C compiler (default: $CC or cc)', default=None )
+    args = parser.parse_args()
+
+    for fmu_path in build( args.out_dir, args.models, args.cc ):
+        print( 'built {}'.format( fmu_path ) )
+
+
+if __name__ == '__main__':
+    main()
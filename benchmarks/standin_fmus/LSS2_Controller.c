@@ -0,0 +1,39 @@
+/*
+	Stand-in for the controller FMU exported from MATLAB (LSS2_Controller, see
+	fmus/matlab_controller_fmu/LSS2_Controller.m).
+
+	Real inputs 0 to 6 are the voltage readings (u_line1 to u_line7), 7 and 8 the limits (vup,
+	vlow), integer output 0 is the tap position. Steps of size zero decide on the tap position:
+	it is increased if the maximum reading exceeds vup and decreased if the minimum falls below
+	vlow. Steps of non-zero size do not change the state (like the MATLAB implementation).
+*/
+
+#define N_LINES 7
+#define N_REALS ( N_LINES + 2 )
+#define N_INTEGERS 1
+
+#define VUP N_LINES
+#define VLOW ( N_LINES + 1 )
+#define TAP 0
+
+struct ModelState { int unused; };
+
+#include "standin_fmu.c"
+
+
+static void model_initialize( ModelInstance* m ) {}
+
+static fmiStatus model_do_step( ModelInstance* m, fmiReal t, fmiReal h )
+{
+	if ( 0. != h ) return fmiOK;
+
+	fmiReal umin = m->r[0], umax = m->r[0];
+	for ( int k = 1; k < N_LINES; ++k ) {
+		if ( m->r[k] < umin ) umin = m->r[k];
+		if ( m->r[k] > umax ) umax = m->r[k];
+	}
+
+	if ( umax > m->r[VUP] ) m->i[TAP] += 1;
+	if ( umin < m->r[VLOW] ) m->i[TAP] -= 1;
+	return fmiOK;
+}
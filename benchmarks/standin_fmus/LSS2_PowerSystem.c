@@ -0,0 +1,45 @@
+/*
+	Stand-in for the PowerFactory FMU of the LSS2 network (LSS2_PowerSystem).
+
+	Integer input 0 is the tap position of the transformer (ElmTr2.trafo1.nntap), real outputs
+	0 to N_OUTPUTS-1 are the bus voltages (ElmTerm.<bus>.m:u, in the order of outputs.txt). Each
+	call of fmiDoStep computes a "load flow" for the end of the step: the voltages follow a daily
+	load cycle (larger amplitude at the end of the feeder) plus a fast fluctuation and drop by
+	2.5 % per tap step.
+*/
+
+#include <math.h>
+
+#ifndef N_OUTPUTS
+#define N_OUTPUTS 7
+#endif
+
+#define N_REALS N_OUTPUTS
+#define N_INTEGERS 1
+
+#define TAP 0
+
+struct ModelState { int unused; };
+
+#include "standin_fmu.c"
+
+
+static void load_flow( ModelInstance* m, fmiReal t )
+{
+	const fmiReal day = 2.*M_PI*t/86400.;
+	for ( int k = 0; k < N_OUTPUTS; ++k ) {
+		fmiReal amplitude = 0.07*( k + 1 )/N_OUTPUTS;
+		m->r[k] = 1. + amplitude*sin( day ) + 0.01*sin( t/300. + k ) - 0.025*m->i[TAP];
+	}
+}
+
+static void model_initialize( ModelInstance* m )
+{
+	load_flow( m, m->time );
+}
+
+static fmiStatus model_do_step( ModelInstance* m, fmiReal t, fmiReal h )
+{
+	load_flow( m, t + h );
+	return fmiOK;
+}
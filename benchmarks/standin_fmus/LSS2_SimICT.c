@@ -0,0 +1,158 @@
+/*
+	Stand-in for the ns-3 FMU of the communication network (LSS2_SimICT, see fmus/ns3_comm_fmu/LSS2.cc).
+
+	The variable interface is the one of the ns-3 FMU: integer parameters verbose, interfere,
+	divide_by, n_devices and random_seed, real parameters min_jitter, max_jitter and
+	default_event_step_size, integer inputs device<i>_data_send and outputs device<i>_data_receive
+	(i < MAX_DEVICE_COUNT) and real outputs max_device_delay and next_event_time.
+
+	Like the ns-3 FMU, the network is simulated for each round of messages: all devices whose input
+	has been set to a non-zero message ID since the last step send at the current time. Instead of
+	simulating the WiFi networks, the end-to-end delay of a message is a fixed base delay plus one
+	slot per device that sent before it within the same WiFi (if interference is turned on), plus
+	a fixed random jitter per device. The delivery of a message is an event: when it is reached,
+	output device<i>_data_receive is set to the message ID until the next step of non-zero size.
+	Output next_event_time holds the time of the next event.
+*/
+
+#include <float.h>
+#include <math.h>
+
+#ifndef MAX_DEVICE_COUNT
+#define MAX_DEVICE_COUNT 100
+#endif
+
+#define QUEUE_CAPACITY ( 64*MAX_DEVICE_COUNT )
+
+#define BASE_DELAY 2e-3     /* delay of an undisturbed message in seconds */
+#define SLOT 1e-3           /* additional delay per preceding message in the same WiFi in seconds */
+
+/* Integer variables */
+#define VERBOSE 0
+#define INTERFERE 1
+#define DIVIDE_BY 2
+#define N_DEVICES 3
+#define RANDOM_SEED 4
+#define DATA_SEND 5
+#define DATA_RECEIVE ( DATA_SEND + MAX_DEVICE_COUNT )
+#define N_INTEGERS ( DATA_RECEIVE + MAX_DEVICE_COUNT )
+
+/* Real variables */
+#define MIN_JITTER 0
+#define MAX_JITTER 1
+#define DEFAULT_EVENT_STEP_SIZE 2
+#define MAX_DEVICE_DELAY 3
+#define NEXT_EVENT_TIME 4
+#define N_REALS 5
+
+typedef struct {
+	double time;
+	int device;
+	int msg_id;
+} Event;
+
+struct ModelState {
+	double jitter[MAX_DEVICE_COUNT];
+	Event queue[QUEUE_CAPACITY];    /* binary heap of pending deliveries ordered by time */
+	int queue_size;
+};
+
+#include "standin_fmu.c"
+
+
+static void push_event( struct ModelState* s, Event e )
+{
+	int k = s->queue_size++;
+	while ( k > 0 ) {
+		int parent = ( k - 1 )/2;
+		if ( s->queue[parent].time <= e.time ) break;
+		s->queue[k] = s->queue[parent];
+		k = parent;
+	}
+	s->queue[k] = e;
+}
+
+static Event pop_event( struct ModelState* s )
+{
+	Event top = s->queue[0];
+	Event last = s->queue[--s->queue_size];
+	int k = 0;
+	for (;;) {
+		int child = 2*k + 1;
+		if ( child >= s->queue_size ) break;
+		if ( child + 1 < s->queue_size && s->queue[child + 1].time < s->queue[child].time ) ++child;
+		if ( last.time <= s->queue[child].time ) break;
+		s->queue[k] = s->queue[child];
+		k = child;
+	}
+	s->queue[k] = last;
+	return top;
+}
+
+static int n_devices( ModelInstance* m )
+{
+	int n = m->i[N_DEVICES];
+	return n < 0 ? 0 : ( n > MAX_DEVICE_COUNT ? MAX_DEVICE_COUNT : n );
+}
+
+static void update_next_event_time( ModelInstance* m, fmiReal now )
+{
+	fmiReal next = m->state.queue_size ? m->state.queue[0].time : DBL_MAX;
+	fmiReal step = m->r[DEFAULT_EVENT_STEP_SIZE];
+	if ( step > 0. ) {
+		fmiReal next_default = ( floor( now/step + 1e-9 ) + 1. )*step;
+		if ( next_default < next ) next = next_default;
+	}
+	m->r[NEXT_EVENT_TIME] = next;
+}
+
+static void model_initialize( ModelInstance* m )
+{
+	// Fixed jitter per device (linear congruential generator seeded with parameter random_seed).
+	unsigned long long x = ( unsigned long long ) ( m->i[RANDOM_SEED] ? m->i[RANDOM_SEED] : 1 );
+	for ( int k = 0; k < MAX_DEVICE_COUNT; ++k ) {
+		x = 6364136223846793005ULL*x + 1442695040888963407ULL;
+		double u = ( x >> 11 )*( 1./9007199254740992. );
+		m->state.jitter[k] = m->r[MIN_JITTER] + u*( m->r[MAX_JITTER] - m->r[MIN_JITTER] );
+	}
+	m->state.queue_size = 0;
+	update_next_event_time( m, m->time );
+}
+
+static fmiStatus model_do_step( ModelInstance* m, fmiReal t, fmiReal h )
+{
+	struct ModelState* s = &m->state;
+	const fmiReal sync_time = t + h;
+	const int n = n_devices( m );
+
+	// Received messages are output until the next step of non-zero size.
+	if ( h > 0. ) memset( &m->i[DATA_RECEIVE], 0, MAX_DEVICE_COUNT*sizeof( fmiInteger ) );
+
+	// Deliver the messages that have arrived until the end of the step.
+	while ( s->queue_size && s->queue[0].time <= sync_time + 1e-9 ) {
+		Event e = pop_event( s );
+		m->i[DATA_RECEIVE + e.device] = e.msg_id;
+	}
+
+	// Simulate the network for a new round of messages.
+	int divide_by = m->i[DIVIDE_BY] > 0 ? m->i[DIVIDE_BY] : ( n > 0 ? n : 1 );
+	int sent_in_wifi[MAX_DEVICE_COUNT] = { 0 };
+	fmiReal max_delay = -1.;
+	for ( int k = 0; k < n; ++k ) {
+		if ( !m->integer_set[DATA_SEND + k] || 0 == m->i[DATA_SEND + k] ) continue;
+		if ( s->queue_size == QUEUE_CAPACITY ) return fmiError;
+
+		int wifi = k/divide_by;
+		fmiReal delay = BASE_DELAY + s->jitter[k];
+		if ( m->i[INTERFERE] ) delay += SLOT*sent_in_wifi[wifi];
+		++sent_in_wifi[wifi];
+		if ( delay > max_delay ) max_delay = delay;
+
+		Event e = { sync_time + delay, k, m->i[DATA_SEND + k] };
+		push_event( s, e );
+	}
+	if ( max_delay >= 0. ) m->r[MAX_DEVICE_DELAY] = max_delay;
+
+	update_next_event_time( m, sync_time );
+	return fmiOK;
+}
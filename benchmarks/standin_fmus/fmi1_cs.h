@@ -0,0 +1,78 @@
+/*
+	Types and function prototypes of the FMI 1.0 for Co-Simulation interface, as far as needed
+	by the stand-in FMUs (see standin_fmu.c). The functions are exported with the model identifier
+	as prefix (e.g., LSS2_PowerSystem_fmiDoStep), MODEL_IDENTIFIER has to be defined when compiling.
+*/
+
+#ifndef FMI1_CS_H
+#define FMI1_CS_H
+
+#include <stddef.h>
+
+#define fmiPlatform "standard32"
+#define fmiVersion "1.0"
+
+#define fmiTrue 1
+#define fmiFalse 0
+#define fmiUndefinedValueReference ( fmiValueReference )( -1 )
+
+typedef void* fmiComponent;
+typedef unsigned int fmiValueReference;
+typedef double fmiReal;
+typedef int fmiInteger;
+typedef char fmiBoolean;
+typedef const char* fmiString;
+
+typedef enum { fmiOK, fmiWarning, fmiDiscard, fmiError, fmiFatal, fmiPending } fmiStatus;
+typedef enum { fmiDoStepStatus, fmiPendingStatus, fmiLastSuccessfulTime } fmiStatusKind;
+
+typedef void ( *fmiCallbackLogger )( fmiComponent c, fmiString instanceName, fmiStatus status,
+	fmiString category, fmiString message, ... );
+typedef void* ( *fmiCallbackAllocateMemory )( size_t nobj, size_t size );
+typedef void ( *fmiCallbackFreeMemory )( void* obj );
+typedef void ( *fmiStepFinished )( fmiComponent c, fmiStatus status );
+
+typedef struct {
+	fmiCallbackLogger logger;
+	fmiCallbackAllocateMemory allocateMemory;
+	fmiCallbackFreeMemory freeMemory;
+	fmiStepFinished stepFinished;
+} fmiCallbackFunctions;
+
+#if defined( _WIN32 )
+#define DllExport __declspec( dllexport )
+#else
+#define DllExport __attribute__( ( visibility( "default" ) ) )
+#endif
+
+#define fmiPaste( a, b ) a ## b
+#define fmiPasteB( a, b ) fmiPaste( a, b )
+#define fmiFullName( name ) fmiPasteB( MODEL_IDENTIFIER, name )
+
+#define fmiGetTypesPlatform fmiFullName( _fmiGetTypesPlatform )
+#define fmiGetVersion fmiFullName( _fmiGetVersion )
+#define fmiSetDebugLogging fmiFullName( _fmiSetDebugLogging )
+#define fmiSetReal fmiFullName( _fmiSetReal )
+#define fmiSetInteger fmiFullName( _fmiSetInteger )
+#define fmiSetBoolean fmiFullName( _fmiSetBoolean )
+#define fmiSetString fmiFullName( _fmiSetString )
+#define fmiGetReal fmiFullName( _fmiGetReal )
+#define fmiGetInteger fmiFullName( _fmiGetInteger )
+#define fmiGetBoolean fmiFullName( _fmiGetBoolean )
+#define fmiGetString fmiFullName( _fmiGetString )
+#define fmiInstantiateSlave fmiFullName( _fmiInstantiateSlave )
+#define fmiInitializeSlave fmiFullName( _fmiInitializeSlave )
+#define fmiTerminateSlave fmiFullName( _fmiTerminateSlave )
+#define fmiResetSlave fmiFullName( _fmiResetSlave )
+#define fmiFreeSlaveInstance fmiFullName( _fmiFreeSlaveInstance )
+#define fmiSetRealInputDerivatives fmiFullName( _fmiSetRealInputDerivatives )
+#define fmiGetRealOutputDerivatives fmiFullName( _fmiGetRealOutputDerivatives )
+#define fmiCancelStep fmiFullName( _fmiCancelStep )
+#define fmiDoStep fmiFullName( _fmiDoStep )
+#define fmiGetStatus fmiFullName( _fmiGetStatus )
+#define fmiGetRealStatus fmiFullName( _fmiGetRealStatus )
+#define fmiGetIntegerStatus fmiFullName( _fmiGetIntegerStatus )
+#define fmiGetBooleanStatus fmiFullName( _fmiGetBooleanStatus )
+#define fmiGetStringStatus fmiFullName( _fmiGetStringStatus )
+
+#endif /* FMI1_CS_H */
@@ -0,0 +1,202 @@
+/*
+	Generic part of the stand-in FMUs (FMI 1.0 for Co-Simulation). A model source defines the
+	number of real and integer variables (N_REALS, N_INTEGERS) and its internal state (struct
+	ModelState), includes this file and implements the two functions declared below. Value
+	references are indices into the arrays of real and integer values of a model instance.
+
+	Integer inputs that have been set since the last call of fmiDoStep are flagged (array
+	integer_set), which allows a model to treat them as messages.
+*/
+
+#include <stdlib.h>
+#include <string.h>
+
+#include "fmi1_cs.h"
+
+typedef struct {
+	fmiReal r[N_REALS];
+	fmiInteger i[N_INTEGERS];
+	fmiBoolean integer_set[N_INTEGERS];
+	fmiReal time;
+	char* instance_name;
+	fmiCallbackFunctions functions;
+	fmiBoolean logging_on;
+	struct ModelState state;
+} ModelInstance;
+
+/* Called by fmiInitializeSlave (the parameters have been set before) and fmiResetSlave. */
+static void model_initialize( ModelInstance* m );
+
+/* Advances the model from time t to t + h (h may be zero). */
+static fmiStatus model_do_step( ModelInstance* m, fmiReal t, fmiReal h );
+
+
+static void log_message( ModelInstance* m, fmiStatus status, fmiString message )
+{
+	if ( m->logging_on && m->functions.logger )
+		m->functions.logger( m, m->instance_name, status, "standin", "%s", message );
+}
+
+DllExport const char* fmiGetTypesPlatform() { return fmiPlatform; }
+
+DllExport const char* fmiGetVersion() { return fmiVersion; }
+
+DllExport fmiStatus fmiSetDebugLogging( fmiComponent c, fmiBoolean loggingOn )
+{
+	( ( ModelInstance* ) c )->logging_on = loggingOn;
+	return fmiOK;
+}
+
+DllExport fmiComponent fmiInstantiateSlave( fmiString instanceName, fmiString fmuGUID, fmiString fmuLocation,
+	fmiString mimeType, fmiReal timeout, fmiBoolean visible, fmiBoolean interactive,
+	fmiCallbackFunctions functions, fmiBoolean loggingOn )
+{
+	// Memory is not allocated via the callback functions, some FMI front ends do not provide them.
+	ModelInstance* m = ( ModelInstance* ) calloc( 1, sizeof( ModelInstance ) );
+	if ( !m ) return NULL;
+	m->instance_name = strdup( instanceName ? instanceName : "" );
+	m->functions = functions;
+	m->logging_on = loggingOn;
+	return m;
+}
+
+DllExport fmiStatus fmiInitializeSlave( fmiComponent c, fmiReal tStart, fmiBoolean StopTimeDefined, fmiReal tStop )
+{
+	ModelInstance* m = ( ModelInstance* ) c;
+	m->time = tStart;
+	model_initialize( m );
+	log_message( m, fmiOK, "initialized" );
+	return fmiOK;
+}
+
+DllExport fmiStatus fmiTerminateSlave( fmiComponent c ) { return fmiOK; }
+
+DllExport fmiStatus fmiResetSlave( fmiComponent c )
+{
+	ModelInstance* m = ( ModelInstance* ) c;
+	memset( m->r, 0, sizeof( m->r ) );
+	memset( m->i, 0, sizeof( m->i ) );
+	memset( m->integer_set, 0, sizeof( m->integer_set ) );
+	memset( &m->state, 0, sizeof( m->state ) );
+	m->time = 0.;
+	model_initialize( m );
+	return fmiOK;
+}
+
+DllExport void fmiFreeSlaveInstance( fmiComponent c )
+{
+	ModelInstance* m = ( ModelInstance* ) c;
+	if ( !m ) return;
+	free( m->instance_name );
+	free( m );
+}
+
+DllExport fmiStatus fmiSetReal( fmiComponent c, const fmiValueReference vr[], size_t nvr, const fmiReal value[] )
+{
+	ModelInstance* m = ( ModelInstance* ) c;
+	for ( size_t k = 0; k < nvr; ++k ) {
+		if ( vr[k] >= N_REALS ) return fmiError;
+		m->r[vr[k]] = value[k];
+	}
+	return fmiOK;
+}
+
+DllExport fmiStatus fmiSetInteger( fmiComponent c, const fmiValueReference vr[], size_t nvr, const fmiInteger value[] )
+{
+	ModelInstance* m = ( ModelInstance* ) c;
+	for ( size_t k = 0; k < nvr; ++k ) {
+		if ( vr[k] >= N_INTEGERS ) return fmiError;
+		m->i[vr[k]] = value[k];
+		m->integer_set[vr[k]] = fmiTrue;
+	}
+	return fmiOK;
+}
+
+DllExport fmiStatus fmiSetBoolean( fmiComponent c, const fmiValueReference vr[], size_t nvr, const fmiBoolean value[] )
+{
+	return 0 == nvr ? fmiOK : fmiError;
+}
+
+DllExport fmiStatus fmiSetString( fmiComponent c, const fmiValueReference vr[], size_t nvr, const fmiString value[] )
+{
+	return 0 == nvr ? fmiOK : fmiError;
+}
+
+DllExport fmiStatus fmiGetReal( fmiComponent c, const fmiValueReference vr[], size_t nvr, fmiReal value[] )
+{
+	ModelInstance* m = ( ModelInstance* ) c;
+	for ( size_t k = 0; k < nvr; ++k ) {
+		if ( vr[k] >= N_REALS ) return fmiError;
+		value[k] = m->r[vr[k]];
+	}
+	return fmiOK;
+}
+
+DllExport fmiStatus fmiGetInteger( fmiComponent c, const fmiValueReference vr[], size_t nvr, fmiInteger value[] )
+{
+	ModelInstance* m = ( ModelInstance* ) c;
+	for ( size_t k = 0; k < nvr; ++k ) {
+		if ( vr[k] >= N_INTEGERS ) return fmiError;
+		value[k] = m->i[vr[k]];
+	}
+	return fmiOK;
+}
+
+DllExport fmiStatus fmiGetBoolean( fmiComponent c, const fmiValueReference vr[], size_t nvr, fmiBoolean value[] )
+{
+	return 0 == nvr ? fmiOK : fmiError;
+}
+
+DllExport fmiStatus fmiGetString( fmiComponent c, const fmiValueReference vr[], size_t nvr, fmiString value[] )
+{
+	return 0 == nvr ? fmiOK : fmiError;
+}
+
+DllExport fmiStatus fmiSetRealInputDerivatives( fmiComponent c, const fmiValueReference vr[], size_t nvr,
+	const fmiInteger order[], const fmiReal value[] )
+{
+	return fmiError;
+}
+
+DllExport fmiStatus fmiGetRealOutputDerivatives( fmiComponent c, const fmiValueReference vr[], size_t nvr,
+	const fmiInteger order[], fmiReal value[] )
+{
+	return fmiError;
+}
+
+DllExport fmiStatus fmiDoStep( fmiComponent c, fmiReal currentCommunicationPoint, fmiReal communicationStepSize,
+	fmiBoolean newStep )
+{
+	ModelInstance* m = ( ModelInstance* ) c;
+	if ( communicationStepSize < 0. ) return fmiError;
+	fmiStatus status = model_do_step( m, currentCommunicationPoint, communicationStepSize );
+	if ( fmiOK != status ) {
+		log_message( m, status, "step failed" );
+		return status;
+	}
+	m->time = currentCommunicationPoint + communicationStepSize;
+	memset( m->integer_set, 0, sizeof( m->integer_set ) );
+	return fmiOK;
+}
+
+DllExport fmiStatus fmiCancelStep( fmiComponent c ) { return fmiError; }
+
+DllExport fmiStatus fmiGetStatus( fmiComponent c, const fmiStatusKind s, fmiStatus* value )
+{
+	if ( fmiDoStepStatus != s ) return fmiDiscard;
+	*value = fmiOK;
+	return fmiOK;
+}
+
+DllExport fmiStatus fmiGetRealStatus( fmiComponent c, const fmiStatusKind s, fmiReal* value )
+{
+	if ( fmiLastSuccessfulTime != s ) return fmiDiscard;
+	*value = ( ( ModelInstance* ) c )->time;
+	return fmiOK;
+}
+
+DllExport fmiStatus fmiGetIntegerStatus( fmiComponent c, const fmiStatusKind s, fmiInteger* value ) { return fmiDiscard; }
+
+DllExport fmiStatus fmiGetBooleanStatus( fmiComponent c, const fmiStatusKind s, fmiBoolean* value ) { return fmiDiscard; }
+
+DllExport fmiStatus fmiGetStringStatus( fmiComponent c, const fmiStatusKind s, fmiString* value ) { return fmiDiscard; }
@@ -1,15 +1,24 @@
 """
-    A simple data collector that prints all data when the simulator ends.
+    A simple data collector that saves all data to an HDF5 file (in chunks, while the simulation
+    is running) and prints all data when the simulator ends. See collector_store.py for the layout
+    of the results.
 """
 
-import collections
-import mosaik_api
+import copy
+import fnmatch
+import mosaik_api_v3
+import numpy as np
 import pandas as pd
-import warnings
-# import numpy as np
+import queue
+import shutil
+import sim_checkpoint
+import sim_profiler
+from collector_store import BackgroundWriter, ResultWriter, read_results, reconstruct
+from collector_telemetry import TelemetryWriter
 
 
 META = {
+        'type': 'time-based',
         'models': {
                 'Monitor': {
                     'public': True,
@@ -20,30 +29,137 @@ META = {
             },
     }
 
+# Aggregates that can be recorded per window (see parameter *aggregates* of Collector).
+AGGREGATES = ['last', 'min', 'max', 'mean']
+
 def format_func(x):
     try:
         return '{0:.02f}'.format(x)
     except TypeError:
         return str(x)
 
-class Collector(mosaik_api.Simulator):
+class Collector(mosaik_api_v3.Simulator):
+    """
+        The collected data is written to the HDF5 file in chunks of *chunk_size* rows (appended to
+        one compressed array per column, see collector_store.py), i.e., memory usage does not grow
+        with the length of a run and all chunks written so far can be read while the simulation is
+        still running. Compression is set with *complevel* (0: none) and *complib*.
+
+        The chunks are written on a separate thread: a filled block is handed over to the writer
+        and recording continues in a free block. At most *writer_queue* filled blocks wait for the
+        writer, if there are more, the simulation waits (with 0, chunks are written in the step).
+
+        With *telemetry* (file name), the values of each recorded step (or window) are also published
+        to a ring file that can be watched while the simulation is running (see collector_telemetry.py).
+        The published attributes are selected with patterns *telemetry_include* (default: all), they
+        are fixed with the first record.
+
+        In mode 'events', the collector records only changes of values, as (time, column, value) rows.
+        Use function *read_results* to reconstruct the values at every step (from the first to the
+        last step of the collector, every *step_size* mosaiktimes). With *triggered*,
+        the collector is not stepped every *step_size* mosaiktimes but whenever its inputs are updated.
+        Note that mosaik (3.6) keeps bookkeeping data for each such step, which slows down long runs.
+
+        The columns (one per attribute) are discovered in the first steps. In mode 'dense', the values
+        are written into a preallocated block (*chunk_size* rows, one column per attribute, of type
+        *dtype*), missing values (None) are stored as NaN. Attributes that appear after the first chunk
+        has been written get new columns, which hold NaN for all earlier rows.
+
+        Dict-valued attributes (e.g., *out* of PeriodicGroupSender) are recorded as one column per key.
+        They are detected by their first dict value, or declared in advance with name patterns *groups*
+        (so that an attribute without value in the first steps does not get a column of its own).
+
+        Attributes are selected by name (<simulator>.<entity>.<attribute>) with lists of patterns
+        *include* and *exclude* (see module fnmatch). In mode 'dense', the values can be aggregated
+        over windows of *window* mosaiktimes (one row per window instead of one per step). Parameter
+        *aggregates* maps patterns to the aggregates ('last', 'min', 'max', 'mean') recorded for the
+        matching attributes, e.g., {'*.U_*': ['min', 'max', 'mean']}, all other attributes are
+        recorded with their last value in the window. The aggregates are updated in each step, i.e.,
+        no samples are kept.
+
+        With *checkpoint* and *checkpoint_time* (see sim_checkpoint.py), the results written up to the
+        checkpoint time are copied to the checkpoint, together with the column layout, the last values
+        (mode 'events') and the aggregates of the current window. A collector restored from the
+        checkpoint (*restore*) starts its result file with this copy and appends from the checkpoint
+        time on, i.e., the results cover the whole simulation.
+    """
+
+    # State saved in checkpoints (see sim_checkpoint.py), in addition to the results written so far.
+    checkpoint_attrs = ['columns', 'column_index', 'groups', 'group_keys', 'pending', 'last', 'outputs', 'aggregate_index',
+        'sample', 'acc', 'window_start', 'grid', 'block', 'times', 'chunks', 'rows']
+
     def __init__(self):
-        super(Collector, self).__init__(META)
+        super(Collector, self).__init__(copy.deepcopy(META))
         self.eid = None
-        self.data = collections.defaultdict(
-                lambda: collections.defaultdict(list))
-        self.time_list=[]
+        self.columns = [] # (src, attr) of all recorded attributes
+        self.column_index = {} # (src, attr) -> column of attribute (None if not recorded)
+        self.groups = set() # (src, attr) of dict-valued attributes
+        self.group_patterns = [] # Name patterns of dict-valued attributes (parameter *groups*)
+        self.group_keys = {} # (src, attr) -> keys of a dict-valued attribute seen so far (mode 'events')
+        self.pending = set() # (src, attr) of attributes without values so far
+        self.last = np.empty(0) # Last recorded value per column (mode 'events')
+        self.outputs = [] # (column, aggregate) of all columns in block (mode 'dense')
+        self.aggregate_index = {} # aggregate -> (columns in block, columns of attributes)
+        self.sample = np.empty(0) # Values of the current step (mode 'dense')
+        self.acc = {} # Aggregates of the current window (mode 'dense')
+        self.window_start = None # Start of the current window
+        self.grid = None # [first step, latest step, step size] (mode 'events')
+        self.block = None # Values of the current chunk (one row per step or window)
+        self.times = None # Mosaik times of the current chunk
+        self.writer = None # Writes the chunks to the HDF5 file
+        self.free = queue.Queue() # (block, times) that have been written and can be reused
+        self.num_blocks = 1 # Number of blocks allocated so far
+        self.telemetry_writer = None # Publishes records to the telemetry ring file
+        self.telemetry_keys = [] # Outputs (mode 'dense') or columns (mode 'events') that are published
+        self.telemetry_index = None # Positions of the published outputs or columns
+        self.row = 0 # Next row in block
+        self.chunks = [] # Chunks kept in memory (only if results are not saved)
+        self.rows = 0 # Number of rows written so far
+        self.profiler = None # Profiler (only if parameter *profile* is set)
+        self.checkpoint = None # Checkpoint to write or restore (only if parameter *checkpoint* or *restore* is set)
 
         self.step_size = None
         self.sec_per_mt = None
 
-    def init(self, sid, step_size, seconds_per_mosaik_timestep=1, print_results=True, save_h5=True, h5_storename='collectorstore', h5_panelname=None):
+    def init(self, sid, step_size, time_resolution=1., seconds_per_mosaik_timestep=1, print_results=True, save_h5=True, h5_storename='collectorstore', h5_panelname=None, chunk_size=1000, dtype='float64', mode='dense', triggered=False, include=None, exclude=None, window=None, aggregates=None, groups=None, complevel=5, complib='blosc', writer_queue=2, telemetry=None, telemetry_include=None, telemetry_capacity=1000, profile=None, checkpoint=None, checkpoint_time=None, restore=None):
+        if mode not in ('dense', 'events'):
+            raise RuntimeError("Collector: unknown mode {0} (use 'dense' or 'events').".format(mode))
+        for aggs in (aggregates or {}).values():
+            for agg in aggs:
+                if agg not in AGGREGATES:
+                    raise RuntimeError("Collector: unknown aggregate {0} (use {1}).".format(agg, ', '.join(AGGREGATES)))
         self.step_size = step_size
         self.sec_per_mt = seconds_per_mosaik_timestep
         self.print_results = print_results
         self.save_h5 = save_h5
         self.h5_storename = h5_storename
         self.h5_panelname = h5_panelname
+        self.chunk_size = chunk_size
+        self.dtype = np.dtype(dtype)
+        self.mode = mode
+        self.triggered = triggered
+        self.include = include
+        self.exclude = exclude or []
+        self.window = window
+        self.aggregates = aggregates or {}
+        self.group_patterns = groups or []
+        self.complevel = complevel
+        self.complib = complib
+        self.writer_queue = writer_queue
+        self.telemetry = telemetry
+        self.telemetry_include = telemetry_include
+        self.telemetry_capacity = telemetry_capacity
+        self.profiler = sim_profiler.create(sid, profile)
+        self.checkpoint = sim_checkpoint.create(self, sid, checkpoint, checkpoint_time, restore)
+        if mode == 'events':
+            # Only changed values are recorded (one row per change).
+            if triggered:
+                self.meta['type'] = 'event-based'
+            self.block = np.empty(chunk_size, dtype=[('time', 'i8'), ('column', 'i4'), ('value', self.dtype)])
+        else:
+            self.block = np.full((chunk_size, 0), np.nan, dtype=self.dtype)
+            self.times = np.empty(chunk_size, dtype=np.int64)
+            self.acc = {agg: np.empty(0) for agg in ('count', 'sum', 'min', 'max', 'last')}
         return self.meta
 
     def create(self, num, model):
@@ -52,40 +168,311 @@ class Collector(mosaik_api.Simulator):
 
         self.eid = 'Monitor'
         if self.h5_panelname is None: self.h5_panelname = self.eid
+        if self.save_h5:
+            self.writer = ResultWriter(self.h5_storename, self.h5_panelname, self.mode, self.sec_per_mt,
+                self.dtype, complevel=self.complevel, complib=self.complib)
+            if self.writer_queue > 0:
+                self.writer = BackgroundWriter(self.writer, self.writer_queue)
         return [{'eid': self.eid, 'type': model}]
 
-    def step(self, time, inputs):
+    @sim_profiler.profiled
+    @sim_checkpoint.checkpointed
+    def step(self, time, inputs, max_advance=None):
+        if self.mode == 'events':
+            if self.grid is None: self.grid = [time, time, self.step_size]
+            self.grid[1] = time
+            self.record_events(time, inputs[self.eid])
+            if self.telemetry:
+                self.publish(time, self.last, range(len(self.columns)), lambda col: '{0}.{1}'.format(*self.columns[col]))
+            return None if self.triggered else time + self.step_size
+
+        # A new window starts: record the aggregates of the previous one.
+        if self.window:
+            window_start = time - time % self.window
+            if self.window_start is not None and window_start != self.window_start:
+                self.record_window()
+            self.window_start = window_start
+        else:
+            self.window_start = time
+
         data = inputs[self.eid]
         for attr, values in data.items():
             for src, value in values.items():
-                val_list = self.data[src][attr]
-                if value is None:
-                    if len( val_list ) is not 0:
-                        val_list.append( val_list[-1] )
-                        # val_list.append( np.NaN )
-                    else:
-                        val_list.append( 0 )
-                        # val_list.append( np.NaN )
-                else:
-                    val_list.append( value )
-        self.time_list.append(time*self.sec_per_mt)
+                if isinstance(value, dict):
+                    # Dict-valued attributes (e.g., *out* of PeriodicGroupSender) are recorded as one column per key.
+                    self.groups.add((src, attr))
+                    for key, val in value.items():
+                        if val is None: continue
+                        col = self.column(src, '{0}.{1}'.format(attr, key))
+                        if col is not None: self.sample[col] = val
+                elif value is not None:
+                    col = self.column(src, attr)
+                    if col is not None: self.sample[col] = value
+                elif (src, attr) not in self.column_index and not self.is_group(src, attr):
+                    self.pending.add((src, attr))
+
+        self.accumulate()
+        if not self.window:
+            self.record_window()
 
         return time + self.step_size
 
+    def accumulate(self):
+        '''Updates the aggregates of the current window with the values of the current step.'''
+        acc, sample = self.acc, self.sample
+        valid = ~np.isnan(sample)
+        acc['count'] += valid
+        acc['sum'] += np.where(valid, sample, 0.)
+        np.fmin(acc['min'], sample, out=acc['min'])
+        np.fmax(acc['max'], sample, out=acc['max'])
+        np.copyto(acc['last'], sample, where=valid)
+        sample.fill(np.nan)
+
+    def record_window(self):
+        '''Writes the aggregates of the current window into the next row of the block.'''
+        acc, row = self.acc, self.block[self.row]
+        for agg, (out_cols, cols) in self.aggregate_index.items():
+            if agg == 'mean':
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    row[out_cols] = acc['sum'][cols] / acc['count'][cols]
+            else:
+                row[out_cols] = acc[agg][cols]
+        self.times[self.row] = self.window_start
+        if self.telemetry:
+            self.publish(self.window_start, row, self.outputs, lambda out: self.output_name(*out))
+        self.row += 1
+
+        for agg, values in acc.items():
+            values.fill(0. if agg in ('count', 'sum') else np.nan)
+
+        if self.row == self.chunk_size:
+            self.flush()
+
+    def record_events(self, time, data):
+        for attr, values in data.items():
+            for src, value in values.items():
+                if isinstance(value, dict):
+                    keys = self.group_keys.setdefault((src, attr), set())
+                    keys.update(value)
+                    for key in keys:
+                        self.record_event(time, src, '{0}.{1}'.format(attr, key), value.get(key))
+                elif (src, attr) in self.group_keys:
+                    # A dict-valued attribute without value (e.g., *out* of a sender in between transmissions).
+                    for key in self.group_keys[(src, attr)]:
+                        self.record_event(time, src, '{0}.{1}'.format(attr, key), None)
+                else:
+                    self.record_event(time, src, attr, value)
+
+    def record_event(self, time, src, attr, value):
+        '''Records a change of an attribute. Changes to None are recorded as NaN (as in mode 'dense'),
+        except for attributes that have never had a value.'''
+        if value is None:
+            col, value = self.column_index.get((src, attr)), np.nan
+        else:
+            col = self.column(src, attr)
+        if col is None: return
+        last = self.last[col]
+        if value == last or (value != value and last != last): return
+        self.last[col] = value
+
+        self.block[self.row] = (time, col, value)
+        self.row += 1
+        if self.row == self.chunk_size:
+            self.flush()
+
+    def publish(self, time, values, keys, name):
+        '''Publishes the values of the selected keys (outputs or columns) to the telemetry ring file.'''
+        if self.telemetry_writer is None:
+            self.telemetry_keys = [key for key in keys if self.telemetry_include is None
+                or any(fnmatch.fnmatchcase(name(key), p) for p in self.telemetry_include)]
+            self.telemetry_writer = TelemetryWriter(self.telemetry, [name(key) for key in self.telemetry_keys],
+                self.sec_per_mt, self.telemetry_capacity)
+        if self.telemetry_index is None:
+            position = {key: i for i, key in enumerate(keys)}
+            self.telemetry_index = np.array([position[key] for key in self.telemetry_keys], dtype=int)
+        self.telemetry_writer.publish(time, values[self.telemetry_index])
+
+    def is_group(self, src, attr):
+        '''Checks whether an attribute is dict-valued (seen with a dict value or declared with *groups*).'''
+        if (src, attr) in self.groups: return True
+        name = '{0}.{1}'.format(src, attr)
+        if any(fnmatch.fnmatchcase(name, p) for p in self.group_patterns):
+            self.groups.add((src, attr))
+            return True
+        return False
+
+    def is_recorded(self, name):
+        '''Checks the patterns *include* and *exclude* for an attribute.'''
+        if self.include is not None and not any(fnmatch.fnmatchcase(name, p) for p in self.include):
+            return False
+        return not any(fnmatch.fnmatchcase(name, p) for p in self.exclude)
+
+    def column(self, src, attr):
+        '''Returns the column of an attribute (None if it is not recorded). In mode 'dense', columns
+        added after the first chunk has been written are appended to the sorted columns.'''
+        try:
+            return self.column_index[(src, attr)]
+        except KeyError:
+            pass
+
+        name = '{0}.{1}'.format(src, attr)
+        if not self.is_recorded(name):
+            self.column_index[(src, attr)] = None
+            return None
+
+        if self.mode == 'events':
+            # Events can refer to new columns at any time.
+            self.column_index[(src, attr)] = len(self.columns)
+            self.columns.append((src, attr))
+            self.last = np.append(self.last, np.nan)
+            return self.column_index[(src, attr)]
+
+        col = len(self.columns)
+        self.column_index[(src, attr)] = col
+        self.columns.append((src, attr))
+
+        # Without window, each row holds the values of one step (i.e., all aggregates are equal).
+        aggs = ['last']
+        if self.window:
+            aggs = next((aggs for pattern, aggs in self.aggregates.items() if fnmatch.fnmatchcase(name, pattern)), aggs)
+        self.outputs.extend((col, agg) for agg in aggs)
+        self.block = np.hstack([self.block, np.full((self.chunk_size, len(aggs)), np.nan, dtype=self.dtype)])
+        self.sample = np.append(self.sample, np.nan)
+        for agg, values in self.acc.items():
+            self.acc[agg] = np.append(values, 0. if agg in ('count', 'sum') else np.nan)
+        self.update_aggregate_index()
+        return col
+
+    def update_aggregate_index(self):
+        index = {}
+        for out_col, (col, agg) in enumerate(self.outputs):
+            index.setdefault(agg, ([], []))
+            index[agg][0].append(out_col)
+            index[agg][1].append(col)
+        self.aggregate_index = {agg: (np.array(out_cols), np.array(cols)) for agg, (out_cols, cols) in index.items()}
+        self.telemetry_index = None # The outputs have changed.
+
+    def output_name(self, col, agg):
+        '''Returns the name of a column in the results, aggregates other than 'last' get a suffix.'''
+        src, attr = self.columns[col]
+        return '{0}.{1}'.format(src, attr) if agg == 'last' else '{0}.{1}.{2}'.format(src, attr, agg)
+
+    def flush(self, force=False):
+        '''Writes the data collected since the last flush as new chunk (with *force*, also an empty chunk
+        in mode 'events', which updates the grid).'''
+        if self.row == 0 and not (force and self.mode == 'events' and self.grid is not None): return
+
+        if self.mode == 'events':
+            self.flush_events()
+            return
+
+        if self.rows == 0:
+            # Attributes without any values get a column as well, the columns are sorted.
+            for src, attr in sorted(self.pending - self.groups):
+                self.column(src, attr)
+            order = sorted(range(len(self.outputs)), key=lambda out_col: self.output_name(*self.outputs[out_col]))
+            self.outputs = [self.outputs[out_col] for out_col in order]
+            self.block = self.block[:, order]
+            self.update_aggregate_index()
+
+        names = [self.output_name(col, agg) for col, agg in self.outputs]
+        if self.save_h5:
+            self.hand_over(self.writer.write_dense, self.times[:self.row], self.block[:self.row], names)
+        else:
+            self.chunks.append(pd.DataFrame(self.block[:self.row], index=self.times[:self.row]*self.sec_per_mt,
+                columns=names))
+        self.rows += self.row
+
+        self.block.fill(np.nan)
+        self.row = 0
+
+    def flush_events(self):
+        events = self.block[:self.row]
+        names = ['{0}.{1}'.format(src, attr) for src, attr in self.columns]
+
+        if self.save_h5:
+            self.hand_over(self.writer.write_events, events['time'], events['column'], events['value'], names, list(self.grid))
+        else:
+            chunk = pd.DataFrame(events)
+            chunk['time'] = chunk['time']*self.sec_per_mt
+            self.chunks.append(chunk)
+        self.rows += self.row
+        self.row = 0
+
+    def hand_over(self, write, *args):
+        '''Writes a chunk (a view on the current block). With a background writer, the block is handed
+        over and replaced by a free one, which may have to wait until a block has been written.'''
+        if not isinstance(self.writer, BackgroundWriter):
+            write(*args)
+            return
+
+        block, times = self.block, self.times
+        write(*args, done=lambda: self.free.put((block, times)))
+        try:
+            self.block, self.times = self.free.get_nowait()
+        except queue.Empty:
+            if self.num_blocks <= self.writer_queue + 1:
+                # One block is filled, one is being written and up to *writer_queue* are waiting.
+                self.num_blocks += 1
+                self.block = np.empty_like(block)
+                self.times = None if times is None else np.empty_like(times)
+            else:
+                self.block, self.times = self.free.get()
+        if self.block.shape != block.shape:
+            # Columns have been added since the free block was allocated.
+            self.block = np.empty_like(block)
+
+    def result_writer(self):
+        return self.writer.writer if isinstance(self.writer, BackgroundWriter) else self.writer
+
+    def get_checkpoint_state(self):
+        '''Writes the rows collected so far and copies the result file to the checkpoint.'''
+        self.flush(force=self.save_h5)
+        state = {'collector': sim_checkpoint.get_state(self)}
+        if self.save_h5:
+            if isinstance(self.writer, BackgroundWriter): self.writer.sync()
+            writer = self.result_writer()
+            state['writer'] = sim_checkpoint.get_state(writer, ['created', 'num_columns'])
+            if writer.created: shutil.copyfile(self.h5_storename, self.checkpoint.file('h5'))
+        return state
+
+    def set_checkpoint_state(self, state):
+        '''Starts the result file with the results of the checkpoint.'''
+        sim_checkpoint.set_state(self, state['collector'])
+        if self.save_h5:
+            writer = self.result_writer()
+            sim_checkpoint.set_state(writer, state['writer'])
+            if writer.created: shutil.copyfile(self.checkpoint.file('h5'), self.h5_storename)
+
     def finalize(self):
-        if self.print_results:
+        if self.checkpoint is not None:
+            # Before the last window and chunk are written (if the simulation ended before the checkpoint time).
+            self.checkpoint.close()
+        if self.mode == 'dense' and self.window and self.window_start is not None:
+            self.record_window() # Last (incomplete) window.
+        self.flush(force=self.save_h5)
+        if isinstance(self.writer, BackgroundWriter):
+            self.writer.close()
+        if self.telemetry_writer is not None:
+            self.telemetry_writer.close()
+        if self.profiler is not None:
+            self.profiler.write()
+
+        if self.print_results and self.rows > 0:
+            if self.save_h5:
+                results = read_results(self.h5_storename, self.h5_panelname)
+            elif self.mode == 'events':
+                start, end, step_size = self.grid
+                results = reconstruct(pd.concat(self.chunks), ['{0}.{1}'.format(*c) for c in self.columns],
+                    np.arange(start, end + 1, step_size)*self.sec_per_mt)
+            else:
+                results = pd.concat(self.chunks)
             print('Collected data:')
-            for sim, sim_data in sorted(self.data.items()):
+            for sim in sorted(set(src for src, attr in self.columns)):
                 print('- {0}'.format(sim))
-                for attr, values in sorted(sim_data.items()):
-                    print('  - {0}: {1}'.format(attr, list(map(format_func, values))))
-        if self.save_h5:
-            with warnings.catch_warnings():
-                warnings.filterwarnings( 'ignore', category=FutureWarning )
-
-                store = pd.HDFStore(self.h5_storename)
-                store[self.h5_panelname] = pd.Panel.from_dict({k: pd.DataFrame(v, index=self.time_list) for k,v in self.data.items()})
-                store.close()
+                for name in results.columns:
+                    if not name.startswith(sim + '.'): continue
+                    print('  - {0}: {1}'.format(name[len(sim) + 1:], list(map(format_func, results[name]))))
 
 if __name__ == '__main__':
-    mosaik_api.start_simulation(Collector())
+    mosaik_api_v3.start_simulation(Collector())
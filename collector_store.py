@@ -0,0 +1,201 @@
+"""
+    Storage of Collector results in HDF5 files (via PyTables).
+
+    Layout of the results of a Collector (group /<key>, e.g., /Monitor):
+        attributes    schema ('lss2-collector'), version, mode ('dense' or 'events'),
+                      seconds_per_mosaik_timestep, names (names of all columns), grid
+                      (mode 'events': mosaik times of the first and last step and step size)
+        time          int64 mosaik time of each row (mode 'dense') or event (mode 'events')
+        c<i>          values of column i, one array per column (mode 'dense')
+        column, value column index and value of each event (mode 'events')
+
+    All arrays are extendable and compressed, i.e., results can be appended in chunks while
+    the simulation is running and each column can be read without loading the others.
+"""
+
+import fnmatch
+import numpy as np
+import pandas as pd
+import queue
+import tables
+import threading
+import warnings
+
+
+SCHEMA = 'lss2-collector'
+VERSION = 2
+
+
+class ResultWriter(object):
+    """
+        Appends chunks of Collector results to an HDF5 file. The file is only open while
+        writing, so that it can be read in between.
+    """
+
+    def __init__(self, filename, key, mode, seconds_per_mosaik_timestep, dtype, complevel=5, complib='blosc'):
+        self.filename = filename
+        self.key = key
+        self.mode = mode
+        self.sec_per_mt = seconds_per_mosaik_timestep
+        self.dtype = np.dtype(dtype)
+        self.filters = tables.Filters(complevel=complevel, complib=complib, shuffle=True) if complevel else None
+        self.created = False
+        self.num_columns = 0 # Number of column arrays (mode 'dense')
+
+    def write_dense(self, times, block, names):
+        '''Appends rows (one per time, block has one column per name). New names may be added with
+        each call, their columns hold NaN for all rows written before.'''
+        with self.open() as h5:
+            group = self.group(h5, names)
+            self.created = True
+            for col in range(self.num_columns, len(names)):
+                array = self.create_array(h5, group, 'c{0}'.format(col), self.dtype)
+                if group.time.nrows: array.append(np.full(group.time.nrows, np.nan, dtype=self.dtype))
+            self.num_columns = len(names)
+            group.time.append(np.asarray(times, dtype=np.int64))
+            for col in range(len(names)):
+                group._f_get_child('c{0}'.format(col)).append(block[:, col])
+
+    def write_events(self, times, columns, values, names, grid):
+        '''Appends events (time, column index, value), new names may be added with each call. The grid
+        (first step, last step so far, step size) is used to reconstruct the values at every step.'''
+        with self.open() as h5:
+            group = self.group(h5, names)
+            group._v_attrs.grid = list(grid)
+            if not self.created:
+                self.create_array(h5, group, 'column', np.dtype(np.int32))
+                self.create_array(h5, group, 'value', self.dtype)
+                self.created = True
+            group.time.append(np.asarray(times, dtype=np.int64))
+            group.column.append(np.asarray(columns, dtype=np.int32))
+            group.value.append(np.asarray(values, dtype=self.dtype))
+
+    def open(self):
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', category=tables.NaturalNameWarning)
+            return tables.open_file(self.filename, 'a')
+
+    def group(self, h5, names):
+        '''Returns the group of the results (created with the first chunk, replacing results of a previous run).'''
+        path = '/' + self.key
+        if not self.created:
+            if path in h5: h5.remove_node(path, recursive=True)
+            group = h5.create_group('/', self.key)
+            group._v_attrs.schema = SCHEMA
+            group._v_attrs.version = VERSION
+            group._v_attrs.mode = self.mode
+            group._v_attrs.seconds_per_mosaik_timestep = self.sec_per_mt
+            self.create_array(h5, group, 'time', np.dtype(np.int64))
+        else:
+            group = h5.get_node(path)
+        group._v_attrs.names = list(names)
+        return group
+
+    def create_array(self, h5, group, name, dtype):
+        return h5.create_earray(group, name, atom=tables.Atom.from_dtype(dtype), shape=(0,),
+            filters=self.filters, chunkshape=(16384,))
+
+
+class BackgroundWriter(object):
+    """
+        Runs the methods of a ResultWriter on a dedicated thread, so that compressing and writing
+        chunks overlaps with the simulation. Chunks are passed through a queue of at most *queue_size*
+        entries, submitting a chunk blocks while the queue is full (back-pressure). Each chunk may have
+        a callback *done*, which is called (on the writer thread) when the chunk has been written.
+    """
+
+    def __init__(self, writer, queue_size=2):
+        self.writer = writer
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='ResultWriter', daemon=True)
+        self.thread.start()
+
+    def write_dense(self, times, block, names, done=None):
+        self.submit(self.writer.write_dense, (times, block, names), done)
+
+    def write_events(self, times, columns, values, names, grid, done=None):
+        self.submit(self.writer.write_events, (times, columns, values, names, grid), done)
+
+    def submit(self, func, args, done):
+        self.check()
+        self.queue.put((func, args, done))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None: break
+            func, args, done = item
+            try:
+                # After an error, the remaining chunks are discarded.
+                if self.error is None: func(*args)
+            except Exception as e:
+                self.error = e
+            finally:
+                if done is not None: done()
+
+    def sync(self):
+        '''Waits until all chunks submitted so far have been written.'''
+        written = threading.Event()
+        self.submit(lambda: None, (), written.set)
+        written.wait()
+        self.check()
+
+    def close(self):
+        '''Waits until all chunks have been written.'''
+        self.queue.put(None)
+        self.thread.join()
+        self.check()
+
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError('Writing results to {0} failed: {1}'.format(self.writer.filename, self.error)) from self.error
+
+
+def read_results(storename, key='Monitor', columns=None, changes_only=False):
+    '''Reads the results of a Collector as DataFrame with one column per attribute (index: time in
+    seconds). Only the columns matching one of the patterns in *columns* are read (default: all).
+    Results recorded in mode 'events' are reconstructed, i.e., each value holds until the next change,
+    with one row per step of the Collector (as in mode 'dense'). With *changes_only*, there are only
+    rows at the times of changes.'''
+    with tables.open_file(storename, 'r') as h5:
+        group = h5.get_node('/' + key)
+        attrs = group._v_attrs
+        if getattr(attrs, 'schema', None) != SCHEMA or attrs.version != VERSION:
+            raise RuntimeError('{0}: /{1} does not hold Collector results (version {2}).'.format(storename, key, VERSION))
+
+        names = list(attrs.names)
+        selected = [col for col, name in enumerate(names)
+            if columns is None or any(fnmatch.fnmatchcase(name, pattern) for pattern in columns)]
+        times = group.time.read() * attrs.seconds_per_mosaik_timestep
+
+        if attrs.mode == 'events':
+            events = pd.DataFrame({'time': times, 'column': group.column.read(), 'value': group.value.read()})
+            grid = None
+            if not changes_only:
+                start, end, step_size = attrs.grid
+                grid = np.arange(start, end + 1, step_size) * attrs.seconds_per_mosaik_timestep
+            return reconstruct(events[events['column'].isin(selected)], names, grid)
+
+        return pd.DataFrame({names[col]: group._f_get_child('c{0}'.format(col)).read() for col in selected},
+            index=times, columns=[names[col] for col in selected])
+
+
+def reconstruct(events, names, grid=None):
+    '''Converts (time, column, value) rows to a DataFrame with one column per attribute. Each event holds
+    until the next one of its column, including events with value NaN (changes to None). The rows are
+    at the times of the events or, if given, at the times of *grid* (e.g., all steps).'''
+    events = events.drop_duplicates(['time', 'column'], keep='last')
+    values = events.pivot(index='time', columns='column', values='value')
+    present = events.assign(value=1.).pivot(index='time', columns='column', values='value').notna().to_numpy()
+
+    # Row of the latest event of each column at each time (-1 before the first event).
+    rows = np.maximum.accumulate(np.where(present, np.arange(len(values))[:, np.newaxis], -1), axis=0)
+    data = values.to_numpy()[np.maximum(rows, 0), np.arange(values.shape[1])]
+    data[rows < 0] = np.nan
+
+    results = pd.DataFrame(data, index=values.index, columns=[names[col] for col in values.columns])
+    results.index.name = None
+    if grid is not None:
+        results = results.reindex(grid, method='ffill')
+    return results
@@ -0,0 +1,186 @@
+"""
+    Live telemetry of a running co-simulation: the Collector publishes one compact binary record
+    per recorded step to a memory-mapped ring file (parameter *telemetry*), which can be read by
+    any number of processes while the simulation is running.
+
+    The ring holds the latest *capacity* records. When it is full, the oldest record is overwritten
+    (drop-oldest), i.e., the simulation never waits for a reader and a slow reader misses records.
+
+    Watch and summarize the stream with:
+        python collector_telemetry.py tail -f erigridstore.telemetry --columns '*.U_*' '*.current_tap'
+        python collector_telemetry.py summary erigridstore.telemetry
+
+    Layout of the ring file (little endian):
+        header   magic, version, capacity, number of columns, size of names, seconds per
+                 mosaik timestep, number of records written so far (padded to HEADER_SIZE bytes)
+        names    column names (UTF-8, separated by newlines)
+        records  capacity x (sequence number (uint64), mosaik time (int64), values (float32))
+
+    The sequence number of a record is written last (and set to WRITING before the record is
+    overwritten), the reader copies the records and re-checks their sequence numbers afterwards.
+"""
+
+import argparse
+import fnmatch
+import mmap
+import struct
+import time
+import numpy as np
+
+
+MAGIC = b'LSS2TLM\0'
+VERSION = 1
+HEADER = struct.Struct('<8sIIIIdQ')
+HEADER_SIZE = 64
+SEQ_OFFSET = HEADER.size - 8
+WRITING = np.iinfo(np.uint64).max # Sequence number of a record that is being written
+
+
+def record_dtype(num_columns):
+    return np.dtype([('seq', '<u8'), ('time', '<i8'), ('values', '<f4', (num_columns,))])
+
+
+class TelemetryWriter(object):
+    """
+        Publishes records to a ring file. The names of the columns are fixed when the ring file is
+        created (columns that appear later are not published).
+    """
+
+    def __init__(self, filename, names, seconds_per_mosaik_timestep=1, capacity=1000):
+        self.filename = filename
+        self.names = list(names)
+        self.capacity = capacity
+        self.seq = 0
+
+        encoded = '\n'.join(self.names).encode('utf-8')
+        dtype = record_dtype(len(self.names))
+        data_offset = HEADER_SIZE + len(encoded)
+        size = data_offset + capacity*dtype.itemsize
+
+        with open(filename, 'w+b') as f:
+            f.truncate(size)
+            self.mm = mmap.mmap(f.fileno(), size)
+        self.mm[HEADER_SIZE:data_offset] = encoded
+        HEADER.pack_into(self.mm, 0, MAGIC, VERSION, capacity, len(self.names), len(encoded),
+            seconds_per_mosaik_timestep, 0)
+        self.records = np.ndarray(capacity, dtype=dtype, buffer=self.mm, offset=data_offset)
+
+    def publish(self, time, values):
+        '''Writes a record (values ordered as the names) and overwrites the oldest one if the ring is full.'''
+        record = self.records[self.seq % self.capacity]
+        record['seq'] = WRITING
+        record['time'] = time
+        record['values'] = values
+        record['seq'] = self.seq
+        self.seq += 1
+        struct.pack_into('<Q', self.mm, SEQ_OFFSET, self.seq)
+
+    def close(self):
+        del self.records
+        self.mm.close()
+
+
+class TelemetryReader(object):
+    """
+        Reads the records of a ring file that have been published since the last call of *read*.
+    """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.capacity, num_columns, names_size, self.sec_per_mt, _ = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise RuntimeError('{0} is not a telemetry file (version {1}).'.format(filename, VERSION))
+        names = bytes(self.mm[HEADER_SIZE:HEADER_SIZE + names_size]).decode('utf-8')
+        self.names = names.split('\n') if num_columns else []
+        self.records = np.ndarray(self.capacity, dtype=record_dtype(num_columns), buffer=self.mm,
+            offset=HEADER_SIZE + names_size)
+        self.next_seq = 0
+        self.dropped = 0
+
+    def written(self):
+        '''Returns the number of records published so far.'''
+        return struct.unpack_from('<Q', self.mm, SEQ_OFFSET)[0]
+
+    def read(self):
+        '''Returns the new records (oldest first). Records that have been overwritten before they could
+        be read are counted as dropped.'''
+        while True:
+            end = self.written()
+            start = max(self.next_seq, end - self.capacity)
+            slots = np.arange(start, end) % self.capacity
+            records = self.records[slots].copy()
+            # Read again if a record has been overwritten while copying it.
+            if np.array_equal(self.records['seq'][slots], records['seq']): break
+        self.dropped += start - self.next_seq
+
+        # Records overwritten before copying are dropped as well.
+        valid = records['seq'] == np.arange(start, end, dtype=np.uint64)
+        self.dropped += int((~valid).sum())
+        self.next_seq = end
+        return records[valid]
+
+    def select(self, patterns):
+        '''Returns the indices of the columns matching any of the patterns (all if None).'''
+        return [i for i, name in enumerate(self.names)
+            if patterns is None or any(fnmatch.fnmatchcase(name, p) for p in patterns)]
+
+
+def tail(args):
+    reader = TelemetryReader(args.filename)
+    columns = reader.select(args.columns)
+    print('time [s]\t' + '\t'.join(reader.names[i] for i in columns))
+    reader.next_seq = max(0, reader.written() - args.lines)
+    while True:
+        for record in reader.read():
+            values = '\t'.join('{0:.4f}'.format(v) for v in record['values'][columns])
+            print('{0:g}\t{1}'.format(record['time']*reader.sec_per_mt, values), flush=True)
+        if not args.follow: break
+        time.sleep(args.interval)
+
+
+def summary(args):
+    reader = TelemetryReader(args.filename)
+    columns = reader.select(args.columns)
+    records = reader.read()
+    print('{0}: {1} records published, {2} in ring'.format(args.filename, reader.next_seq, len(records)))
+    if len(records) == 0: return
+
+    times = records['time']*reader.sec_per_mt
+    print('time {0:g} s to {1:g} s'.format(times[0], times[-1]))
+    values = records['values'][:, columns]
+    for k, i in enumerate(columns):
+        v = values[:, k]
+        if np.isnan(v).all():
+            print('  {0}: no values'.format(reader.names[i]))
+            continue
+        print('  {0}: last {1:.4f}, min {2:.4f}, max {3:.4f}, mean {4:.4f}'.format(
+            reader.names[i], v[~np.isnan(v)][-1], np.nanmin(v), np.nanmax(v), np.nanmean(v)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Watch the telemetry of a running co-simulation')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_tail = subparsers.add_parser('tail', help='print new records')
+    parser_tail.add_argument('filename', type=str, help='telemetry ring file')
+    parser_tail.add_argument('--columns', nargs='*', help='name patterns of the columns to print', default=None)
+    parser_tail.add_argument('--lines', '-n', type=int, help='number of previous records to print first', default=10)
+    parser_tail.add_argument('--follow', '-f', action='store_true', help='keep printing new records')
+    parser_tail.add_argument('--interval', type=float, help='polling interval in seconds', default=1.)
+    parser_tail.set_defaults(func=tail)
+
+    parser_summary = subparsers.add_parser('summary', help='summarize the records in the ring')
+    parser_summary.add_argument('filename', type=str, help='telemetry ring file')
+    parser_summary.add_argument('--columns', nargs='*', help='name patterns of the columns to summarize', default=None)
+    parser_summary.set_defaults(func=summary)
+
+    args = parser.parse_args()
+    try:
+        args.func(args)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -68,7 +68,7 @@ class FMUCoSimulationV1:
     fmi_pending = 5
 
 
-    def __init__( self, fmu_name, fmu_path ):
+    def __init__( self, fmu_name, fmu_path, profiler=None ):
 
         self.fmu_name = fmu_name
         self.fmu_path = fmu_path
@@ -85,6 +85,10 @@ class FMUCoSimulationV1:
         # Initialize the FMU functions.
         self.__init_functions()
 
+        # Time the calls of the FMU functions (see sim_profiler.py).
+        if profiler is not None:
+            profiler.instrument( self, [ 'doStep', 'getReal', 'setReal', 'getInteger', 'setInteger' ] )
+
 
     def __del__( self ):
         self.terminateSlave()
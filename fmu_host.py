@@ -0,0 +1,302 @@
+"""
+    A local host daemon that keeps a pool of instantiated FMUs (fmipp) and leases
+    them to the simulators via a local socket.
+
+    Starting the tools behind the FMUs (PowerFactory, MATLAB) takes many seconds. With the
+    host running, a parameter sweep pays this start-up cost only once: when a simulator
+    releases an FMU at the end of a run, the FMU is reset (fmiResetSlave) and kept for the
+    next run instead of being freed. FMUs that cannot be reset (e.g., the FMI++ exports of
+    PowerFactory and MATLAB) are terminated instead (fmiTerminateSlave) and initialized again
+    by the next run. FMUs that can neither be reset nor terminated are dropped with a warning,
+    the numbers of instantiated, reused and dropped FMUs are printed at shutdown.
+
+    FMUs are identified by the contents of their FMU files (not by their directories), i.e.,
+    an FMU is reused by runs that use copies of the same FMU file in different directories.
+
+    Start the daemon (optionally with pre-instantiated FMUs) with:
+        python fmu_host.py --work_dir=fmus --preload LSS2_PowerSystem LoadFlow1 --preload LSS2_Controller Controller1
+
+    and pass its address to the simulators (parameter *fmu_host*, e.g., '127.0.0.1:5678').
+
+    Protocol: one JSON-encoded request per line, answered by one JSON-encoded response per line.
+        ["extract", work_dir, model_name]  -> ["ok", URI of extracted FMU]
+        ["lease", spec]                    -> ["ok", handle]
+        ["call", handle, method, args]     -> ["ok", return value of method]
+        ["release", handle]                -> ["ok", null]
+    Errors are answered by ["error", message]. All FMUs leased via a connection are released
+    automatically when the connection is closed.
+"""
+
+import argparse
+import collections
+import hashlib
+import itertools
+import json
+import os.path
+import socket
+import socketserver
+import sys
+import threading
+
+
+DEFAULT_ADDR = '127.0.0.1:5678'
+
+# Specification of an FMU instance, FMUs are only reused for identical specifications. The FMU
+# is identified by the hash of its FMU file (fmu_digest).
+FMUSpec = collections.namedtuple('FMUSpec', ['fmu_digest', 'model_name', 'instance_name',
+    'logging_on', 'time_diff_resolution', 'timeout', 'visible', 'interactive'])
+
+# (path, size, modification time) of FMU files -> hash of their contents.
+_digests = {}
+
+
+def fmu_digest(work_dir, model_name):
+    '''Returns the hash (SHA-256) of the contents of an FMU file (cached as long as the file is not modified).'''
+    path = os.path.join(os.path.abspath(work_dir), model_name + '.fmu')
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if key not in _digests:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''): sha.update(chunk)
+        _digests[key] = sha.hexdigest()
+    return _digests[key]
+
+
+def make_spec(work_dir, model_name, instance_name, logging_on=False, time_diff_resolution=1e-9,
+    timeout=0, visible=False, interactive=False):
+    return FMUSpec(fmu_digest(work_dir, model_name), model_name, instance_name, bool(logging_on),
+        float(time_diff_resolution), timeout, bool(visible), bool(interactive))
+
+
+class FMUPool(object):
+    """
+        Keeps instantiated FMUs and hands them out. Calls to a leased FMU are forwarded
+        unchanged, except for *instantiate*, which is a no-op for warm instances.
+    """
+
+    def __init__(self, verbose=False):
+        import fmipp
+        self.fmipp = fmipp
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.idle = collections.defaultdict(list)   # FMUSpec -> list of idle (reset or terminated) FMU instances
+        self.leased = {}                            # handle -> (FMUSpec, FMU instance)
+        self.extracted = {}                         # (work_dir, model_name) -> URI of extracted FMU
+        self.handles = itertools.count(start=1)
+        self.stats = collections.Counter()          # number of instantiated, reused and dropped FMUs
+
+    def preload(self, spec, work_dir, num=1):
+        '''Instantiate FMUs in advance, so that even the first lease finds a warm instance.'''
+        for i in range(num):
+            fmu = self.instantiate(spec, work_dir)
+            with self.lock:
+                self.idle[spec].append(fmu)
+
+    def extract(self, work_dir, model_name):
+        '''Extract an FMU only once, FMUs in use must not be overwritten (their shared libraries are loaded).'''
+        key = (os.path.abspath(work_dir), model_name)
+        with self.lock:
+            uri = self.extracted.get(key)
+        if uri is None:
+            path_to_fmu = os.path.join(key[0], model_name + '.fmu')
+            uri = self.fmipp.extractFMU(path_to_fmu, key[0])
+            if uri is None:
+                raise RuntimeError('Failed to extract FMU {0}'.format(path_to_fmu))
+            with self.lock:
+                self.extracted[key] = uri
+        return uri
+
+    def instantiate(self, spec, work_dir):
+        uri = self.extract(work_dir, spec.model_name)
+
+        if self.verbose: print('[FMU HOST] instantiate {0} ({1})'.format(spec.model_name, spec.instance_name))
+        fmu = self.fmipp.FMUCoSimulationV1(uri, spec.model_name, spec.logging_on, spec.time_diff_resolution)
+        status = fmu.instantiate(spec.instance_name, spec.timeout, spec.visible, spec.interactive)
+        if status != self.fmipp.fmiOK:
+            raise RuntimeError('Failed to instantiate FMU {0}'.format(spec.model_name))
+        with self.lock:
+            self.stats['instantiated'] += 1
+        return fmu
+
+    def lease(self, spec, work_dir):
+        '''Leases an idle FMU of the specification or instantiates a new one (from the FMU file in *work_dir*).'''
+        with self.lock:
+            fmu = self.idle[spec].pop() if self.idle[spec] else None
+        if fmu is None:
+            fmu = self.instantiate(spec, work_dir)
+        else:
+            with self.lock:
+                self.stats['reused'] += 1
+            if self.verbose: print('[FMU HOST] reuse {0} ({1})'.format(spec.model_name, spec.instance_name))
+
+        with self.lock:
+            handle = next(self.handles)
+            self.leased[handle] = (spec, fmu)
+        return handle
+
+    def call(self, handle, method, args):
+        try:
+            spec, fmu = self.leased[handle]
+        except KeyError:
+            raise RuntimeError('Unknown FMU handle {0}'.format(handle))
+
+        # Leased FMUs are always instantiated already.
+        if method == 'instantiate': return self.fmipp.fmiOK
+        if method.startswith('_'): raise RuntimeError('Method {0} not allowed'.format(method))
+
+        return getattr(fmu, method)(*args)
+
+    def release(self, handle):
+        with self.lock:
+            spec, fmu = self.leased.pop(handle)
+
+        # Reset the FMU so that it can be initialized again. FMUs that cannot be reset (fmiResetSlave not
+        # supported or failed) are terminated instead, the next run initializes the same instance again
+        # (the simulators always call initialize after the lease). FMUs that cannot be terminated either
+        # are dropped, i.e., the next lease instantiates a new FMU.
+        statuses = []
+        for method in ('reset', 'terminate'):
+            status = self.try_call(fmu, method)
+            if status == self.fmipp.fmiOK:
+                if self.verbose and statuses: print('[FMU HOST] terminated {0} ({1}), reset failed (status {2})'.format(
+                    spec.model_name, spec.instance_name, statuses[0]))
+                with self.lock:
+                    self.idle[spec].append(fmu)
+                return
+            statuses.append(status)
+        with self.lock:
+            self.stats['dropped'] += 1
+        print('[FMU HOST] warning: dropped {0} ({1}), reset and terminate failed (status {2})'.format(
+            spec.model_name, spec.instance_name, ', '.join(str(status) for status in statuses)), file=sys.stderr)
+
+    @staticmethod
+    def try_call(fmu, method):
+        '''Calls a method of an FMU without arguments, returns its status or a description of the failure.'''
+        func = getattr(fmu, method, None)
+        if func is None: return 'not supported'
+        try:
+            return func()
+        except Exception as e:
+            return '{0}: {1}'.format(type(e).__name__, e)
+
+    def summary(self):
+        with self.lock:
+            return 'FMUs instantiated: {0}, reused: {1}, dropped: {2}'.format(
+                self.stats['instantiated'], self.stats['reused'], self.stats['dropped'])
+
+
+class FMUHostHandler(socketserver.StreamRequestHandler):
+    '''Serves one client connection (i.e., one simulator).'''
+
+    def handle(self):
+        pool = self.server.pool
+        handles = set()
+        try:
+            for line in self.rfile:
+                request = json.loads(line.decode())
+                try:
+                    if request[0] == 'extract':
+                        result = pool.extract(request[1], request[2])
+                    elif request[0] == 'lease':
+                        result = pool.lease(make_spec(**request[1]), request[1]['work_dir'])
+                        handles.add(result)
+                    elif request[0] == 'call':
+                        result = pool.call(request[1], request[2], request[3])
+                    elif request[0] == 'release':
+                        handles.discard(request[1])
+                        result = pool.release(request[1])
+                    else:
+                        raise RuntimeError('Unknown request {0}'.format(request[0]))
+                    response = ['ok', result]
+                except Exception as e:
+                    response = ['error', '{0}: {1}'.format(type(e).__name__, e)]
+                self.wfile.write((json.dumps(response) + '\n').encode())
+        finally:
+            for handle in handles:
+                pool.release(handle)
+
+
+class FMUHost(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, addr, pool):
+        host, port = addr.split(':')
+        super().__init__((host, int(port)), FMUHostHandler)
+        self.pool = pool
+
+
+class RemoteFMU(object):
+    """
+        Proxy for an FMU leased from the FMU host. Offers the same methods as
+        fmipp.FMUCoSimulationV1 (instantiate, initialize, doStep, getRealValue, ...).
+    """
+
+    def __init__(self, client, handle):
+        self._client = client
+        self._handle = handle
+
+    def __getattr__(self, method):
+        if method.startswith('_'): raise AttributeError(method)
+        return lambda *args: self._client.request('call', self._handle, method, args)
+
+    def release(self):
+        self._client.request('release', self._handle)
+
+
+class FMUHostClient(object):
+    '''Connection to the FMU host.'''
+
+    def __init__(self, addr=DEFAULT_ADDR):
+        host, port = addr.split(':')
+        self.sock = socket.create_connection((host, int(port)))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile('rb')
+
+    def request(self, *request):
+        self.sock.sendall((json.dumps(request) + '\n').encode())
+        status, result = json.loads(self.rfile.readline().decode())
+        if status != 'ok':
+            raise RuntimeError('FMU host: {0}'.format(result))
+        return result
+
+    # Directories are sent as absolute paths, the FMU host may run in another directory.
+    def extract(self, work_dir, model_name):
+        return self.request('extract', os.path.abspath(work_dir), model_name)
+
+    def lease(self, work_dir, model_name, instance_name, **kwargs):
+        spec = dict(work_dir=os.path.abspath(work_dir), model_name=model_name, instance_name=instance_name, **kwargs)
+        return RemoteFMU(self, self.request('lease', spec))
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Host a pool of FMU instances')
+    parser.add_argument('--addr', type=str, help='address to listen on (host:port)', default=DEFAULT_ADDR)
+    parser.add_argument('--work_dir', type=str, help='directory of the FMUs to preload', default='fmus')
+    parser.add_argument('--preload', nargs=2, action='append', metavar=('MODEL_NAME', 'INSTANCE_NAME'),
+        help='instantiate an FMU at start-up', default=[])
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    pool = FMUPool(verbose=args.verbose)
+    for model_name, instance_name in args.preload:
+        pool.preload(make_spec(args.work_dir, model_name, instance_name), args.work_dir)
+
+    server = FMUHost(args.addr, pool)
+    print('FMU host listening on {0}'.format(args.addr))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(pool.summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,6 @@
 import matplotlib.pyplot as plt
-import pandas as pd
 import sys
+from collector_store import read_results
 
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
@@ -10,11 +10,8 @@ if len(sys.argv) > 1:
 else:
     storename = 'erigridstore.h5'
 
-store = pd.HDFStore(storename)
-df = store['Monitor']
-store.close()
-df2 = df.to_frame(False).unstack().dropna(axis=1)
-df2.columns = df2.columns.map('.'.join)
+# One column per attribute, named <simulator>.<entity>.<attribute>. Only the voltages are read.
+df2 = read_results(storename, 'Monitor', columns=['*.U_*']).dropna(axis=1)
 df2.index.name = ""
 df2 = df2.rename(columns=lambda x: '.'.join(x.split('.')[2:]))
 
@@ -1,3 +1,4 @@
+import functools
 import itertools
 import os
 import mosaik_api
@@ -19,7 +20,7 @@ META = {
                 'u_line1_receive',
                 'current_time',
                 'pending_messages'
-            ],
+            ], # Attributes device<k>_send and device<k>_receive of all devices are added in init.
         }
     }
 }
@@ -28,11 +29,30 @@ INPUT_NAME_MAP = {
     'u_line1_send': 'device0_data_send'
 }
 
+
+def instrumented(method):
+    '''Decorator for the calls of mosaik (create, step, get_data): if the simulator is traced, profiled or
+    writes/restores a checkpoint, the call is passed through the decorators of sim_trace.py, sim_profiler.py
+    and sim_checkpoint.py (see LSS2CommNetwork.instrument), otherwise the method is called directly.'''
+    name = method.__name__
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.instrumented is None: return method(self, *args, **kwargs)
+        return self.instrumented[name](self, *args, **kwargs)
+    wrapper.method = method
+    return wrapper
+
+
 class LSS2CommNetwork(mosaik_api.Simulator):
     """
         MosaikTime-based edition of Cornelius' JRA2 TC3 workaround.
         This version meta-izes messages sent through the queue
     """
+
+    # State saved in checkpoints (see sim_checkpoint.py), in addition to the message counters.
+    # The FMU state is restored by replaying its inputs.
+    checkpoint_attrs = [ 'fmutimes', 'fmuwanttimes', 'msgtable', 'outqueue', 'current_time' ]
+
     def __init__(self):
         super(LSS2CommNetwork, self).__init__(META)
         self.sid = None
@@ -63,7 +83,12 @@ class LSS2CommNetwork(mosaik_api.Simulator):
         self.msgtable = {}                  # Tables of messages for translation
         self.msgcounters = {}               # Set of counters for message ID translation
         self.outqueue = {}                  # Holds lists of outputs for various simulators
+        self.input_name_map = {}            # mosaik attribute -> FMU input of the sending device
         self.sec_per_mt = 1                 # Number of seconds of internaltime per mosaiktime
+        self.profiler = None                # Profiler (only if parameter profile is set)
+        self.tracer = None                  # Tracer (only if parameter trace is set)
+        self.checkpoint = None              # Checkpoint to write or restore (only if parameter checkpoint or restore is set)
+        self.instrumented = None            # Decorated calls of mosaik (only if one of the above is set)
         self.verbose = False
 
 
@@ -71,10 +96,12 @@ class LSS2CommNetwork(mosaik_api.Simulator):
               start_time=0, stop_time=0, stop_time_defined=False, seconds_per_mosaik_timestep=1,
               time_diff_resolution=1e-9, logging_on=False, interactive=False, visible=False,
               event_var_name='next_event_time', default_event_step_size=0, random_seed=1,
-              var_table=None, translation_table=None, path_conversion=None, verbose=False
+              var_table=None, translation_table=None, path_conversion=None, profile=None, trace=None,
+              checkpoint=None, checkpoint_time=None, restore=None, verbose=False
               ):
         '''Function that allows mosaik to initialize the simulator. Extract the FMU and construct meta description
         for mosaik.'''
+        init_kwargs = dict( ( name, value ) for name, value in locals().items() if name not in ( 'self', 'sid' ) )
         assert work_dir is not None
         assert model_name is not None
         assert instance_name is not None
@@ -103,6 +130,8 @@ class LSS2CommNetwork(mosaik_api.Simulator):
         self.default_event_step_size = default_event_step_size
         self.random_seed = random_seed
         self.verbose = verbose
+        if profile is not None or trace is not None or checkpoint is not None or restore is not None:
+            self.instrument( sid, profile, trace, checkpoint, checkpoint_time, restore )
 
         path_to_fmu = os.path.join(self.work_dir, self.model_name + '.fmu')
         if self.verbose: print('Attempted to extract FMU {0}, Path {1}'.format(path_to_fmu, self.work_dir))
@@ -125,8 +154,31 @@ class LSS2CommNetwork(mosaik_api.Simulator):
 
         self.adjust_var_table()
 
+        # Besides the signals of INPUT_NAME_MAP, each device can be addressed directly (attributes device<k>_send
+        # and device<k>_receive), e.g., by the feeders of a scenario that share one network.
+        self.input_name_map = dict( INPUT_NAME_MAP )
+        devices = sorted( int( name[6:-10] ) for name in self.translation_table['input']
+            if name.startswith( 'device' ) and name.endswith( '_data_send' ) )
+        for k in devices:
+            self.input_name_map[ 'device{0}_send'.format( k ) ] = 'device{0}_data_send'.format( k )
+            self.meta['models']['LSS2CommNetwork']['attrs'] += [ 'device{0}_send'.format( k ), 'device{0}_receive'.format( k ) ]
+
+        if self.tracer is not None: self.tracer.result( self.tracer.call( 'init', ( sid, ), init_kwargs ), self.meta )
         return self.meta
 
+    def instrument( self, sid, profile, trace, checkpoint, checkpoint_time, restore ):
+        '''Creates the profiler, tracer and checkpoint and wraps the calls of mosaik (like the decorators of the
+        other simulators). Their modules are only imported here, i.e., if they are used.'''
+        import sim_profiler, sim_trace, sim_checkpoint
+        self.profiler = sim_profiler.create( sid, profile )
+        self.tracer = sim_trace.create( self, sid, trace )
+        self.checkpoint = sim_checkpoint.create( self, sid, checkpoint, checkpoint_time, restore )
+        cls = type( self )
+        self.instrumented = { 'create': sim_trace.traced( cls.create.method ) }
+        for name in ( 'step', 'get_data' ):
+            self.instrumented[name] = sim_trace.traced( sim_profiler.profiled( sim_checkpoint.checkpointed( getattr( cls, name ).method ) ) )
+
+    @instrumented
     def create(self, num, model):
         '''Function that allows mosaik the creation of model entities for the connection in co-sim scenarios.'''
         counter = self.eid_counters.setdefault(model, itertools.count())
@@ -138,7 +190,7 @@ class LSS2CommNetwork(mosaik_api.Simulator):
 
             if self.verbose: print('{0}, {1}, {2}, {3}'.format(self.work_dir, self.model_name, self.logging_on, self.time_diff_resolution))
 
-            fmu = FMUCoSimulationV1( self.model_name, self.work_dir )
+            fmu = FMUCoSimulationV1( self.model_name, self.work_dir, profiler=self.profiler )
 
             self._entities[eid] = fmu
             self._entities[eid].instantiateSlave(
@@ -173,10 +225,13 @@ class LSS2CommNetwork(mosaik_api.Simulator):
             # Outbound message queue
             self.outqueue[eid] = {}
 
+            if self.checkpoint is not None: self._entities[eid] = self.checkpoint.fmu( eid, self._entities[eid] )
+
             entities.append({'eid': eid, 'type': model, 'rel': []})
 
         return entities
 
+    @instrumented
     def step(self, time, inputs=None):
         '''Function for stepping of the simulator during the co-simulation process.'''
 
@@ -198,6 +253,8 @@ class LSS2CommNetwork(mosaik_api.Simulator):
             # While we have output messages waiting, step the queue along and store the output in self.outqueue
             while self.fmuwanttimes[eid] < target_time + self.time_diff_resolution:
 
+                if self.profiler is not None: self.profiler.count( 'event_iterations' )
+
                 if self.verbose: print( 'QUEUE: About to step from fmutime = {}, to fmuwanttime = {}'.format( self.fmutimes[eid], self.fmuwanttimes[eid] ) )
 
                 # Update the internal state of the FMU to the time of the next event,
@@ -254,8 +311,8 @@ class LSS2CommNetwork(mosaik_api.Simulator):
                         self.msgtable[eid][msg_id] = [ input_name, val ]
                         if self.verbose:
                             print( 'INPUT MESSAGE: {0} from {1}, assigned msg_id = {2}.'.format( val, input_name, msg_id ) )
-                        self.set_values( eid, { INPUT_NAME_MAP[input_name]: msg_id }, 'input' )
-                        set_inputs.append( INPUT_NAME_MAP[input_name] )
+                        self.set_values( eid, { self.input_name_map[input_name]: msg_id }, 'input' )
+                        set_inputs.append( self.input_name_map[input_name] )
 
             if 0!= len( set_inputs ):
                 # Set all other inputs to -1 (dummy messages).
@@ -280,6 +337,7 @@ class LSS2CommNetwork(mosaik_api.Simulator):
         return time + 1
 
 
+    @instrumented
     def get_data(self, outputs):
         '''Function for obtaining FMU output during co-simulation process.'''
         data = {}
@@ -298,6 +356,31 @@ class LSS2CommNetwork(mosaik_api.Simulator):
 
         return data
 
+    def finalize(self):
+        if self.profiler is not None:
+            self.profiler.write()
+        if self.tracer is not None:
+            self.tracer.close()
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+
+    def get_checkpoint_state(self):
+        import sim_checkpoint
+        state = sim_checkpoint.get_state( self )
+        # Message counters (itertools.count cannot be copied in Python 2) are saved as next message IDs.
+        state['msgcounters'] = {}
+        for eid, counter in self.msgcounters.items():
+            state['msgcounters'][eid] = next( counter )
+            self.msgcounters[eid] = itertools.count( start=state['msgcounters'][eid] )
+        return state
+
+    def set_checkpoint_state(self, state):
+        state = dict( state )
+        for eid, msg_id in state.pop( 'msgcounters' ).items():
+            self.msgcounters[eid] = itertools.count( start=msg_id )
+        import sim_checkpoint
+        sim_checkpoint.set_state( self, state )
+
     def adjust_var_table(self):
         '''Helper function that adds missing keys to the var_table and its associated translation table.
         Avoids errors due to faulty access later on.'''
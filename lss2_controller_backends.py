@@ -0,0 +1,267 @@
+"""
+    Backends for LSS2PeriodicController, i.e., implementations of the tap decision algorithm.
+
+    The algorithm (see fmus/matlab_controller_fmu/LSS2_Controller.m) compares the minimum and
+    maximum of the voltage readings against the limits *vlow* and *vup*: if the maximum exceeds
+    *vup* the tap position is increased, if the minimum falls below *vlow* it is decreased.
+"""
+
+import os.path
+import xml.etree.ElementTree as ETree
+import numpy as np
+from fmu_host import FMUHostClient
+import sim_profiler
+
+
+# Voltage readings used by the control algorithm (in the order expected by the MATLAB FMU).
+INPUT_NAMES = ['u_line1', 'u_line2', 'u_line3', 'u_line4', 'u_line5', 'u_line6', 'u_line7']
+
+
+class ControllerBackend(object):
+    """
+        Interface of controller backends. The controller entities of LSS2PeriodicController
+        are registered with the backend via *create* and identified by their index, i.e.,
+        the order in which they have been created.
+    """
+
+    # State saved in checkpoints of the controller (see sim_checkpoint.py).
+    checkpoint_attrs = []
+
+    def create(self, eids, vlow, vup):
+        '''Create new controller instances (one per entity ID) with voltage limits *vlow* and *vup*.'''
+        raise NotImplementedError
+
+    def decide_on_taps(self, index, time, voltages):
+        '''Return the new tap positions of the controllers with the given indices at *time* (in seconds).
+        Row k of *voltages* holds the latest readings (ordered as INPUT_NAMES) of controller index[k].'''
+        raise NotImplementedError
+
+    def finalize(self):
+        pass
+
+
+class NumpyBackend(ControllerBackend):
+    """
+        Native implementation of the control algorithm, without any external tool.
+    """
+
+    checkpoint_attrs = ['tap']
+
+    def __init__(self, verbose=False, **kwargs):
+        self.vlow = np.empty(0)             # lower voltage limits
+        self.vup = np.empty(0)              # upper voltage limits
+        self.tap = np.empty(0, dtype=int)   # current tap positions
+        self.verbose = verbose
+
+    def create(self, eids, vlow, vup):
+        n = len(eids)
+        self.vlow = np.append(self.vlow, np.full(n, vlow, dtype=float))
+        self.vup = np.append(self.vup, np.full(n, vup, dtype=float))
+        self.tap = np.append(self.tap, np.zeros(n, dtype=int))
+
+    def decide_on_taps(self, index, time, voltages):
+        # All due controllers are evaluated at once.
+        self.tap[index] += voltages.max(axis=1) > self.vup[index]
+        self.tap[index] -= voltages.min(axis=1) < self.vlow[index]
+
+        return self.tap[index]
+
+
+class MatlabFMUBackend(ControllerBackend):
+    """
+        Runs the control algorithm in an FMU exported from MATLAB (via fmipp).
+    """
+
+    # The FMU state is restored by replaying its inputs.
+    checkpoint_attrs = ['fmutimes']
+
+    def __init__(self, work_dir, model_name, instance_name, start_time=0, stop_time=0,
+        logging_on=False, time_diff_resolution=1e-9, timeout=0, interactive=False, visible=False,
+        stop_time_defined=False, var_table=None, translation_table=None, fmu_host=None, profiler=None, checkpoint=None, verbose=False):
+        import fmipp
+        self.fmipp = fmipp
+        self._entities = {}
+        self.eids = []                                      # entity IDs (in the order of creation)
+        self.work_dir = work_dir                            # directory of FMU
+        self.model_name = model_name                        # model name of FMU
+        self.instance_name = instance_name                  # instance name of FMU
+        self.start_time = start_time                        # FMI++ parameter (in seconds)
+        self.stop_time = stop_time                          # FMI++ parameter (in seconds)
+        self.logging_on = logging_on                        # FMI++ parameter
+        self.time_diff_resolution = time_diff_resolution    # FMI++ parameter
+        self.timeout = timeout                              # FMI++ parameter
+        self.interactive = interactive                      # FMI++ parameter
+        self.visible = visible                              # FMI++ parameter
+        self.stop_time_defined = stop_time_defined          # FMI++ parameter
+        self.fmutimes = {}                                  # Keeping track of each FMU's internal time
+        self.profiler = profiler                            # call statistics (see sim_profiler.py)
+        self.checkpoint = checkpoint                        # checkpoint to write or restore (see sim_checkpoint.py)
+        self.verbose = verbose
+
+        # Lease pre-initialized FMUs from a local FMU host (see fmu_host.py) instead of instantiating them.
+        self.fmu_host = FMUHostClient( fmu_host ) if fmu_host is not None else None
+
+        path_to_fmu = os.path.join(self.work_dir, self.model_name + '.fmu')
+        if self.fmu_host is None:
+            self.uri_to_extracted_fmu = fmipp.extractFMU(path_to_fmu, self.work_dir)
+        else:
+            self.uri_to_extracted_fmu = self.fmu_host.extract(self.work_dir, self.model_name)
+        assert self.uri_to_extracted_fmu is not None
+
+        # If no variable table is given by user, parse the modelDescription.xml for a table -
+        # however, this will not work properly for some FMUs due to varying conventions.
+        xmlfile = os.path.join( self.work_dir, self.model_name, 'modelDescription.xml' )
+        if var_table is None:
+            self.var_table, self.translation_table = self.get_var_table( xmlfile )
+        else:
+            self.var_table = var_table
+            self.translation_table = translation_table
+
+        self.adjust_var_table()
+
+
+    def create(self, eids, vlow, vup):
+        for eid in eids:
+            self.create_fmu( eid, vlow, vup )
+            self.eids.append( eid )
+
+
+    def create_fmu(self, eid, vlow, vup):
+        self._entities[eid] = self.new_fmu()
+
+        status = self._entities[eid].instantiate( self.instance_name, self.timeout,
+            self.visible, self.interactive )
+        assert status == self.fmipp.fmiOK
+
+        status = self._entities[eid].initialize( self.start_time,
+            self.stop_time_defined, self.stop_time )
+        assert status == self.fmipp.fmiOK
+
+        # Initialize all voltage inputs to 1.
+        self.set_values( eid, { n: 1. for n in INPUT_NAMES }, 'input' )
+
+        # Set parameters vlow & vup.
+        self.set_values( eid, { 'vlow': vlow, 'vup': vup }, 'input' )
+
+        # Handling tracking internal fmu times
+        self.fmutimes[eid] = self.start_time
+
+        if self.checkpoint is not None: self._entities[eid] = self.checkpoint.fmu( eid, self._entities[eid] )
+
+
+    def advance(self, eid, time):
+        status = self._entities[eid].doStep( self.fmutimes[eid], time - self.fmutimes[eid], True )
+        assert status == self.fmipp.fmiOK
+
+        self.fmutimes[eid] = time
+
+
+    def decide_on_taps(self, index, time, voltages):
+        taps = np.empty( len( index ), dtype=int )
+
+        # Each controller runs in its own FMU instance.
+        for k, i in enumerate( index ):
+            eid = self.eids[i]
+            self.advance( eid, time )
+            taps[k] = self.decide_on_tap( eid, dict( zip( INPUT_NAMES, voltages[k].tolist() ) ) )
+
+        return taps
+
+
+    def decide_on_tap( self, eid, inputs ):
+
+        self.set_values( eid, inputs, 'input' )
+
+        status = self._entities[eid].doStep( self.fmutimes[eid], 0, True )
+        assert status == self.fmipp.fmiOK
+
+        return self.get_value( eid, 'tap' )
+
+
+    def finalize(self):
+        if self.fmu_host is not None:
+            # Hand the FMUs back to the FMU host for the next run.
+            for fmu in self._entities.values(): fmu.release()
+            self.fmu_host.close()
+
+
+    def new_fmu(self):
+        '''Helper function that returns a new FMU instance, either leased from the FMU host or created locally.'''
+        if self.fmu_host is not None:
+            fmu = self.fmu_host.lease( self.work_dir, self.model_name, self.instance_name,
+                logging_on=self.logging_on, time_diff_resolution=self.time_diff_resolution,
+                timeout=self.timeout, visible=self.visible, interactive=self.interactive )
+        else:
+            fmu = self.fmipp.FMUCoSimulationV1( self.uri_to_extracted_fmu, self.model_name,
+                self.logging_on, self.time_diff_resolution )
+
+        # Time the FMI calls if profiling is turned on.
+        return self.profiler.proxy( fmu, sim_profiler.FMU_METHODS ) if self.profiler is not None else fmu
+
+
+    def get_var_table( self, filename ):
+        var_table = {}
+        translation_table = {}
+
+        base = ETree.parse(filename).getroot()
+        mvars = base.find('ModelVariables')
+
+        for var in mvars.findall('ScalarVariable'):
+            causality = var.get('causality')
+            name = var.get('name')
+            if causality in ['input', 'output', 'parameter']:
+                var_table.setdefault(causality, {})
+                translation_table.setdefault(causality, {})
+                # Variable names including '.' cannot be used in Python scripts - they get aliases with '_':
+                if '.' in name:
+                    alt_name = name.replace('.', '_')
+                else:
+                    alt_name = name
+                translation_table[causality][alt_name] = name
+
+                # Store variable type information:
+                specs = list( var )
+                for spec in specs:
+                    if spec.tag in ['Real', 'Integer', 'Boolean', 'String']:
+                        var_table[causality][name] = spec.tag
+                        continue
+
+        return var_table, translation_table
+
+
+    def adjust_var_table(self):
+        '''Helper function that adds missing keys to the var_table and its associated translation table.
+        Avoids errors due to faulty access later on.'''
+        self.var_table.setdefault('parameter', {})
+        self.var_table.setdefault('input', {})
+        self.var_table.setdefault('output', {})
+
+        self.translation_table.setdefault('parameter', {})
+        self.translation_table.setdefault('input', {})
+        self.translation_table.setdefault('output', {})
+
+
+    def set_values(self, eid, val_dict, var_type):
+        '''Helper function to set input variable and parameter values to a FMU instance'''
+        for alt_name, val in val_dict.items():
+            name = self.translation_table[var_type][alt_name]
+            # Obtain setter function according to specified var type (Real, Integer, etc.):
+            set_func = getattr(self._entities[eid], 'set' + self.var_table[var_type][name] + 'Value')
+            set_stat = set_func(name, val)
+            assert set_stat == self.fmipp.fmiOK
+
+
+    def get_value(self, eid, alt_attr):
+        '''Helper function to get output variable values from a FMU instance.'''
+        attr = self.translation_table['output'][alt_attr]
+        # Obtain getter function according to specified var type (Real, Integer, etc.):
+        get_func = getattr(self._entities[eid], 'get' + self.var_table['output'][attr] + 'Value')
+        val = get_func(attr)
+        return val
+
+
+# Available controller backends (see parameter *backend* of LSS2PeriodicController).
+BACKENDS = {
+    'matlab_fmu': MatlabFMUBackend,
+    'numpy': NumpyBackend,
+}
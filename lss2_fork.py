@@ -0,0 +1,108 @@
+"""
+    Runs what-if branches of a LSS2 scenario that share a common prefix: the prefix is simulated
+    once up to the checkpoint time and all simulators (including the collector and its results)
+    write a checkpoint (see sim_checkpoint.py). The branches then start shortly before the
+    checkpoint time and continue from this checkpoint in parallel, each with its own changes of
+    the configuration, e.g.:
+        python lss2_fork.py --config scenarios/lss2_nocomm.json --at 3600 \\
+            --branch base --branch dead_time_5 controller.dead_time=5 --branch vup controller.vup=1.04
+
+    Changes of a branch take effect from the checkpoint time on. They must not change the structure
+    of the scenario (e.g., the number of feeders, the routing of the signals or the controller
+    backend), otherwise the simulators cannot be restored. The results of a branch cover the whole
+    simulation, they are stored in <out_dir>/<branch>.h5 and its output in <out_dir>/<branch>.log.
+    A summary of all runs is written to <out_dir>/branches.json.
+
+    Each run extracts its FMUs from a copy of the FMU files in <out_dir>/fmus/<run>, since runs in
+    parallel (or one after the other in the same process) must not overwrite the shared libraries
+    of FMUs that are loaded. The copy is deleted when the run is finished (see lss2_sweep.run_point).
+
+    The processes are assigned mosaik ports like the workers of lss2_sweep.py.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import lss2_scenario
+import lss2_sweep
+
+
+def scenario_argv(config_file, settings):
+    '''Returns the command line options of lss2_scenario.py for a configuration file with changes.'''
+    argv = ['--config', config_file]
+    for key, value in settings:
+        argv += ['--set', '{0}={1}'.format(key, json.dumps(value))]
+    return argv
+
+
+def fmus(config, out_dir, name):
+    '''Returns the FMU directory of a scenario and the working directory of a run (see lss2_sweep.run_point).'''
+    return (lss2_scenario.fmu_dir(config), os.path.join(out_dir, 'fmus', name))
+
+
+def parse_branch(values):
+    name, settings = values[0], [lss2_scenario.parse_setting(v) for v in values[1:]]
+    return name, settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run what-if branches of a LSS2 scenario from a common checkpoint')
+    parser.add_argument('--config', type=str, help='scenario configuration (JSON file)', required=True)
+    parser.add_argument('--set', type=lss2_scenario.parse_setting, action='append', metavar='KEY=VALUE',
+        help='change an entry of the configuration (prefix and all branches)', default=[])
+    parser.add_argument('--at', type=float, help='checkpoint time in seconds (end of the common prefix)', required=True)
+    parser.add_argument('--branch', type=str, nargs='+', action='append', metavar=('NAME', 'KEY=VALUE'),
+        help='branch name and changes of the configuration from the checkpoint time on', required=True)
+    parser.add_argument('--out_dir', type=str, help='directory of checkpoint, results and logs', default='fork')
+    parser.add_argument('--workers', type=int, help='number of worker processes', default=os.cpu_count())
+    parser.add_argument('--base_port', type=int, help='first mosaik port used by the workers', default=5600)
+    args = parser.parse_args()
+
+    branches = [parse_branch(values) for values in args.branch]
+    names = [name for name, _ in branches]
+    if len(set(names)) != len(names):
+        raise RuntimeError('Branch names must be unique: {0}.'.format(', '.join(names)))
+
+    config = lss2_scenario.load_config(args.config, args.set)
+    if not 0 < args.at < config['time']['stop']:
+        raise RuntimeError('The checkpoint time must be within the simulation (0 to {0} s).'.format(config['time']['stop']))
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    checkpoint_dir = os.path.join(args.out_dir, 'checkpoint')
+
+    counter = multiprocessing.Value('i', 0)
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=lss2_sweep.init_worker,
+            initargs=(counter, args.workers, args.base_port)) as pool:
+        # The common prefix, simulated once.
+        prefix_argv = scenario_argv(args.config, args.set)
+        prefix_argv += ['--checkpoint', checkpoint_dir, '--checkpoint_time', str(args.at),
+            '--output_file', os.path.join(args.out_dir, 'prefix.h5')]
+        _, status, wall_time = pool.submit(lss2_sweep.run_point, 'lss2_scenario', 'prefix', prefix_argv,
+            os.path.join(args.out_dir, 'prefix.log'), fmus(config, args.out_dir, 'prefix')).result()
+        print('prefix {0} ({1:.1f} s): checkpoint at {2} s'.format(status, wall_time, args.at))
+        if status != 'done':
+            raise RuntimeError('The prefix failed, see {0}.'.format(os.path.join(args.out_dir, 'prefix.log')))
+        summary = [{'name': 'prefix', 'settings': args.set, 'status': status, 'wall_time': wall_time}]
+
+        futures = {}
+        for name, settings in branches:
+            output_file = os.path.join(args.out_dir, name + '.h5')
+            branch_argv = scenario_argv(args.config, args.set + settings) + ['--restore', checkpoint_dir, '--output_file', output_file]
+            future = pool.submit(lss2_sweep.run_point, 'lss2_scenario', name, branch_argv, os.path.join(args.out_dir, name + '.log'),
+                fmus(lss2_scenario.load_config(args.config, args.set + settings), args.out_dir, name))
+            futures[future] = (name, settings, output_file)
+        for n, future in enumerate(as_completed(futures), 1):
+            name, settings, output_file = futures[future]
+            _, status, wall_time = future.result()
+            summary.append({'name': name, 'settings': settings, 'output_file': output_file, 'status': status, 'wall_time': wall_time})
+            print('[{0}/{1}] {2} {3} ({4:.1f} s): {5}'.format(n, len(futures), name, status, wall_time, settings))
+
+    with open(os.path.join(args.out_dir, 'branches.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
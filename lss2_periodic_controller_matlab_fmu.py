@@ -1,277 +1,221 @@
 """
     A controller implementing a (too) simple coordinated voltage control algorithm.
+
+    The tap decision is delegated to a controller backend (see lss2_controller_backends.py),
+    either an FMU exported from MATLAB ('matlab_fmu') or a native implementation ('numpy').
 """
 
-import collections
-import mosaik_api
+import math
+import mosaik_api_v3
+import numpy as np
 from itertools import count
-import fmipp
-import xml.etree.ElementTree as ETree
-import os.path
+from lss2_controller_backends import BACKENDS, INPUT_NAMES
+import sim_profiler
+import sim_trace
+import sim_checkpoint
 
 
 META = {
+    'type': 'hybrid',
     'models': {
         'LSS2PeriodicController': {
             'public': True,
             'params': ['vlow', 'vup', 'phase_shift', 'period'],
-            'attrs': ['u_line1', 'u_line2', 'u_line3', 'u_line4', 'u_line5', 'u_line6', 'u_line7', 'tap'],
+            'attrs': ['u_line1', 'u_line2', 'u_line3', 'u_line4', 'u_line5', 'u_line6', 'u_line7', 'readings', 'tap'],
+            'trigger': ['u_line1', 'u_line2', 'u_line3', 'u_line4', 'u_line5', 'u_line6', 'u_line7', 'readings'],
+            'non-persistent': ['tap'], # Tap positions are only sent when the controller decides on a new one.
         },
     },
 }
 
 
 
-class LSS2PeriodicController(mosaik_api.Simulator):
+class LSS2PeriodicController(mosaik_api_v3.Simulator):
+    """
+        All controller entities of this simulator form a bank: their state is kept in NumPy arrays
+        (one element per entity), so that all due tap decisions are evaluated in one pass.
+    """
+
+    # State saved in checkpoints (see sim_checkpoint.py), in addition to the state of the backend.
+    checkpoint_attrs = [ 'next_send_time', 'voltages', 'tap', 'has_tap', 'is_responsive', 'wakeup_time' ]
 
     def __init__(self):
         super().__init__(META)
-        self.data = collections.defaultdict(dict)
-        self._entities = {}
+        self.eids = []                                  # entity IDs (in the order of creation)
+        self.index = {}                                 # entity ID -> index in the state arrays
         self.eid_counters = {}
-        self.period = {}
-        self.next_send_time = {}
-        self.controller_inputs = {}
-        self.input_names = []               # list of input variable names for the FMU
-        self.is_responsive = {}             # controller state regarding dead time
-        self.wakeup_time = {}               # time stamp until end of dead time
-        self.dead_time = 0                  # dead time of controller
-        self.work_dir = None                # directory of FMU
-        self.model_name = None              # model name of FMU
-        self.instance_name = None           # instance name of FMU
-        self.var_table = None               # dict of FMU variables (input, output, parameters)
-        self.translation_table = None       # help dict if variable names cannot be parsed properly in Python
-        self.logging_on = False             # FMI++ parameter
-        self.time_diff_resolution = 1e-9    # FMI++ parameter
-        self.timeout = 0                    # FMI++ parameter
-        self.interactive = False            # FMI++ parameter
-        self.visible = False                # FMI++ parameter
-        self.start_time = 0                 # FMI++ parameter
-        self.stop_time = 0                  # FMI++ parameter
-        self.stop_time_defined = False      # FMI++ parameter
-        self.uri_to_extracted_fmu = None
-        self.sec_per_mt = 1                 # Number of seconds of internaltime per mosaiktime
-        self.fmutimes = {}                  # Keeping track of each FMU's internal time
+        self.input_names = INPUT_NAMES                  # list of input variable names of the controller
+        self.input_index = { n: i for i, n in enumerate( INPUT_NAMES ) }
+        self.period = np.empty(0)                       # control periods (in seconds)
+        self.next_send_time = np.empty(0)               # next send times (in seconds)
+        self.voltages = np.empty( ( 0, len( INPUT_NAMES ) ) ) # latest voltage readings
+        self.tap = np.empty( 0, dtype=int )             # latest tap decisions
+        self.has_tap = np.empty( 0, dtype=bool )        # whether a tap decision is pending
+        self.is_responsive = np.empty( 0, dtype=bool )  # controller state regarding dead time
+        self.wakeup_time = np.empty( 0, dtype=int )     # time stamp until end of dead time
+        self.dead_time = 0                              # dead time of controller
+        self.backend = None                             # implementation of the control algorithm
+        self.start_time = 0                             # FMI++ parameter
+        self.sec_per_mt = 1                             # Number of seconds of internaltime per mosaiktime
+        self.profiler = None                            # call statistics (if profiling is turned on, see sim_profiler.py)
+        self.tracer = None                              # trace of the calls (if tracing is turned on, see sim_trace.py)
+        self.checkpoint = None                          # checkpoint to write or restore (see sim_checkpoint.py)
         self.verbose = False
 
 
-    def init( self, sid, work_dir, model_name, instance_name, dead_time=0, start_time=0, stop_time=0,
+    @sim_trace.traced
+    def init( self, sid, work_dir=None, model_name=None, instance_name=None, dead_time=0, start_time=0, stop_time=0,
         logging_on = False, time_diff_resolution=1e-9, timeout=0, interactive=False, visible=False,
-        stop_time_defined=False, seconds_per_mosaik_timestep=1, var_table=None, translation_table=None,
-        verbose=False ):
+        stop_time_defined=False, seconds_per_mosaik_timestep=1, var_table=None, translation_table=None, fmu_host=None,
+        backend='matlab_fmu', profile=None, trace=None, checkpoint=None, checkpoint_time=None, restore=None, verbose=False, time_resolution=1. ):
 
         self.dead_time = dead_time / seconds_per_mosaik_timestep
-        self.work_dir = work_dir
-        self.model_name = model_name
-        self.instance_name = instance_name
         self.start_time = start_time
-        self.stop_time = stop_time
-        self.logging_on = logging_on
-        self.time_diff_resolution = time_diff_resolution # How close should two events be to be considered equal?
-        self.timeout = timeout
-        self.interactive = interactive
-        self.visible = visible
-        self.stop_time_defined = stop_time_defined
         self.sec_per_mt = seconds_per_mosaik_timestep # Number of seconds of internaltime per mosaiktime (Default: 1, mosaiktime measured in seconds)
         self.verbose = verbose
-
-        path_to_fmu = os.path.join(self.work_dir, self.model_name + '.fmu')
-        self.uri_to_extracted_fmu = fmipp.extractFMU(path_to_fmu, self.work_dir)
-        assert self.uri_to_extracted_fmu is not None
-
-        # If no variable table is given by user, parse the modelDescription.xml for a table -
-        # however, this will not work properly for some FMUs due to varying conventions.
-        xmlfile = os.path.join( self.work_dir, self.model_name, 'modelDescription.xml' )
-        if var_table is None:
-            self.var_table, self.translation_table = self.get_var_table( xmlfile )
-        else:
-            self.var_table = var_table
-            self.translation_table = translation_table
-
-        self.adjust_var_table()
+        self.profiler = sim_profiler.create( sid, profile )
+        self.tracer = sim_trace.create( self, sid, trace )
+        self.checkpoint = sim_checkpoint.create( self, sid, checkpoint, checkpoint_time, restore )
+
+        try:
+            backend_class = BACKENDS[backend]
+        except KeyError:
+            raise RuntimeError("Unknown controller backend {0} (available: {1})".format(backend, ', '.join(BACKENDS)))
+
+        # FMU-related parameters are only used by the 'matlab_fmu' backend.
+        self.backend = backend_class( work_dir=work_dir, model_name=model_name, instance_name=instance_name,
+            start_time=start_time*self.sec_per_mt, stop_time=stop_time*self.sec_per_mt,
+            logging_on=logging_on, time_diff_resolution=time_diff_resolution, timeout=timeout,
+            interactive=interactive, visible=visible, stop_time_defined=stop_time_defined,
+            var_table=var_table, translation_table=translation_table, fmu_host=fmu_host, profiler=self.profiler, checkpoint=self.checkpoint,
+            verbose=verbose )
 
         return self.meta
 
 
+    @sim_trace.traced
     def create(self, num, model, vlow=0.95, vup=1.05, phase_shift=0., period=60.):
-        counter = self.eid_counters.get(model, count())
+        counter = self.eid_counters.setdefault(model, count())
 
         # If negative, convert phase shift to equivalent positive value.
         while phase_shift < 0.: phase_shift = phase_shift + period
 
-        entities = []
-
-        for i in range(num):
-            eid = '%s_%s' % (model, next(counter))  # entity ID
-
-            fmu = fmipp.FMUCoSimulationV1( self.uri_to_extracted_fmu, self.model_name,
-                self.logging_on, self.time_diff_resolution )
-            self._entities[eid] = fmu
-
-            self.period[eid] = period
-            self.next_send_time[eid] = phase_shift
-            self.controller_inputs[eid] = {}
-
-            status = self._entities[eid].instantiate( self.instance_name, self.timeout,
-                self.visible, self.interactive )
-            assert status == fmipp.fmiOK
-
-            status = self._entities[eid].initialize( self.start_time*self.sec_per_mt,
-                self.stop_time_defined, self.stop_time*self.sec_per_mt )
-            assert status == fmipp.fmiOK
-
-            self.data[eid] = { 'tap': 0 }
+        eids = [ '%s_%s' % (model, next(counter)) for i in range(num) ]  # entity IDs
 
-            # All simulator attributes except the last ones (tap) are inputs to the FMU.
-            # Initialize all these inputs to 1.
-            self.input_names = META['models']['LSS2PeriodicController']['attrs'][:-1]
-            self.set_values( eid, { n: 1. for n in self.input_names }, 'input' )
+        for eid in eids:
+            self.index[eid] = len( self.eids )
+            self.eids.append( eid )
 
-            # Set parameters vlow & vup.
-            self.set_values( eid, { 'vlow': vlow, 'vup': vup }, 'input' )
+        self.backend.create( eids, vlow, vup )
 
-            self.is_responsive[eid] = True
-            self.wakeup_time[eid] = None
+        # Extend the state arrays by the new controllers. The voltage readings are
+        # initialized to 1 (like the inputs of the MATLAB FMU).
+        self.period = np.append( self.period, np.full( num, period, dtype=float ) )
+        self.next_send_time = np.append( self.next_send_time, np.full( num, phase_shift, dtype=float ) )
+        self.voltages = np.vstack( [ self.voltages, np.ones( ( num, len( self.input_names ) ) ) ] )
+        self.tap = np.append( self.tap, np.zeros( num, dtype=int ) )
+        self.has_tap = np.append( self.has_tap, np.zeros( num, dtype=bool ) )
+        self.is_responsive = np.append( self.is_responsive, np.ones( num, dtype=bool ) )
+        self.wakeup_time = np.append( self.wakeup_time, np.zeros( num, dtype=int ) )
 
-            # Handling tracking internal fmu times
-            self.fmutimes[eid] = self.start_time*self.sec_per_mt
+        return [ { 'eid': eid, 'type': model, 'rel': [] } for eid in eids ]
 
-            entities.append( { 'eid': eid, 'type': model, 'rel': [] } )
 
-        return entities
-
-
-    def step(self, time, inputs):
+    @sim_trace.traced
+    @sim_profiler.profiled
+    @sim_checkpoint.checkpointed
+    def step(self, time, inputs, max_advance=None):
         # This is the internal time.
         target_time = ( time + self.start_time )*self.sec_per_mt
 
-        for eid, fmu in self._entities.items():
-            status = fmu.doStep( self.fmutimes[eid], target_time - self.fmutimes[eid], True )
-            assert status == fmipp.fmiOK
-
-            self.fmutimes[eid] += target_time - self.fmutimes[eid]
+        # Only the controllers that actually received new readings are touched.
+        for eid, input_data in inputs.items():
+            i = self.index[eid]
+            for n, values in input_data.items():
+                for u in values.values():
+                    if u is None: continue
+                    # Attribute 'readings' receives several readings at once (see PeriodicGroupSender).
+                    readings = u if 'readings' == n else { n: u }
+                    for m, v in readings.items():
+                        if v is None: continue
+                        self.voltages[i, self.input_index[m]] = v
+                        if self.verbose:
+                            print( '[CONTROLLER] input at time = {}: {} = {}'.format( target_time, m, v ) )
 
-        for eid, edata in self.data.items():
-            input_data = inputs.get(eid, {})
+        # Controllers in dead time wake up (they decide on new taps in a later step at the earliest).
+        waking = ~self.is_responsive & ( self.wakeup_time <= time )
 
-            controller_inputs = self.controller_inputs[eid]
+        # Responsive controllers decide on new taps at their send times, all others have no new taps.
+        due = self.is_responsive & ( self.to_mosaik_time( self.next_send_time ) <= time )
+        self.has_tap[self.is_responsive] = False
 
-            for n in self.input_names:
-                [ ( _, u ) ] = input_data[n].items() if n in input_data else [ ( None, None ) ]
-                if u is not None:
-                    controller_inputs[n] = u
-                    if self.verbose:
-                        print( '[CONTROLLER] input at time = {}: {} = {}'.format( target_time, n, u ) )
+        if due.any():
+            index = np.flatnonzero( due )
+            self.tap[index] = self.backend.decide_on_taps( index, target_time, self.voltages[index] )
+            self.has_tap[index] = True
+            if self.verbose:
+                for i in index:
+                    print( "[CONTROLLER] decided on tap {} at time {}".format( self.tap[i], time ) )
 
-            if True is self.is_responsive[eid]: # Controller is responsive.
-                if target_time == self.next_send_time[eid]:
-                    new_tap = self.decide_on_tap(eid, controller_inputs)
-                    edata['tap'] = new_tap
-                    if self.verbose:
-                        print( "[CONTROLLER] decided on tap {} at time {}".format( new_tap, time ) )
+            # Compute next send times.
+            self.next_send_time[index] += self.period[index]
 
-                    # Compute next send time.
-                    self.next_send_time[eid] = self.next_send_time[eid] + self.period[eid]
+            # Enter dead time (the controllers wake up in a later step at the earliest).
+            self.is_responsive[index] = False
+            self.wakeup_time[index] = max( time + 1, int( math.ceil( time + self.dead_time ) ) )
 
-                    # Enter dead time.
-                    self.is_responsive[eid] = False
-                    self.wakeup_time[eid] = time + self.dead_time
-                else:
-                    edata['tap'] = None # No inputs --> no output.
-            else: # Controller is not responsive (dead time).
-                if time >= self.wakeup_time[eid]:
-                    self.wakeup_time[eid] = None
-                    self.is_responsive[eid] = True
+        self.is_responsive[waking] = True
 
+        # Compute next time for sending (or waking up). In between, the controller is only stepped when new
+        # measurements arrive.
+        return self.next_step_time( time )
 
-        # Compute next time for sending
-        return time + 1
 
+    def next_step_time(self, time):
+        '''Returns the earliest mosaik time at which a controller either decides on a tap or leaves its dead time.
+        A send time that falls into a dead time is handled right after the controller has woken up.'''
+        if not self.eids: return None
 
-    def decide_on_tap( self, eid, inputs ):
+        next_time = np.where( self.is_responsive, self.to_mosaik_time( self.next_send_time ), self.wakeup_time ).min()
+        return max( int( next_time ), time + 1 )
 
-        self.set_values( eid, inputs, 'input' )
 
-        status = self._entities[eid].doStep( self.fmutimes[eid], 0, True )
-        assert status == fmipp.fmiOK
-
-        return self.get_value( eid, 'tap' )
+    def to_mosaik_time(self, t):
+        '''Converts internal time (in seconds) to mosaik time.'''
+        return np.rint( t / self.sec_per_mt ).astype( int ) - self.start_time
 
 
+    @sim_trace.traced
+    @sim_profiler.profiled
+    @sim_checkpoint.checkpointed
     def get_data(self, outputs):
+        # Only send actual set-points (i.e., taps decided on by controllers that are responsive
+        # again), otherwise the receivers would be triggered in every step.
         data = {}
-        for eid, edata in self.data.items():
-            requests = outputs[eid]
-            mydata = {}
-            for attr in requests:
-                try:
-                    mydata[attr] = edata[attr] if self.is_responsive[eid] is True else None
-                except KeyError:
-                    raise RuntimeError("OLTC controller has no attribute {0}".format(attr))
-            data[eid] = mydata
+        for i in np.flatnonzero( self.has_tap & self.is_responsive ):
+            eid = self.eids[i]
+            if eid not in outputs: continue
+            for attr in outputs[eid]:
+                if attr != 'tap': raise RuntimeError("OLTC controller has no attribute {0}".format(attr))
+                data[eid] = { 'tap': int( self.tap[i] ) }
         return data
 
 
-    def get_var_table( self, filename ):
-        var_table = {}
-        translation_table = {}
-
-        base = ETree.parse(filename).getroot()
-        mvars = base.find('ModelVariables')
-
-        for var in mvars.findall('ScalarVariable'):
-            causality = var.get('causality')
-            name = var.get('name')
-            if causality in ['input', 'output', 'parameter']:
-                var_table.setdefault(causality, {})
-                translation_table.setdefault(causality, {})
-                # Variable names including '.' cannot be used in Python scripts - they get aliases with '_':
-                if '.' in name:
-                    alt_name = name.replace('.', '_')
-                else:
-                    alt_name = name
-                translation_table[causality][alt_name] = name
-
-                # Store variable type information:
-                specs = var.getchildren()
-                for spec in specs:
-                    if spec.tag in ['Real', 'Integer', 'Boolean', 'String']:
-                        var_table[causality][name] = spec.tag
-                        continue
-
-        return var_table, translation_table
-
-
-    def adjust_var_table(self):
-        '''Helper function that adds missing keys to the var_table and its associated translation table.
-        Avoids errors due to faulty access later on.'''
-        self.var_table.setdefault('parameter', {})
-        self.var_table.setdefault('input', {})
-        self.var_table.setdefault('output', {})
-
-        self.translation_table.setdefault('parameter', {})
-        self.translation_table.setdefault('input', {})
-        self.translation_table.setdefault('output', {})
+    def get_checkpoint_state(self):
+        return { 'controller': sim_checkpoint.get_state( self ), 'backend': sim_checkpoint.get_state( self.backend ) }
 
 
-    def set_values(self, eid, val_dict, var_type):
-        '''Helper function to set input variable and parameter values to a FMU instance'''
-        for alt_name, val in val_dict.items():
-            name = self.translation_table[var_type][alt_name]
-            # Obtain setter function according to specified var type (Real, Integer, etc.):
-            set_func = getattr(self._entities[eid], 'set' + self.var_table[var_type][name] + 'Value')
-            set_stat = set_func(name, val)
-            assert set_stat == fmipp.fmiOK
+    def set_checkpoint_state(self, state):
+        sim_checkpoint.set_state( self, state['controller'] )
+        sim_checkpoint.set_state( self.backend, state['backend'] )
 
 
-    def get_value(self, eid, alt_attr):
-        '''Helper function to get output variable values from a FMU instance.'''
-        attr = self.translation_table['output'][alt_attr]
-        # Obtain getter function according to specified var type (Real, Integer, etc.):
-        get_func = getattr(self._entities[eid], 'get' + self.var_table['output'][attr] + 'Value')
-        val = get_func(attr)
-        return val
+    def finalize(self):
+        self.backend.finalize()
+        if self.profiler is not None: self.profiler.write()
+        if self.tracer is not None: self.tracer.close()
+        if self.checkpoint is not None: self.checkpoint.close()
 
 
 if __name__ == '__main__':
-    mosaik_api.start_simulation(LSS2PeriodicController())
+    mosaik_api_v3.start_simulation(LSS2PeriodicController())
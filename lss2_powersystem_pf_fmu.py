@@ -3,31 +3,45 @@
 """
 
 import collections
-import mosaik_api
+import copy
+import mosaik_api_v3
 from itertools import count
-import fmipp
 import xml.etree.ElementTree as ETree
 import os.path
+from fmu_host import FMUHostClient
+import sim_profiler
+import sim_trace
+import sim_checkpoint
 import math
+import re
 
 
 META = {
+    'type': 'hybrid',
     'models': {
         'LSS2PowerSystem': {
             'public': True,
             'params': [],
-            'attrs': ['tap', 'U_1_60', 'U_2_32', 'U_3_32', 'U_4_19', 'U_5_15', 'U_6_15', 'U_7_10', 'current_tap'],
+            'attrs': ['tap', 'current_tap'], # FMU outputs are added in init (see function get_output_attrs).
+            'trigger': ['tap'], # New tap positions wake up the simulator in between regular load flow calculations.
         },
     },
 }
 
+# Status fmiOK of the FMI 1.0 standard (fmipp is only imported when FMUs are instantiated locally).
+FMI_OK = 0
 
 
-class LSS2PowerSystem(mosaik_api.Simulator):
+class LSS2PowerSystem(mosaik_api_v3.Simulator):
+
+    # State saved in checkpoints (see sim_checkpoint.py), the FMU state is restored by replaying its inputs.
+    checkpoint_attrs = [ 'fmutimes', 'current_tap', 'data', 'subscriptions' ]
 
     def __init__(self):
-        super().__init__(META)
+        super().__init__(copy.deepcopy(META))
         self.data = collections.defaultdict(dict)
+        self.output_attrs = {}              # mosaik attribute -> (translated) name of FMU output
+        self.subscriptions = {}             # set of mosaik attributes that are actually requested (per entity)
         self._entities = {}
         self.eid_counters = {}
         self.work_dir = None                # directory of FMU
@@ -46,16 +60,21 @@ class LSS2PowerSystem(mosaik_api.Simulator):
         self.stop_time = 0                  # FMI++ parameter
         self.stop_time_defined = False      # FMI++ parameter
         self.uri_to_extracted_fmu = None
+        self.fmu_host = None                # connection to FMU host (if FMUs are leased from a pool)
         self.fmutimes = {}                  # Keeping track of each FMU's internal time
         self.sec_per_mt = 1                 # Number of seconds of internaltime per mosaiktime
-        self.current_tap = 0
+        self.current_tap = {}               # latest tap position of each entity
+        self.profiler = None                # call statistics (if profiling is turned on, see sim_profiler.py)
+        self.tracer = None                  # trace of the calls (if tracing is turned on, see sim_trace.py)
+        self.checkpoint = None              # checkpoint to write or restore (see sim_checkpoint.py)
         self.verbose = False
 
 
+    @sim_trace.traced
     def init( self, sid, work_dir, model_name, instance_name, step_size, start_time=0, stop_time=0,
         logging_on = False, time_diff_resolution=1e-9, timeout=0, interactive=False, visible=False,
-        stop_time_defined=False, seconds_per_mosaik_timestep=1, var_table=None, translation_table=None,
-        verbose=False ):
+        stop_time_defined=False, seconds_per_mosaik_timestep=1, var_table=None, translation_table=None, fmu_host=None,
+        outputs_file=None, profile=None, trace=None, checkpoint=None, checkpoint_time=None, restore=None, verbose=False, time_resolution=1. ):
 
         self.step_size = step_size
         self.work_dir = work_dir
@@ -71,10 +90,20 @@ class LSS2PowerSystem(mosaik_api.Simulator):
         self.stop_time_defined = stop_time_defined
         self.sec_per_mt = seconds_per_mosaik_timestep # Number of seconds of internaltime per mosaiktime (Default: 1, mosaiktime measured in seconds)
         self.verbose = verbose
+        self.profiler = sim_profiler.create( sid, profile )
+        self.tracer = sim_trace.create( self, sid, trace )
+        self.checkpoint = sim_checkpoint.create( self, sid, checkpoint, checkpoint_time, restore )
+
+        # Lease pre-initialized FMUs from a local FMU host (see fmu_host.py) instead of instantiating them.
+        if fmu_host is not None: self.fmu_host = FMUHostClient( fmu_host )
 
         path_to_fmu = os.path.join(self.work_dir, self.model_name + '.fmu')
         if self.verbose: print('Attempted to extract FMU {0}, Path {1}'.format(path_to_fmu, self.work_dir))
-        self.uri_to_extracted_fmu = fmipp.extractFMU(path_to_fmu, self.work_dir)
+        if self.fmu_host is None:
+            import fmipp
+            self.uri_to_extracted_fmu = fmipp.extractFMU(path_to_fmu, self.work_dir)
+        else:
+            self.uri_to_extracted_fmu = self.fmu_host.extract(self.work_dir, self.model_name)
         assert self.uri_to_extracted_fmu is not None
 
         '''If no variable table is given by user, parse the modelDescription.xml for a table -
@@ -88,9 +117,16 @@ class LSS2PowerSystem(mosaik_api.Simulator):
 
         self.adjust_var_table()
 
+        # Expose the FMU outputs as mosaik attributes. By default, all outputs listed in the model description
+        # are exposed, optionally this can be restricted to the outputs listed in a file (e.g., 'outputs.txt').
+        output_names = self.read_outputs_file( outputs_file ) if outputs_file is not None else None
+        self.output_attrs = self.get_output_attrs( output_names )
+        self.meta['models']['LSS2PowerSystem']['attrs'] += sorted( self.output_attrs.keys() )
+
         return self.meta
 
 
+    @sim_trace.traced
     def create(self, num, model):
         counter = self.eid_counters.get(model, count())
 
@@ -101,44 +137,43 @@ class LSS2PowerSystem(mosaik_api.Simulator):
 
             if self.verbose: print('{0}, {1}, {2}, {3}'.format(self.uri_to_extracted_fmu, self.model_name, self.logging_on, self.time_diff_resolution))
 
-            fmu = fmipp.FMUCoSimulationV1( self.uri_to_extracted_fmu, self.model_name,
-                self.logging_on, self.time_diff_resolution )
+            fmu = self.new_fmu()
             self._entities[eid] = fmu
 
             status = self._entities[eid].instantiate( self.instance_name, self.timeout,
                 self.visible, self.interactive )
-            assert status == fmipp.fmiOK
+            assert status == FMI_OK
 
             status = self._entities[eid].initialize( self.start_time*self.sec_per_mt,
                 self.stop_time_defined, self.stop_time*self.sec_per_mt )
-            assert status == fmipp.fmiOK
-
-            self.data[eid] = {
-                'U_1_60': self.get_value( eid, 'ElmTerm_bus_1_60_m:u' ),
-                'U_2_32': self.get_value( eid, 'ElmTerm_bus_2_32_m:u' ),
-                'U_3_32': self.get_value( eid, 'ElmTerm_bus_3_32_m:u' ),
-                'U_4_19': self.get_value( eid, 'ElmTerm_bus_4_19_m:u' ),
-                'U_5_15': self.get_value( eid, 'ElmTerm_bus_5_15_m:u' ),
-                'U_6_15': self.get_value( eid, 'ElmTerm_bus_6_15_m:u' ),
-                'U_7_10': self.get_value( eid, 'ElmTerm_bus_7_10_m:u' ),
-                'current_tap': self.current_tap
-            }
+            assert status == FMI_OK
+
+            # FMU outputs are only retrieved once they are requested (see function get_data).
+            self.subscriptions[eid] = set()
+            self.current_tap[eid] = 0
+            self.data[eid] = { 'current_tap': self.current_tap[eid] }
 
             # Handling tracking internal fmu times
             self.fmutimes[eid] = self.start_time*self.sec_per_mt
 
+            if self.checkpoint is not None: self._entities[eid] = self.checkpoint.fmu( eid, self._entities[eid] )
+
             entities.append( { 'eid': eid, 'type': model, 'rel': [] } )
 
         return entities
 
 
-    def step(self, time, inputs):
+    @sim_trace.traced
+    @sim_profiler.profiled
+    @sim_checkpoint.checkpointed
+    def step(self, time, inputs, max_advance=None):
         #print( 'LOADFLOW called at t = {}'.format( time ) )
 
         # This is the internal time.
         target_time = ( time + self.start_time )*self.sec_per_mt
 
-        for eid, input_data in inputs.items():
+        for eid in self._entities.keys():
+            input_data = inputs.get( eid, {} )
 
             [ ( _, tap ) ] = input_data['tap'].items() if 'tap' in input_data else [ ( None, None ) ]
 
@@ -151,7 +186,7 @@ class LSS2PowerSystem(mosaik_api.Simulator):
 
                 if tap is not None:
                     fmu_inputs['ElmTr2_trafo1_nntap'] = tap
-                    self.current_tap = tap
+                    self.current_tap[eid] = tap
 
                 self.set_values( eid, fmu_inputs, 'input' )
 
@@ -159,30 +194,37 @@ class LSS2PowerSystem(mosaik_api.Simulator):
                 communication_point = self.fmutimes[eid]
                 communication_step_size = target_time - self.fmutimes[eid]
                 status = self._entities[eid].doStep( communication_point, communication_step_size, True )
-                assert status == fmipp.fmiOK
+                assert status == FMI_OK
 
                 self.fmutimes[eid] += communication_step_size
 
-                self.data[eid] = {
-                    'U_1_60': self.get_value( eid, 'ElmTerm_bus_1_60_m:u' ),
-                    'U_2_32': self.get_value( eid, 'ElmTerm_bus_2_32_m:u' ),
-                    'U_3_32': self.get_value( eid, 'ElmTerm_bus_3_32_m:u' ),
-                    'U_4_19': self.get_value( eid, 'ElmTerm_bus_4_19_m:u' ),
-                    'U_5_15': self.get_value( eid, 'ElmTerm_bus_5_15_m:u' ),
-                    'U_6_15': self.get_value( eid, 'ElmTerm_bus_6_15_m:u' ),
-                    'U_7_10': self.get_value( eid, 'ElmTerm_bus_7_10_m:u' ),
-                    'current_tap': self.current_tap
-                }
+                # Only retrieve the outputs that are connected to other simulators.
+                self.data[eid] = { attr: self.get_value( eid, self.output_attrs[attr] ) for attr in self.subscriptions[eid] }
+                self.data[eid]['current_tap'] = self.current_tap[eid]
+
+        # Schedule the next regular load flow calculation. In between, the simulator
+        # is only woken up by mosaik in case a new tap position arrives.
+        return self.next_step_time( time )
 
-        return time + 1 # self.step_size
 
+    def next_step_time(self, time):
+        '''Returns the next mosaik time that is a multiple of the step size.'''
+        return int( ( time // self.step_size + 1 ) * self.step_size )
 
+
+    @sim_trace.traced
+    @sim_profiler.profiled
+    @sim_checkpoint.checkpointed
     def get_data(self, outputs):
         data = {}
         for eid, edata in self.data.items():
             requests = outputs[eid]
             mydata = {}
             for attr in requests:
+                if attr not in edata and attr in self.output_attrs:
+                    # First request for this output, retrieve it from now on after each load flow calculation.
+                    self.subscriptions[eid].add( attr )
+                    edata[attr] = self.get_value( eid, self.output_attrs[attr] )
                 try:
                     mydata[attr] = edata[attr]
                 except KeyError:
@@ -191,6 +233,31 @@ class LSS2PowerSystem(mosaik_api.Simulator):
         return data
 
 
+    def finalize(self):
+        if self.fmu_host is not None:
+            # Hand the FMUs back to the FMU host for the next run.
+            for fmu in self._entities.values(): fmu.release()
+            self.fmu_host.close()
+        if self.profiler is not None: self.profiler.write()
+        if self.tracer is not None: self.tracer.close()
+        if self.checkpoint is not None: self.checkpoint.close()
+
+
+    def new_fmu(self):
+        '''Helper function that returns a new FMU instance, either leased from the FMU host or created locally.'''
+        if self.fmu_host is not None:
+            fmu = self.fmu_host.lease( self.work_dir, self.model_name, self.instance_name,
+                logging_on=self.logging_on, time_diff_resolution=self.time_diff_resolution,
+                timeout=self.timeout, visible=self.visible, interactive=self.interactive )
+        else:
+            import fmipp
+            fmu = fmipp.FMUCoSimulationV1( self.uri_to_extracted_fmu, self.model_name,
+                self.logging_on, self.time_diff_resolution )
+
+        # Time the FMI calls if profiling is turned on.
+        return self.profiler.proxy( fmu, sim_profiler.FMU_METHODS ) if self.profiler is not None else fmu
+
+
     def get_var_table( self, filename ):
         var_table = {}
         translation_table = {}
@@ -212,7 +279,7 @@ class LSS2PowerSystem(mosaik_api.Simulator):
                 translation_table[causality][alt_name] = name
 
                 # Store variable type information:
-                specs = var.getchildren()
+                specs = list( var )
                 for spec in specs:
                     if spec.tag in ['Real', 'Integer', 'Boolean', 'String']:
                         var_table[causality][name] = spec.tag
@@ -221,6 +288,30 @@ class LSS2PowerSystem(mosaik_api.Simulator):
         return var_table, translation_table
 
 
+    def get_output_attrs( self, output_names=None ):
+        '''Returns a dict mapping mosaik attribute names to the (translated) names of the FMU outputs.
+        Bus voltages (e.g., 'ElmTerm.bus_1_60.m:u') are available with a short name (e.g., 'U_1_60'),
+        all other outputs (e.g., line loadings or losses) are available with their translated name.'''
+        output_attrs = {}
+        for alt_name, name in self.translation_table['output'].items():
+            if output_names is not None and name not in output_names: continue
+            match = re.fullmatch( r'ElmTerm_(bus_)?(.+)_m:u', alt_name )
+            attr = 'U_' + match.group(2) if match else alt_name
+            output_attrs[attr] = alt_name
+        return output_attrs
+
+
+    def read_outputs_file( self, filename ):
+        '''Returns the list of variable names defined in an output definition file of the
+        FMI++ PowerFactory FMU Export Utility (one variable per line, comments start with ';').'''
+        output_names = []
+        with open( filename ) as outputs_file:
+            for line in outputs_file:
+                name = line.split( ';' )[0].strip()
+                if name: output_names.append( name )
+        return output_names
+
+
     def adjust_var_table(self):
         '''Helper function that adds missing keys to the var_table and its associated translation table.
         Avoids errors due to faulty access later on.'''
@@ -241,7 +332,7 @@ class LSS2PowerSystem(mosaik_api.Simulator):
             # Obtain setter function according to specified var type (Real, Integer, etc.):
             set_func = getattr(self._entities[eid], 'set' + self.var_table[var_type][name] + 'Value')
             set_stat = set_func(name, val)
-            assert set_stat == fmipp.fmiOK
+            assert set_stat == FMI_OK
 
 
     def get_value(self, eid, alt_attr):
@@ -255,4 +346,4 @@ class LSS2PowerSystem(mosaik_api.Simulator):
 
 
 if __name__ == '__main__':
-    mosaik_api.start_simulation(LSS2PowerSystem())
+    mosaik_api_v3.start_simulation(LSS2PowerSystem())
@@ -0,0 +1,422 @@
+"""
+    Builds and runs LSS2 scenarios from a declarative configuration (JSON file, see subfolder
+    *scenarios*), e.g.:
+        python lss2_scenario.py --config scenarios/lss2_fmu.json --set feeders=10 --set controller.backend=\\"numpy\\"
+
+    The configuration defines the time resolution and horizon, the number of feeders (each with its
+    own power system, controller and senders, created in bulk), the routing of the voltage readings
+    (signals with simulated communication are sent through the ns-3 network, all others via a group
+    sender) and the parameters of the simulators. Missing entries are taken from DEFAULTS.
+
+    The power systems and controllers of the feeders can be distributed over worker processes
+    (entry *workers*): the feeders are split into groups, each with its own power system and
+    controller simulator in a separate process, which mosaik either starts itself or connects to.
+    With entry *comm.shared*, all feeders send their readings through one ns-3 network.
+"""
+
+import argparse
+import copy
+import json
+import mosaik
+import mosaik_patches
+import os
+import scenario_cache
+import shutil
+import sim_checkpoint
+import sim_profiler
+import warnings
+from pathlib import Path
+
+
+BASE_DIR = os.path.abspath( os.path.dirname( __file__ ) )
+
+DEFAULTS = {
+    'description': '',
+    'time': {
+        'mt_per_sec': 1,        # N ticks of mosaik time = 1 second
+        'stop': 120,            # simulation stop time in seconds
+    },
+    'fmu_dir': 'fmus',          # FMU repository (relative to this file)
+    'feeders': 1,               # number of feeders
+    'random_seed': 1,           # random seed of ns-3 and the senders
+    'signals': {},              # voltage readings: output of power system -> input of controller
+    'comm': {
+        'signals': [],          # signals for which the communication is simulated (ns-3)
+        'model_name': 'LSS2_SimICT',
+        'instance_name': 'CommNetwork1',
+        'n_devices': 50,        # number of devices in communication simulation
+        'shared': False,        # one network for all feeders (one device per feeder and signal) instead of one per feeder
+        'interfere': True,
+        'bash_path': 'C:/Tools/cygwin/bin/bash.exe', # path to Cygwin's bash.exe
+    },
+    'powersystem': {
+        'model_name': 'LSS2_PowerSystem',
+        'instance_name': 'LoadFlow1',
+        'step_size': 1,         # in seconds
+    },
+    'controller': {
+        'backend': 'matlab_fmu',
+        'model_name': 'LSS2_Controller',
+        'instance_name': 'Controller1',
+        'period': 60.,          # in seconds
+        'phase_shift': 1.,      # in seconds
+        'dead_time': 1.,        # in seconds
+        'vlow': 0.95,
+        'vup': 1.05,
+        'verbose': False,
+    },
+    'workers': {
+        'count': 0,             # number of worker processes for the power systems and controllers (0: all in the mosaik process)
+        'connect': {},          # addresses of workers started beforehand (simulator -> list of host:port), see WORKER_SIMS
+    },
+    'sender': {
+        'period': 60.,          # in seconds
+        'phase_spread': 0.,     # interval in seconds over which the start times of the senders are spread
+        'jitter': 0.,           # maximum random delay of each transmission in seconds
+        'mode': 'periodic',
+    },
+    'collector': {
+        'mode': 'dense',
+        'window': None,         # in seconds
+        'exclude': [],
+        'aggregates': { '*.U_*': [ 'min', 'max', 'mean' ] },
+        'telemetry_include': [ '*.U_*', '*.current_tap', '*.pending_messages' ],
+    },
+}
+
+# Command line options for frequently changed entries of the configuration (option -> entry).
+OPTIONS = [
+    ( '--ctrl_dead_time', 'controller.dead_time', float, 'controller deadtime in seconds' ),
+    ( '--ctrl_phase_shift', 'controller.phase_shift', float, 'time difference in seconds between sending voltage readings and computing new controller set points' ),
+    ( '--ctrl_backend', 'controller.backend', str, 'controller backend (matlab_fmu or numpy)' ),
+    ( '--random_seed', 'random_seed', int, 'ns-3 and sender random generator seed' ),
+    ( '--n_devices', 'comm.n_devices', int, 'numbers of devices in communication simulation' ),
+    ( '--feeders', 'feeders', int, 'number of feeders' ),
+    ( '--feeder_workers', 'workers.count', int, 'number of worker processes for the power systems and controllers of the feeders' ),
+    ( '--collector_mode', 'collector.mode', str, 'record all values at each collector step (dense) or only changes (events)' ),
+    ( '--record_window', 'collector.window', float, 'record one row per window of the given length in seconds (min/max/mean of voltages, last value of other attributes)' ),
+    ( '--sender_phase_spread', 'sender.phase_spread', float, 'interval in seconds over which the start times of the senders are spread evenly' ),
+    ( '--sender_jitter', 'sender.jitter', float, 'maximum random delay in seconds of each transmission' ),
+    ( '--sender_mode', 'sender.mode', str, 'transmission schedule of the senders (periodic or poisson)' ),
+]
+
+# Simulators of the feeders that can be placed in worker processes.
+WORKER_SIMS = {
+    'LoadFlowSim': 'lss2_powersystem_pf_fmu:LSS2PowerSystem',
+    'ControllerSim': 'lss2_periodic_controller_matlab_fmu:LSS2PeriodicController',
+}
+
+
+def merge( base, update ):
+    '''Returns a copy of *base* updated recursively with the entries of *update*.'''
+    merged = copy.deepcopy( base )
+    for key, value in update.items():
+        if isinstance( value, dict ) and isinstance( merged.get( key ), dict ):
+            merged[key] = merge( merged[key], value )
+        else:
+            merged[key] = copy.deepcopy( value )
+    return merged
+
+
+def set_entry( config, key, value ):
+    '''Sets an entry of the configuration given by a dotted key (e.g., 'controller.dead_time').'''
+    *path, name = key.split( '.' )
+    for part in path:
+        config = config.setdefault( part, {} )
+    config[name] = value
+
+
+def load_config( filename=None, overrides=() ):
+    '''Returns the configuration of a file (merged with DEFAULTS), updated with (key, value) pairs.'''
+    config = DEFAULTS
+    if filename is not None:
+        with open( filename ) as f:
+            config = merge( config, json.load( f ) )
+    config = copy.deepcopy( config )
+    for key, value in overrides:
+        set_entry( config, key, value )
+
+    unknown = [ v for v in config['comm']['signals'] if v not in config['signals'] ]
+    if unknown:
+        raise RuntimeError( 'Signals with simulated communication are not in the signal table: {0}'.format( ', '.join( unknown ) ) )
+    if config['feeders'] < 1:
+        raise RuntimeError( 'A scenario needs at least one feeder.' )
+    if config['comm']['shared'] and config['feeders']*len( config['comm']['signals'] ) > config['comm']['n_devices']:
+        raise RuntimeError( 'A shared network needs one device per feeder and signal with simulated communication ({0}), only {1} devices.'.format(
+            config['feeders']*len( config['comm']['signals'] ), config['comm']['n_devices'] ) )
+
+    workers = config['workers']
+    if not 0 <= workers['count'] <= config['feeders']:
+        raise RuntimeError( 'The number of worker processes must be between 0 and the number of feeders ({0}).'.format( config['feeders'] ) )
+    for name, addrs in workers['connect'].items():
+        if name not in WORKER_SIMS:
+            raise RuntimeError( 'Simulator {0} cannot be placed in worker processes (use {1}).'.format( name, ', '.join( sorted( WORKER_SIMS ) ) ) )
+        if len( addrs ) != workers['count']:
+            raise RuntimeError( 'Simulator {0} needs one address per worker process ({1}), got {2}.'.format( name, workers['count'], len( addrs ) ) )
+    return config
+
+
+def fmu_dir( config ):
+    return os.path.join( BASE_DIR, config['fmu_dir'] )
+
+
+def feeder_groups( config ):
+    '''Returns the feeders (indices) of each power system and controller simulator, one group per worker process.'''
+    n, count = config['feeders'], max( 1, config['workers']['count'] )
+    return [ range( k*n//count, ( k + 1 )*n//count ) for k in range( count ) ]
+
+
+def worker_sim_name( config, name, k ):
+    '''Returns the name of the simulator configuration (see sim_config) of worker process k for a simulator of WORKER_SIMS.'''
+    return name if not config['workers']['count'] else '{0}-{1}'.format( name, k )
+
+
+def worker_fmu_dir( config, k, model_names ):
+    '''Returns the FMU directory of worker process k. Each worker extracts its FMUs from its own copy,
+    since extracting an FMU overwrites the shared libraries that the other workers have loaded.'''
+    work_dir = os.path.join( fmu_dir( config ), 'workers', str( k ) )
+    os.makedirs( work_dir, exist_ok=True )
+    for model_name in model_names:
+        source = os.path.join( fmu_dir( config ), model_name + '.fmu' )
+        target = os.path.join( work_dir, model_name + '.fmu' )
+        if not os.path.exists( target ) or os.stat( target ).st_mtime != os.stat( source ).st_mtime:
+            shutil.copy2( source, target )
+    return work_dir
+
+
+def sim_config( config ):
+    '''Returns the mosaik simulator configuration (the ns-3 network is only started if it is used). The simulators
+    of WORKER_SIMS are either started by mosaik (one process per worker) or connected to (entry workers.connect).'''
+    sims = {
+        'PeriodicSender': { 'python': 'periodic_sender:PeriodicSender' },
+        'Collector': { 'python': 'collector:Collector' },
+    }
+    workers = config['workers']
+    for name, target in WORKER_SIMS.items():
+        if not workers['count']:
+            sims[name] = { 'python': target }
+            continue
+        addrs = workers['connect'].get( name )
+        for k in range( workers['count'] ):
+            if addrs:
+                sims[worker_sim_name( config, name, k )] = { 'connect': addrs[k] }
+            else:
+                sims[worker_sim_name( config, name, k )] = {
+                    'cmd': '%(python)s ' + target.split( ':' )[0] + '.py %(addr)s',
+                    'cwd': Path( BASE_DIR ).as_posix()
+                }
+    if config['comm']['signals']:
+        sims['CommSim'] = {
+            'cmd': config['comm']['bash_path'] + ' -lc "./lss2_comm_ns3_fmu.sh lss2 %(addr)s"',
+            'cwd': Path( BASE_DIR ).as_posix()
+        }
+    return sims
+
+
+def cache_config( config ):
+    '''Returns the configuration that determines the results of a run (see scenario_cache.py).'''
+    models = [ config['powersystem']['model_name'] ]
+    if config['controller']['backend'] == 'matlab_fmu': models.append( config['controller']['model_name'] )
+    if config['comm']['signals']: models.append( config['comm']['model_name'] )
+    modules = [ target.split( ':' )[0] for target in WORKER_SIMS.values() ] + [ 'periodic_sender', 'collector' ]
+    if config['comm']['signals']: modules.append( 'lss2_comm_ns3_fmu' )
+    files = scenario_cache.input_files( fmu_dir( config ), models, modules )
+    settings = { key: value for key, value in config.items() if key != 'description' }
+    return scenario_cache.scenario_config( 'lss2_scenario', settings, files + [ __file__ ] )
+
+
+def create_scenario( world, config, output_file='erigridstore.h5', fmu_host=None, telemetry=None, profile=None, trace=None,
+    checkpoint=None, checkpoint_time=None, restore=None ):
+    mt_per_sec = config['time']['mt_per_sec']
+    stop = int( config['time']['stop']*mt_per_sec )
+    n = config['feeders']
+    signals = config['signals']
+    comm_signals = [ v for v in signals if v in config['comm']['signals'] ]
+    no_comm_signals = { v: s for v, s in signals.items() if v not in comm_signals }
+    groups = feeder_groups( config )
+    distributed = config['workers']['count'] > 0
+
+    # Directories are passed as absolute paths, the simulators in worker processes run in BASE_DIR.
+    profile, trace, checkpoint, restore = [ os.path.abspath( d ) if d is not None else None for d in ( profile, trace, checkpoint, restore ) ]
+
+    # Checkpoints of all simulators (see sim_checkpoint.py).
+    checkpoints = dict( checkpoint=checkpoint, restore=restore,
+        checkpoint_time=int( round( checkpoint_time*mt_per_sec ) ) if checkpoint_time is not None else None )
+
+    # Periodic senders for voltage readings (per feeder). The readings for which the communication
+    # is not simulated are sent by a single group sender.
+    sender_sim = world.start( 'PeriodicSender', seed=config['random_seed'], profile=profile, trace=trace, verbose=False, **checkpoints )
+    s = config['sender']
+    # The start times are spread evenly over all (feeder, signal) pairs.
+    n_senders = len( comm_signals ) + ( 1 if no_comm_signals else 0 )
+    sender_params = lambda f, i: dict( period=s['period']*mt_per_sec,
+        start_time=int( ( f*n_senders + i ) * s['phase_spread'] * mt_per_sec / ( n*n_senders ) ),
+        jitter=s['jitter']*mt_per_sec, mode=s['mode'] )
+    senders = { v: [ sender_sim.PeriodicSender.create( 1, **sender_params( f, i ) )[0] for f in range( n ) ] for i, v in enumerate( comm_signals ) }
+    group_senders = [ sender_sim.PeriodicGroupSender.create( 1, **sender_params( f, n_senders - 1 ) )[0] for f in range( n ) ] if no_comm_signals else []
+
+    # FMU directories of the power system and controller simulators (one per worker process).
+    models = [ config['powersystem']['model_name'] ]
+    if config['controller']['backend'] == 'matlab_fmu': models.append( config['controller']['model_name'] )
+    work_dirs = [ worker_fmu_dir( config, k, models ) if distributed and fmu_host is None else fmu_dir( config ) for k in range( len( groups ) ) ]
+
+    # Simulators for power system (one FMU instance per feeder, one simulator per group of feeders).
+    p = config['powersystem']
+    loadflows = []
+    for k, group in enumerate( groups ):
+        loadflow_sim = world.start( worker_sim_name( config, 'LoadFlowSim', k ), sim_id='LoadFlowSim-{0}'.format( k ),
+            work_dir=work_dirs[k], model_name=p['model_name'], instance_name=p['instance_name'],
+            start_time=0, stop_time=stop, stop_time_defined=True,
+            step_size=p['step_size']*mt_per_sec, seconds_per_mosaik_timestep=1/mt_per_sec, fmu_host=fmu_host, profile=profile, trace=trace, verbose=False, **checkpoints )
+        loadflows += loadflow_sim.LSS2PowerSystem.create( len( group ) )
+
+    # Simulator for communication network.
+    if comm_signals:
+        c = config['comm']
+        comm_network_sim = world.start( 'CommSim',
+            work_dir=fmu_dir( config ), model_name=c['model_name'], instance_name=c['instance_name'],
+            interfere=c['interfere'], n_devices=c['n_devices'],
+            start_time=0, stop_time=stop, stop_time_defined=True, random_seed=config['random_seed'],
+            seconds_per_mosaik_timestep=1./mt_per_sec, path_conversion='win2cygwin', posix=True, profile=profile, trace=trace, verbose=False, **checkpoints )
+        comm_networks = comm_network_sim.LSS2CommNetwork.create( 1 if c['shared'] else n )
+
+    # Simulators for controller (one controller per feeder, one simulator per group of feeders).
+    c = config['controller']
+    ctrls = []
+    for k, group in enumerate( groups ):
+        ctrl_sim = world.start( worker_sim_name( config, 'ControllerSim', k ), sim_id='ControllerSim-{0}'.format( k ),
+            work_dir=work_dirs[k], model_name=c['model_name'], instance_name=c['instance_name'],
+            start_time=0, stop_time=stop, stop_time_defined=True,
+            dead_time=c['dead_time'], seconds_per_mosaik_timestep=1./mt_per_sec, fmu_host=fmu_host,
+            backend=c['backend'], profile=profile, trace=trace, verbose=c['verbose'], **checkpoints )
+        ctrls += ctrl_sim.LSS2PeriodicController.create( len( group ), vlow=c['vlow'], vup=c['vup'], period=c['period'], phase_shift=c['phase_shift'] )
+
+    # Collect results.
+    c = config['collector']
+    collector = world.start( 'Collector',
+        step_size=mt_per_sec, seconds_per_mosaik_timestep=1./mt_per_sec, print_results=False,
+        h5_storename=output_file, h5_panelname='Monitor', mode=c['mode'],
+        exclude=c['exclude'], window=int( c['window']*mt_per_sec ) if c['window'] else None,
+        aggregates=c['aggregates'], groups=[ '{0}.out'.format( e.full_id ) for e in group_senders ], telemetry=telemetry, telemetry_include=c['telemetry_include'], profile=profile, **checkpoints )
+    monitor = collector.Monitor()
+
+    for f in range( n ):
+        if no_comm_signals:
+            world.connect( loadflows[f], group_senders[f], *no_comm_signals.items() )
+            world.connect( group_senders[f], ctrls[f], ( 'out', 'readings' ) )
+
+        for j, voltage in enumerate( comm_signals ):
+            signal = signals[voltage]
+            if config['comm']['shared']:
+                # Each feeder sends its readings via its own devices of the shared network.
+                network, device = comm_networks[0], 'device{0}'.format( f*len( comm_signals ) + j )
+            else:
+                network, device = comm_networks[f], signal
+            world.connect( loadflows[f], senders[voltage][f], ( voltage, 'in' ) )
+            world.connect( senders[voltage][f], network, ( 'out', device + '_send' ) )
+            world.connect( network, ctrls[f], ( device + '_receive', signal ) )
+
+        # Connect output from controller to OLTC.
+        world.connect( ctrls[f], loadflows[f], ( 'tap', 'tap' ), time_shifted=True )
+
+        world.connect( loadflows[f], monitor, *signals.keys() )
+        world.connect( loadflows[f], monitor, 'current_tap' )
+        for voltage in comm_signals:
+            world.connect( senders[voltage][f], monitor, 'out' )
+        if no_comm_signals:
+            world.connect( group_senders[f], monitor, 'out' )
+
+    for network in ( comm_networks if comm_signals else [] ):
+        world.connect( network, monitor, 'pending_messages' )
+
+
+def run( config, output_file='erigridstore.h5', fmu_host=None, telemetry=None, cache_dir=None, mosaik_port=5555, profile=None, trace=None,
+    checkpoint=None, checkpoint_time=None, restore=None ):
+    if cache_dir is not None and ( checkpoint is not None or restore is not None ):
+        raise RuntimeError( 'Runs writing or restoring checkpoints cannot be cached.' )
+    if checkpoint is not None and checkpoint_time is None:
+        raise RuntimeError( 'A checkpoint requires the checkpoint time.' )
+
+    if cache_dir is not None:
+        # Results of a run with the same configuration (parameters and input files) are reused.
+        cache = scenario_cache.ResultCache( cache_dir )
+        settings = cache_config( config )
+        key = cache.key( settings )
+        if cache.restore( key, output_file ):
+            print( 'Results taken from cache: {0}'.format( cache.entry( key ) ) )
+            return
+    scenario_cache.release( output_file )
+
+    world = mosaik.World( sim_config( config ), mosaik_config={ 'addr': ( '127.0.0.1', mosaik_port ) } )
+    create_scenario( world, config, output_file=output_file, fmu_host=fmu_host, telemetry=telemetry, profile=profile, trace=trace,
+        checkpoint=checkpoint, checkpoint_time=checkpoint_time, restore=restore )
+    if restore is not None:
+        # The restored simulators start at the window before the checkpoint time, not at time 0 (see sim_checkpoint.py).
+        start, sids = sim_checkpoint.window( restore )
+        for sid in sids: world.set_initial_event( sid, start )
+    until = int( config['time']['stop']*config['time']['mt_per_sec'] )
+    if checkpoint is not None:
+        # The simulation ends once all simulators have been stepped at the checkpoint time (if at all).
+        until = int( round( checkpoint_time*config['time']['mt_per_sec'] ) ) + 1
+    # Simulators in other processes need the corrected progress of mosaik's scheduler (see mosaik_patches.py).
+    with mosaik_patches.remote_progress( bool( config['workers']['count'] or config['comm']['signals'] ) ), warnings.catch_warnings():
+        if restore is not None:
+            # Within the window before the checkpoint time, a simulator may be stepped before the first step of a
+            # predecessor (its inputs are not used, see sim_checkpoint.py), which mosaik reports as missing output.
+            warnings.filterwarnings( 'ignore', message='.*did not produce output on its persistent attribute' )
+        world.run( until=until )
+
+    if profile is not None:
+        # The simulators have written their reports when they were finalized.
+        report = sim_profiler.format_report( sim_profiler.read_reports( profile ) )
+        with open( os.path.join( profile, 'report.txt' ), 'w' ) as f:
+            f.write( report + '\n' )
+        print( report )
+
+    if cache_dir is not None:
+        cache.store( key, output_file, settings )
+
+
+def parse_setting( text ):
+    '''Parses KEY=VALUE, the value is JSON (e.g., 10, true, "numpy") or a plain string.'''
+    key, sep, value = text.partition( '=' )
+    if not sep:
+        raise argparse.ArgumentTypeError( 'expected <key>=<value>, got {0}'.format( text ) )
+    try:
+        return key, json.loads( value )
+    except ValueError:
+        return key, value
+
+
+def main( argv=None, config_file=None ):
+
+    parser = argparse.ArgumentParser( description='Run a LSS2 simulation' )
+    parser.add_argument( '--config', type=str, help='scenario configuration (JSON file)', default=config_file, required=config_file is None )
+    parser.add_argument( '--set', type=parse_setting, action='append', metavar='KEY=VALUE', help='change an entry of the configuration (e.g., controller.dead_time=2)', default=[] )
+    for option, key, type_, help_text in OPTIONS:
+        parser.add_argument( option, type=type_, help='{0} (sets {1})'.format( help_text, key ), default=None )
+    parser.add_argument( '--record_exclude', type=str, nargs='*', help='attributes not to record (patterns, e.g., \'PeriodicSender*\')', default=None )
+    parser.add_argument( '--output_file', type=str, help='output file name', default='erigridstore.h5' )
+    parser.add_argument( '--fmu_host', type=str, help='address of FMU host providing pre-initialized FMUs (see fmu_host.py)', default=None )
+    parser.add_argument( '--telemetry', type=str, help='publish voltages, taps and message counts to this ring file while running (see collector_telemetry.py)', default=None )
+    parser.add_argument( '--cache_dir', type=str, help='reuse the results of runs with the same configuration stored in this directory (see scenario_cache.py)', default=None )
+    parser.add_argument( '--mosaik_port', type=int, help='port of the mosaik server (different for simulations running in parallel)', default=5555 )
+    parser.add_argument( '--profile', type=str, help='profile the simulators and write their reports to this directory (see sim_profiler.py)', default=None )
+    parser.add_argument( '--trace', type=str, help='record the calls of the simulators (except the collector) to this directory for replay (see sim_trace.py)', default=None )
+    parser.add_argument( '--checkpoint', type=str, help='run until the checkpoint time and write a checkpoint to this directory (see sim_checkpoint.py)', default=None )
+    parser.add_argument( '--checkpoint_time', type=float, help='time of the checkpoint in seconds', default=None )
+    parser.add_argument( '--restore', type=str, help='continue from the checkpoint in this directory (see lss2_fork.py)', default=None )
+    args = parser.parse_args( argv )
+
+    overrides = [ ( key, getattr( args, option[2:] ) ) for option, key, _, _ in OPTIONS if getattr( args, option[2:] ) is not None ]
+    if args.record_exclude is not None: overrides.append( ( 'collector.exclude', args.record_exclude ) )
+    config = load_config( args.config, overrides + args.set )
+    print( 'Starting simulation with config {0}: {1}'.format( args.config, json.dumps( config ) ) )
+
+    run( config, output_file=args.output_file, fmu_host=args.fmu_host, telemetry=args.telemetry,
+        cache_dir=args.cache_dir, mosaik_port=args.mosaik_port, profile=args.profile, trace=args.trace,
+        checkpoint=args.checkpoint, checkpoint_time=args.checkpoint_time, restore=args.restore )
+
+
+if __name__ == '__main__':
+    main()
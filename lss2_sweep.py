@@ -0,0 +1,244 @@
+"""
+    Runs parameter sweeps of the LSS2 scenarios, one simulation per parameter point, in a pool of
+    processes (by default one per core).
+
+    The parameter points are either a full grid or a Latin hypercube sample of parameter ranges:
+        python lss2_sweep.py --scenario lss2_scenario_fmu --grid ctrl_dead_time=1,2,5 --grid random_seed=1,2,3
+        python lss2_sweep.py --scenario lss2_scenario_nocomm_fmu --sample 100 --range ctrl_dead_time=0:10 \\
+            --range ctrl_phase_shift=0.5:5 --set ctrl_backend=numpy
+
+    Parameters are passed to the scenario as command line options (e.g., --ctrl_dead_time=2). Each point
+    is identified by a hash of its parameters, its results are stored in <out_dir>/<point>.h5 and its
+    output in <out_dir>/<point>.log. Completed points are recorded in <out_dir>/manifest.jsonl, so that
+    an interrupted sweep can be resumed by running the same command again (failed points are repeated).
+
+    Each worker process runs its simulations with its own mosaik port: worker k of n uses the first
+    free port of base_port + k, base_port + k + n, base_port + k + 2n, ...
+
+    Each point extracts its FMUs from its own copy of the FMU files in <out_dir>/fmus/<point>, since
+    points running in parallel (or one after the other in the same worker) must not overwrite the
+    shared libraries of FMUs that are loaded. The copy is deleted when the point is finished. With an
+    FMU host (--set fmu_host=<addr>), the FMUs are extracted once by the host and not copied.
+
+    The output of a point is captured at the level of file descriptors, i.e., it includes the output
+    of loguru (mosaik), of the FMUs (C libraries) and of simulators started as processes.
+"""
+
+import argparse
+import contextlib
+import glob
+import hashlib
+import importlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import lss2_scenario
+
+
+# Port of the mosaik server of the current worker process (see init_worker).
+PORT = None
+
+
+def parse_value(value):
+    '''Converts a parameter value given on the command line to int or float, if possible.'''
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+def parse_assignment(text):
+    name, sep, value = text.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError('expected <parameter>=<value(s)>, got {0}'.format(text))
+    return name, value
+
+
+def grid_design(grid):
+    '''Returns all combinations of the parameter values (dict: parameter -> list of values).'''
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+
+def sampled_design(ranges, n, seed=None):
+    '''Returns a Latin hypercube sample of n points (dict: parameter -> (lower, upper)). Parameters
+    with integer bounds are sampled as integers (uniformly from lower to upper, both included).'''
+    rng = random.Random(seed)
+    columns = {}
+    for name in sorted(ranges):
+        lower, upper = ranges[name]
+        integer = isinstance(lower, int) and isinstance(upper, int)
+        strata = list(range(n))
+        rng.shuffle(strata)
+        # Integers are sampled from [lower, upper + 1) and rounded down.
+        width = upper - lower + (1 if integer else 0)
+        values = [lower + width*(k + rng.random())/n for k in strata]
+        if integer:
+            values = [min(int(math.floor(v)), upper) for v in values]
+        columns[name] = values
+    return [{name: columns[name][i] for name in columns} for i in range(n)]
+
+
+def point_id(scenario, params):
+    '''Returns the ID of a parameter point (hash of scenario and parameters).'''
+    text = json.dumps([scenario, sorted(params.items())])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+
+def read_manifest(filename):
+    '''Returns the IDs of all points that have been completed.'''
+    done = set()
+    if os.path.exists(filename):
+        with open(filename) as f:
+            for line in f:
+                if not line.strip(): continue
+                entry = json.loads(line)
+                if entry['status'] == 'done': done.add(entry['id'])
+    return done
+
+
+def is_free(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        try:
+            s.bind(('127.0.0.1', port))
+        except OSError:
+            return False
+    return True
+
+
+def init_worker(counter, workers, base_port):
+    '''Assigns a mosaik port to the worker process (ports of different workers never coincide).'''
+    global PORT
+    with counter.get_lock():
+        k = counter.value
+        counter.value += 1
+    PORT = next(port for port in itertools.count(base_port + k % workers, workers) if is_free(port))
+
+
+def copy_fmus(fmu_dir, work_dir):
+    '''Copies the FMU files of a directory to a working directory (returns its absolute path).'''
+    os.makedirs(work_dir, exist_ok=True)
+    for filename in glob.glob(os.path.join(fmu_dir, '*.fmu')):
+        shutil.copy(filename, work_dir)
+    return os.path.abspath(work_dir)
+
+
+@contextlib.contextmanager
+def redirect_output(log):
+    '''Redirects the standard output and error of the process to a file. The file descriptors are redirected
+    (not only sys.stdout and sys.stderr), so that the output of loguru, of C libraries and of child processes
+    is captured as well.'''
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = [os.dup(fd) for fd in (1, 2)]
+    try:
+        for fd in (1, 2): os.dup2(log.fileno(), fd)
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, saved_fd in zip((1, 2), saved):
+            os.dup2(saved_fd, fd)
+            os.close(saved_fd)
+
+
+def run_point(scenario, pid, argv, log_file, fmus=None):
+    '''Runs the simulation of one parameter point (in a worker process). If *fmus* is given (FMU directory,
+    working directory), the FMU files are copied to the working directory, the point uses this copy and the
+    working directory is deleted afterwards.'''
+    start = time.time()
+    with open(log_file, 'w') as log, redirect_output(log):
+        try:
+            if fmus is not None:
+                argv = argv + ['--set', 'fmu_dir={0}'.format(json.dumps(copy_fmus(*fmus)))]
+            importlib.import_module(scenario).main(argv + ['--mosaik_port={0}'.format(PORT)])
+            status = 'done'
+        except (Exception, SystemExit):
+            traceback.print_exc()
+            status = 'failed'
+        finally:
+            # Shared libraries that are still loaded cannot be deleted on Windows, they are left behind.
+            if fmus is not None: shutil.rmtree(fmus[1], ignore_errors=True)
+    return pid, status, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a parameter sweep of a LSS2 scenario')
+    parser.add_argument('--scenario', type=str, help='scenario module', default='lss2_scenario_fmu')
+    parser.add_argument('--grid', type=parse_assignment, action='append', metavar='PARAM=V1,V2,...',
+        help='values of a parameter (all combinations are simulated)', default=[])
+    parser.add_argument('--range', type=parse_assignment, action='append', metavar='PARAM=LOWER:UPPER',
+        help='range of a parameter (sampled, see --sample)', default=[])
+    parser.add_argument('--sample', type=int, help='number of points sampled from the ranges', default=0)
+    parser.add_argument('--seed', type=int, help='random seed of the sample', default=None)
+    parser.add_argument('--set', type=parse_assignment, action='append', metavar='PARAM=VALUE',
+        help='parameter with the same value for all points', default=[])
+    parser.add_argument('--out_dir', type=str, help='directory of results, logs and manifest', default='sweep')
+    parser.add_argument('--workers', type=int, help='number of worker processes', default=os.cpu_count())
+    parser.add_argument('--base_port', type=int, help='first mosaik port used by the workers', default=5600)
+    args = parser.parse_args()
+
+    grid = {name: [parse_value(v) for v in values.split(',')] for name, values in args.grid}
+    ranges = {name: tuple(parse_value(v) for v in bounds.split(':')) for name, bounds in args.range}
+    fixed = {name: parse_value(value) for name, value in args.set}
+
+    points = grid_design(grid)
+    if ranges:
+        if not args.sample:
+            raise RuntimeError('Parameter ranges require the number of points to sample (--sample).')
+        # Each sampled point is combined with each grid point.
+        points = [dict(p, **s) for p in points for s in sampled_design(ranges, args.sample, args.seed)]
+
+    # FMU files of the scenario (each point uses its own copy, see run_point), unless an FMU host extracts them.
+    fmu_dir = None
+    if 'fmu_host' not in fixed:
+        config_file = getattr(importlib.import_module(args.scenario), 'CONFIG_FILE', None)
+        fmu_dir = lss2_scenario.fmu_dir(lss2_scenario.load_config(config_file))
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    manifest = os.path.join(args.out_dir, 'manifest.jsonl')
+    done = read_manifest(manifest)
+
+    tasks = []
+    for params in points:
+        params = dict(fixed, **params)
+        pid = point_id(args.scenario, params)
+        if pid in done: continue
+        output_file = os.path.join(args.out_dir, pid + '.h5')
+        argv = ['--{0}={1}'.format(name, value) for name, value in sorted(params.items())]
+        argv.append('--output_file={0}'.format(output_file))
+        tasks.append((pid, params, output_file, argv))
+
+    print('{0} points, {1} completed, {2} to run with {3} workers'.format(
+        len(points), len(points) - len(tasks), len(tasks), args.workers))
+    if not tasks: return
+
+    counter = multiprocessing.Value('i', 0)
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+            initargs=(counter, args.workers, args.base_port)) as pool, open(manifest, 'a') as f:
+        futures = {pool.submit(run_point, args.scenario, pid, argv, os.path.join(args.out_dir, pid + '.log'),
+            (fmu_dir, os.path.join(args.out_dir, 'fmus', pid)) if fmu_dir is not None else None):
+            (pid, params, output_file) for pid, params, output_file, argv in tasks}
+        for n, future in enumerate(as_completed(futures), 1):
+            pid, params, output_file = futures[future]
+            _, status, wall_time = future.result()
+            entry = {'id': pid, 'params': params, 'output_file': output_file, 'status': status, 'wall_time': wall_time}
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            print('[{0}/{1}] {2} {3} ({4:.1f} s): {5}'.format(n, len(tasks), pid, status, wall_time, params))
+
+
+if __name__ == '__main__':
+    main()
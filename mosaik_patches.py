@@ -0,0 +1,55 @@
+"""
+    Workarounds for bugs of mosaik that depend on its internals. Each patch is installed by a context
+    manager only while it is needed and only for the version of mosaik it has been written for (see
+    requirements.txt); with other versions, a warning is issued and mosaik is left unchanged.
+
+    remote_progress: mosaik 3.6 advances the progress of a simulator without considering triggering
+    predecessors that are in the middle of a step. Predecessors in other processes (e.g., worker
+    processes or the ns-3 network) may still be stepping while a simulator is advanced, which then
+    progresses beyond the time of their outputs (assertion "cannot progress backwards").
+"""
+
+import contextlib
+import math
+import time
+import warnings
+
+import mosaik
+import mosaik.scheduler
+from mosaik.tiered_time import TieredTime
+
+
+# Versions of mosaik whose scheduler is replicated by advance_progress.
+PATCHED_VERSIONS = ('3.6.',)
+
+
+def advance_progress(sim, world):
+    '''Replaces mosaik.scheduler.advance_progress (mosaik 3.6), the progress is also limited by the current
+    steps of the triggering predecessors.'''
+    progress = [distance.earliest_sum(pre_sim.next_steps[0]) for pre_sim, distance in sim.triggering_ancestors.items() if pre_sim.next_steps]
+    progress += [distance.earliest_sum(pre_sim.current_step) for pre_sim, distance in sim.triggering_ancestors.items() if pre_sim.current_step]
+    if sim.next_steps: progress.append(sim.next_steps[0])
+    if sim.current_step: progress.append(sim.current_step)
+    if world.rt_factor: progress.append(TieredTime(math.ceil((time.perf_counter() - sim.rt_start)/world.rt_factor)))
+    new_progress = min(progress + [TieredTime(world.until) + sim.from_world_time])
+    sim.progress.set(new_progress)
+    sim.tqdm.update(new_progress.time - sim.tqdm.n)
+
+
+@contextlib.contextmanager
+def remote_progress(enabled=True):
+    '''Installs advance_progress in mosaik's scheduler while a world with simulators in other processes runs
+    (if *enabled*, otherwise mosaik is left unchanged).'''
+    if not enabled:
+        yield
+        return
+    if not mosaik.__version__.startswith(PATCHED_VERSIONS):
+        warnings.warn('The progress of simulators in other processes is not corrected for mosaik {0} (see mosaik_patches.py).'.format(mosaik.__version__))
+        yield
+        return
+    original = mosaik.scheduler.advance_progress
+    mosaik.scheduler.advance_progress = advance_progress
+    try:
+        yield
+    finally:
+        mosaik.scheduler.advance_progress = original
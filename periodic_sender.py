@@ -1,44 +1,102 @@
-import mosaik_api
+import mosaik_api_v3
+import array
+import heapq
 import itertools
-import math
+import random
+import sim_profiler
+import sim_trace
+import sim_checkpoint
 
 META={
+    'type': 'time-based',
     'models': {
         'PeriodicSender':{
             'public': True,
-            'params': ['period', 'eid_prefix', 'start_time'],
+            'params': ['period', 'eid_prefix', 'start_time', 'jitter', 'mode'],
             'attrs': ['in', 't', 'out'],
         },
+        'PeriodicGroupSender':{
+            'public': True,
+            'any_inputs': True,
+            'params': ['period', 'start_time', 'jitter', 'mode'],
+            'attrs': ['t', 'out'],
+        },
     },
 }
 
 
-class PeriodicSender(mosaik_api.Simulator):
+class PeriodicSender(mosaik_api_v3.Simulator):
     """
         Component which periodically raises *out* to the value of *in*
         *out* is initialized to be None.
+
+        The senders of one simulator instance form a bank: their periods, start and
+        next transmission times are kept in arrays and the next transmission times are
+        scheduled in a priority queue, i.e., a step only touches the senders that are due.
+
+        A PeriodicGroupSender accepts any number of inputs (one source per input) and periodically
+        raises *out* to a dict that maps the names of the inputs to their values. Connecting many
+        signals via one group sender results in a single message per step instead of one per signal.
+
+        Transmission schedules can be spread out: *start_time* sets the phase of a sender, *jitter*
+        delays each transmission by a random number of time steps (uniformly drawn from [0, jitter],
+        jitter < period) and mode 'poisson' replaces the fixed period by exponentially distributed
+        intervals with mean *period*. The random numbers are drawn from a generator seeded with
+        parameter *seed* of the simulator.
     """
+
+    # State saved in checkpoints (see sim_checkpoint.py).
+    checkpoint_attrs = ['next_transmission', 'nominal', 'rng', 'out', 'schedule', 'transmitting', 'inputs', 'time']
+
     def __init__(self):
         super().__init__(META)
         self.eid = None
         self.step_size=1
         self.eid_counters = {}
         self.eps = 1e-10 # Possible uncertainty in time messages
-        self.senders = {} # Tables for translation
+        self.eids = [] # Entity IDs (in the order of creation)
+        self.groups = set() # Indices of group senders
+        self.index = {} # Entity ID -> index in the arrays below
+        self.start_time = array.array('d') # Start times
+        self.period = array.array('d') # Periods
+        self.next_transmission = array.array('q') # Next transmission times
+        self.nominal = array.array('q') # Next transmission times without jitter
+        self.jitter = array.array('d') # Maximum jitter of transmission times
+        self.poisson = set() # Indices of senders in mode 'poisson'
+        self.rng = random.Random()
+        self.out = [] # Current values of *out*
+        self.schedule = [] # Priority queue of (next transmission time, index)
+        self.transmitting = [] # Indices of senders that transmitted in the current step
+        self.inputs = {} # Inputs of the current step
+        self.time = None # Time of the current step
+        self.profiler = None # Profiler (only if parameter *profile* is set)
+        self.tracer = None # Tracer (only if parameter *trace* is set)
+        self.checkpoint = None # Checkpoint to write or restore (only if parameter *checkpoint* or *restore* is set)
 
     # Additional initialization contingent on sid
-    def init(self, sid, eid_prefix='Sender', verbose=False):
+    @sim_trace.traced
+    def init(self, sid, time_resolution=1., eid_prefix='Sender', seed=None, profile=None, trace=None, checkpoint=None, checkpoint_time=None, restore=None, verbose=False):
         """
             sid: ID given to us by Mosaik
+            time_resolution: Seconds per mosaik time step (unused)
             eid_prefix: Optional eid prefix
+            seed: Seed for jitter and mode 'poisson'
+            profile: Directory of the profiling report (see sim_profiler.py)
+            trace: Directory of the trace of all calls (see sim_trace.py)
+            checkpoint, checkpoint_time, restore: Write a checkpoint at a mosaik time to a directory or restore it (see sim_checkpoint.py)
         """
         self.sid = sid
         self.eid_prefix = eid_prefix
+        self.rng = random.Random(seed)
         self.verbose = verbose
+        self.profiler = sim_profiler.create(sid, profile)
+        self.tracer = sim_trace.create(self, sid, trace)
+        self.checkpoint = sim_checkpoint.create(self, sid, checkpoint, checkpoint_time, restore)
 
         return self.meta  # Must return self.meta!
 
     # Initialize simulator model instances (entities)
+    @sim_trace.traced
     def create(self, num, model, **model_params):
         """
         Input:
@@ -51,72 +109,135 @@ class PeriodicSender(mosaik_api.Simulator):
         counter = self.eid_counters.setdefault(model, itertools.count())
         entities = []
         for i in range(num):
-            eid = '{0}_{1}'.format(self.eid_prefix, next(counter))
+            prefix = self.eid_prefix if model == 'PeriodicSender' else self.eid_prefix + 'Group'
+            eid = '{0}_{1}'.format(prefix, next(counter))
 
             period = model_params.get('period', 1.0)
             start_time = model_params.get('start_time', 0.0)
-
-            self.senders[eid] = {
-                    'in': None, 't': None, 'out': None,
-                    'start_time': start_time, 'period': period,
-                    'next_transmission': int(start_time), 'transmitting' : False}
+            jitter = model_params.get('jitter', 0.0)
+            mode = model_params.get('mode', 'periodic')
+
+            if mode not in ('periodic', 'poisson'):
+                raise RuntimeError('PeriodicSender mode {0} unknown (use \'periodic\' or \'poisson\').'.format(mode))
+            if not 0 <= jitter < period:
+                raise RuntimeError('PeriodicSender jitter must be non-negative and less than its period.')
+
+            idx = len(self.eids)
+            self.eids.append(eid)
+            self.index[eid] = idx
+            self.start_time.append(start_time)
+            self.period.append(period)
+            self.jitter.append(jitter)
+            self.nominal.append(int(start_time))
+            self.next_transmission.append(0)
+            self.out.append(None)
+            if model == 'PeriodicGroupSender': self.groups.add(idx)
+            if mode == 'poisson': self.poisson.add(idx)
+            self.schedule_transmission(idx, 0)
 
             entities.append({'eid': eid, 'type': model})
 
         return entities
 
     #COS2.4: TODO: Add sec_per_mt
-    def step(self, time, inputs):
-
-        # Process inputs
-        for eid, sender in self.senders.items():
-            inputdata = inputs.get(eid, {})
-            if self.verbose: print('At mosaiktime {0} PeriodicSender {1} got input {2}.'.format(time, eid, inputdata))
-
-            sender['t'] = time
-
-            inport = inputdata.get('in', {0:None})
-            if len(inport) > 1:
-                raise RuntimeError('PeriodicSender {0}\'s *in* is connected to multiple sources. Only one source allowed.'.format(eid))
-            inport = next(iter(inport.values()))
-            sender['in'] = inport
-            if time >= sender['next_transmission']:
-                # We have hit our transmission time; time to send a message
-                out = inport
-                sender['next_transmission'] = int(round(((time-sender['start_time']+self.eps)/sender['period']) + 1) * sender['period']+sender['start_time'])
-                sender['transmitting'] = True
-            else:
-                # Not time yet, lie dormant
-                out = None
-                sender['transmitting'] = False
-            sender['out'] = out
-            if self.verbose: print('PeriodicSender {0} sent out {1}'.format(eid, out))
-
-        if any(s['transmitting'] for s in self.senders.values()):
+    @sim_trace.traced
+    @sim_profiler.profiled
+    @sim_checkpoint.checkpointed
+    def step(self, time, inputs, max_advance=None):
+        self.time = time
+        self.inputs = inputs
+
+        # Senders that transmitted in the previous step fall back to None.
+        for idx in self.transmitting:
+            self.out[idx] = None
+        self.transmitting = []
+
+        # Only senders whose transmission time has been hit are touched.
+        while self.schedule and self.schedule[0][0] <= time:
+            _, idx = heapq.heappop(self.schedule)
+            eid = self.eids[idx]
+            inport = self.get_input(eid) if idx not in self.groups else self.get_group_input(eid)
+            if self.verbose: print('At mosaiktime {0} PeriodicSender {1} got input {2}.'.format(time, eid, inport))
+
+            # We have hit our transmission time; time to send a message
+            self.out[idx] = inport
+            self.nominal[idx] = self.next_nominal(idx)
+            self.schedule_transmission(idx, time + 1)
+            self.transmitting.append(idx)
+            if self.verbose: print('PeriodicSender {0} sent out {1}'.format(eid, inport))
+
+        if self.transmitting:
             # Make sure we are woken up so we can set *out* to None
             if self.verbose: print('Transmitting, next time: {0}'.format(time+1))
             return time + 1
         else:
-            next_outgoing = min(s['next_transmission'] for s in self.senders.values())
+            next_outgoing = self.schedule[0][0] if self.schedule else None
             if self.verbose: print('Not transmitting, next time: {0}'.format(next_outgoing))
             return next_outgoing
 
+    def next_nominal(self, idx):
+        '''Returns the nominal (i.e., without jitter) transmission time following the current one.'''
+        nominal, start_time, period = self.nominal[idx], self.start_time[idx], self.period[idx]
+        if idx in self.poisson:
+            return nominal + max(1, int(round(self.rng.expovariate(1./period))))
+        return int(round(((nominal-start_time+self.eps)/period) + 1) * period+start_time)
+
+    def schedule_transmission(self, idx, earliest):
+        '''Schedules the next transmission of a sender (its nominal transmission time plus jitter).'''
+        next_transmission = self.nominal[idx]
+        if self.jitter[idx] > 0:
+            next_transmission += int(round(self.rng.uniform(0, self.jitter[idx])))
+        next_transmission = max(next_transmission, earliest)
+        self.next_transmission[idx] = next_transmission
+        heapq.heappush(self.schedule, (next_transmission, idx))
+
+    def get_input(self, eid):
+        '''Returns the current value of *in* of a sender.'''
+        inport = self.inputs.get(eid, {}).get('in', {0:None})
+        if len(inport) > 1:
+            raise RuntimeError('PeriodicSender {0}\'s *in* is connected to multiple sources. Only one source allowed.'.format(eid))
+        return next(iter(inport.values()))
+
+    def get_group_input(self, eid):
+        '''Returns the current values of all inputs of a group sender (as dict).'''
+        inports = {}
+        for attr, values in self.inputs.get(eid, {}).items():
+            if len(values) > 1:
+                raise RuntimeError('PeriodicGroupSender {0}\'s *{1}* is connected to multiple sources. Only one source allowed.'.format(eid, attr))
+            inports[attr] = next(iter(values.values()))
+        return inports
+
+    @sim_trace.traced
+    @sim_profiler.profiled
+    @sim_checkpoint.checkpointed
     def get_data(self, outputs):
         data = {}
-        for eid, sender in self.senders.items():
-            requests = outputs.get(eid, [])
+        for eid, requests in outputs.items():
+            idx = self.index[eid]
             mydata = {}
             for attr in requests:
-                try:
-                    mydata[attr] = sender[attr]
-                except KeyError:
+                if attr == 'out':
+                    mydata[attr] = self.out[idx]
+                elif attr == 'in' and idx not in self.groups:
+                    mydata[attr] = self.get_input(eid)
+                elif attr == 't':
+                    mydata[attr] = self.time
+                else:
                     raise RuntimeError("PeriodicSender has no attribute {0}".format(attr))
 
             data[eid] = mydata
         return data
 
+    def finalize(self):
+        if self.profiler is not None:
+            self.profiler.write()
+        if self.tracer is not None:
+            self.tracer.close()
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+
 def main():
-    return mosaik_api.start_simulation(PeriodicSender())
+    return mosaik_api_v3.start_simulation(PeriodicSender())
 
 if __name__ == '__main__':
     main()
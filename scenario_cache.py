@@ -0,0 +1,151 @@
+"""
+    Content-addressed cache of scenario results.
+
+    A scenario run is identified by a hash of its full configuration: the scenario settings
+    (parameters, stop time, time resolution, signal tables) and the hashes of all input files
+    (FMU archives, load profiles, source files of the simulators and of all local modules they
+    import). If a run with the
+    same hash has been done before, its result store is copied to the output file instead of
+    running the simulation again. The output file is a copy (not a link), so that later runs
+    writing to the same file never modify the cache.
+
+    Cache layout: <cache_dir>/<hash>.h5 (result store) and <cache_dir>/<hash>.json (configuration).
+"""
+
+import ast
+import glob
+import hashlib
+import json
+import os
+import shutil
+
+
+# Scenario parameters that do not affect the results.
+OPERATIONAL_ARGS = ['output_file', 'telemetry', 'mosaik_port', 'fmu_host', 'cache_dir', 'profile', 'trace', 'workers', 'fmu_dir']
+
+# Directory of the simulators and their local modules.
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Load profiles of the power system (packaged into the PowerFactory FMU).
+LOAD_PROFILES = os.path.join(SOURCE_DIR, 'fmus', 'pf_network_fmu', 'resources', '*.csv')
+
+_file_hashes = {} # (path, size, mtime) -> hash
+
+
+def file_hash(path):
+    '''Returns the SHA-256 hash of the contents of a file (None if the file does not exist).'''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        _file_hashes[memo_key] = digest.hexdigest()
+    return _file_hashes[memo_key]
+
+
+def module_file(name):
+    '''Returns the source file of a local module (in SOURCE_DIR, None for other modules).'''
+    path = os.path.join(SOURCE_DIR, *name.split('.'))
+    for filename in (path + '.py', os.path.join(path, '__init__.py')):
+        if os.path.isfile(filename): return filename
+    return None
+
+
+def local_modules(names):
+    '''Returns the source files of local modules and of all local modules they import (directly or indirectly).
+    The imports are parsed, not executed (e.g., the ns-3 adapter runs with Python 2).'''
+    files, pending = [], list(names)
+    while pending:
+        name = pending.pop()
+        if '.' in name: pending.append(name.rsplit('.', 1)[0]) # Importing a module runs its package.
+        filename = module_file(name)
+        if filename is None or filename in files: continue
+        files.append(filename)
+        with open(filename, 'rb') as f:
+            tree = ast.parse(f.read(), filename)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                pending.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                # 'from package import module' imports a module of the package.
+                pending.append(node.module)
+                pending.extend(node.module + '.' + alias.name for alias in node.names)
+    return sorted(files)
+
+
+def input_files(fmu_dir, model_names, modules):
+    '''Returns the input files of a scenario: FMU archives, load profiles and the source files of the
+    simulators (modules, however they are started) and of all local modules they import.'''
+    files = [os.path.join(fmu_dir, name + '.fmu') for name in model_names]
+    files.extend(sorted(glob.glob(LOAD_PROFILES)))
+    files.extend(local_modules(modules))
+    return files
+
+
+def file_key(path):
+    '''Returns the name of an input file in the configuration (local files relative to SOURCE_DIR).'''
+    path = os.path.abspath(path)
+    if path.startswith(SOURCE_DIR + os.sep) and not path.endswith('.fmu'):
+        return os.path.relpath(path, SOURCE_DIR).replace(os.sep, '/')
+    return os.path.basename(path)
+
+
+def scenario_config(name, settings, files):
+    '''Returns the configuration of a scenario run that determines its results (settings: dict).
+    Runs with missing input files cannot be cached.'''
+    hashes = {file_key(path): file_hash(path) for path in files}
+    missing = [path for path in files if hashes[file_key(path)] is None]
+    if missing:
+        raise RuntimeError('Results cannot be cached, input files are missing: {0}'.format(', '.join(missing)))
+    return {
+        'scenario': name,
+        'settings': {key: value for key, value in sorted(settings.items()) if key not in OPERATIONAL_ARGS},
+        'files': hashes,
+    }
+
+
+def release(output_file):
+    '''Removes a link to a result store (e.g., a cache entry linked by earlier versions), so that a
+    new run writes a new file instead of writing through the link.'''
+    if os.path.islink(output_file): os.remove(output_file)
+
+
+class ResultCache(object):
+    """
+        Result stores of previous runs, addressed by the hash of their configuration.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, config):
+        text = json.dumps(config, sort_keys=True, default=str)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.cache_dir, key + '.h5')
+
+    def restore(self, key, output_file):
+        '''Copies the cached result store to the output file. Returns False if there is none.'''
+        entry = self.entry(key)
+        if not os.path.exists(entry): return False
+        if os.path.abspath(output_file) == os.path.abspath(entry): return True
+
+        if os.path.lexists(output_file): os.remove(output_file)
+        shutil.copyfile(entry, output_file)
+        return True
+
+    def store(self, key, output_file, config):
+        '''Copies the result store of a run into the cache.'''
+        entry = self.entry(key)
+        tmp = '{0}.{1}.tmp'.format(entry, os.getpid())
+        shutil.copyfile(output_file, tmp)
+        os.replace(tmp, entry) # Atomic, runs in parallel may store the same entry.
+        with open(os.path.join(self.cache_dir, key + '.json'), 'w') as f:
+            json.dump(config, f, indent=2, sort_keys=True, default=str)
@@ -0,0 +1,215 @@
+"""
+    Checkpoints of the LSS2 simulators, for what-if studies that branch off a common prefix (see
+    lss2_fork.py). A simulator started with parameters *checkpoint* (a directory) and
+    *checkpoint_time* (mosaik time) writes a checkpoint to <checkpoint>/<sid>.checkpoint right
+    before its first step at or after the checkpoint time. A simulator started with parameter
+    *restore* (the same directory) continues from this checkpoint in a new mosaik world.
+
+    The new world does not start at time 0 but at the start of a short window before the checkpoint
+    time: the earliest of the latest steps of all simulators before the checkpoint time (see window,
+    lss2_scenario.py sets the initial step of all simulators to this time). Within the window, a
+    restored simulator answers all calls (step, get_data) with the results recorded in the checkpoint,
+    i.e., without any computation, so that mosaik passes the same data (e.g., the latest outputs of
+    the predecessors of each simulator) as in the original run. A simulator whose first recorded step
+    in the window is later than its start only reports this step as its next one (without outputs). At
+    its first step at or after the checkpoint time, it restores its state and continues normally
+    (with the parameters of the new world, e.g., a different dead time of the controller).
+
+    The state of a simulator consists of the attributes listed in its *checkpoint_attrs* (e.g.,
+    FMU times, message tables, sender schedules and controller state), simulators with state
+    that cannot be copied directly provide methods get_checkpoint_state and set_checkpoint_state.
+    The FMUs (FMI 1.0) cannot serialize their state: the calls that change it (setters and doStep)
+    are logged from the first step on and replayed on the new FMU instances when restoring. Hence,
+    restoring costs as much FMU time as the prefix, but none of the co-simulation around it.
+
+    Files of a checkpoint (per simulator): <sid>.checkpoint (state, results and FMU calls), <sid>.json
+    (time of the latest step before the checkpoint time) and other files a simulator may add (e.g.,
+    the results written so far by the collector, see Checkpoint.file).
+
+    This module is also used by the Python 2 adapter of the ns-3 network (see lss2_comm_ns3_fmu.py).
+"""
+
+import copy
+import functools
+import glob
+import gzip
+import json
+import os
+import pickle
+import sim_profiler
+
+FORMAT_VERSION = 2
+
+# FMU methods that change the state of an FMU (fmipp and fmi_cs_v1_standalone).
+STATE_METHODS = [name for name in sim_profiler.FMU_METHODS if name == 'doStep' or name.startswith('set')]
+
+
+def get_state(obj, names=None):
+    '''Returns copies of the attributes of an object (by default, the ones listed in its *checkpoint_attrs*).'''
+    return dict((name, copy.deepcopy(getattr(obj, name))) for name in (names or obj.checkpoint_attrs))
+
+
+def set_state(obj, state):
+    for name, value in state.items():
+        setattr(obj, name, value)
+
+
+class FMURecorder(object):
+    """
+        Proxy of an FMU that logs the calls changing its state while the checkpoint is recording.
+    """
+
+    def __init__(self, checkpoint, fmu, calls):
+        self._fmu = fmu
+        for name in STATE_METHODS:
+            if hasattr(fmu, name): setattr(self, name, self.recorded(checkpoint, calls, name, getattr(fmu, name)))
+
+    @staticmethod
+    def recorded(checkpoint, calls, name, func):
+        def wrapper(*args, **kwargs):
+            if checkpoint.recording: calls.append((name, args, kwargs))
+            return func(*args, **kwargs)
+        return wrapper
+
+    def __getattr__(self, name):
+        return getattr(self._fmu, name)
+
+
+class Checkpoint(object):
+    """
+        Writes (mode 'save') or restores (mode 'restore') the checkpoint of one simulator.
+    """
+
+    def __init__(self, sim, sid, checkpoint_dir, time=None, restore=False):
+        self.sim = sim
+        self.sid = sid
+        self.filename = os.path.join(checkpoint_dir, sid.replace('/', '_') + '.checkpoint')
+        self.restore = restore
+        self.active = True # Before the checkpoint time
+        self.recording = False # FMU calls are logged (from the first step on)
+        self.fmus = {} # key -> FMU (e.g., one per entity)
+        self.fmu_calls = {} # key -> list of (name, args, kwargs)
+        self.results = [] # (name, step time, result) of all calls before the checkpoint time
+        self.position = 0 # Next recorded result (mode 'restore')
+        self.state = None
+        self.step_time = None # Time of the latest step
+        self.last_step = None # Time of the latest step before the checkpoint time (mode 'save')
+        self.gap = None # Time of a step at the start of the window that has not been recorded (mode 'restore')
+        if restore:
+            if not os.path.exists(self.filename):
+                raise RuntimeError('No checkpoint of simulator {0} in {1}.'.format(sid, checkpoint_dir))
+            with gzip.open(self.filename, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('format') != FORMAT_VERSION:
+                raise RuntimeError('Checkpoint {0} has unknown format {1}.'.format(self.filename, data.get('format')))
+            time, self.state, self.results, self.fmu_calls = data['time'], data['state'], data['results'], data['fmu_calls']
+            # Calls before the window are not made in the new world.
+            start = window(checkpoint_dir)[0]
+            while self.position < len(self.results) and self.results[self.position][1] < start: self.position += 1
+        elif time is None:
+            raise RuntimeError('Simulator {0}: a checkpoint requires the checkpoint time.'.format(sid))
+        self.time = time
+
+    def file(self, extension):
+        '''Returns the name of an additional file of the checkpoint of the simulator.'''
+        return os.path.splitext(self.filename)[0] + '.' + extension
+
+    def fmu(self, key, fmu):
+        '''Registers an FMU (its state is part of the checkpoint) and returns the FMU to be used by the simulator.'''
+        self.fmus[key] = fmu
+        if self.restore: return fmu
+        return FMURecorder(self, fmu, self.fmu_calls.setdefault(key, []))
+
+    def call(self, name, method, args, kwargs):
+        if name == 'step':
+            self.step_time = args[0]
+            if self.step_time >= self.time:
+                self.switch()
+                return method(*args, **kwargs)
+            self.recording = True
+            self.last_step = self.step_time
+        if self.restore:
+            if name == 'step' and self.gap is None and self.position < len(self.results) and self.results[self.position][1] > self.step_time:
+                # First step of the new world (at the start of the window), the next one has been recorded.
+                self.gap = self.step_time
+                return self.results[self.position][1]
+            if name == 'get_data' and self.step_time == self.gap:
+                return {}
+            if self.position >= len(self.results) or self.results[self.position][:2] != (name, self.step_time):
+                raise RuntimeError('Simulator {0} cannot be restored: call {1} at time {2} differs from the checkpoint.'.format(
+                    self.sid, name, self.step_time))
+            self.position += 1
+            return self.results[self.position - 1][2]
+        result = method(*args, **kwargs)
+        self.results.append((name, self.step_time, copy.deepcopy(result)))
+        return result
+
+    def switch(self):
+        '''Writes or restores the checkpoint (before the first step at or after the checkpoint time).'''
+        if not self.active: return
+        self.active = False
+        self.recording = False
+        sim = self.sim
+        if self.restore:
+            if self.position != len(self.results):
+                raise RuntimeError('Simulator {0} cannot be restored: {1} calls of the checkpoint have not been made.'.format(
+                    self.sid, len(self.results) - self.position))
+            for key, calls in self.fmu_calls.items():
+                if key not in self.fmus:
+                    raise RuntimeError('Simulator {0} cannot be restored: it has no FMU {1} (different configuration?).'.format(
+                        self.sid, key))
+                fmu = self.fmus[key]
+                for name, args, kwargs in calls: getattr(fmu, name)(*args, **kwargs)
+            if hasattr(sim, 'set_checkpoint_state'): sim.set_checkpoint_state(self.state)
+            else: set_state(sim, self.state)
+        else:
+            state = sim.get_checkpoint_state() if hasattr(sim, 'get_checkpoint_state') else get_state(sim)
+            data = {'format': FORMAT_VERSION, 'sid': self.sid, 'time': self.time, 'state': state,
+                'results': self.results, 'fmu_calls': self.fmu_calls}
+            if not os.path.isdir(os.path.dirname(self.filename)): os.makedirs(os.path.dirname(self.filename))
+            with gzip.open(self.filename + '.tmp', 'wb') as f:
+                pickle.dump(data, f, 2)
+            os.rename(self.filename + '.tmp', self.filename)
+            with open(self.file('json'), 'w') as f:
+                json.dump({'sid': self.sid, 'time': self.time, 'last_step': self.last_step}, f)
+        self.results = []
+        self.fmu_calls = {}
+
+    def close(self):
+        '''Writes the checkpoint if the simulation ended before the simulator was stepped again.'''
+        if not self.restore: self.switch()
+
+
+def checkpointed(method):
+    '''Decorator for methods of simulators (step, get_data): calls before the checkpoint time are recorded
+    or answered from the checkpoint if the simulator has a checkpoint (attribute *checkpoint*, None if
+    checkpoints are turned off).'''
+    name = method.__name__
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        checkpoint = self.checkpoint
+        if checkpoint is None or not checkpoint.active: return method(self, *args, **kwargs)
+        return checkpoint.call(name, functools.partial(method, self), args, kwargs)
+    return wrapper
+
+
+def window(checkpoint_dir):
+    '''Returns the start of the window before the checkpoint time (the earliest of the latest steps of all
+    simulators before the checkpoint time) and the IDs of the simulators that have been stepped before.'''
+    last_steps = {}
+    for filename in glob.glob(os.path.join(checkpoint_dir, '*.json')):
+        with open(filename) as f:
+            info = json.load(f)
+        if info['last_step'] is not None: last_steps[info['sid']] = info['last_step']
+    if not last_steps:
+        raise RuntimeError('No checkpoints in {0}.'.format(checkpoint_dir))
+    return min(last_steps.values()), sorted(last_steps)
+
+
+def create(sim, sid, checkpoint_dir=None, checkpoint_time=None, restore_dir=None):
+    '''Returns the checkpoint of a simulator (None if neither checkpoint_dir nor restore_dir is given).'''
+    if checkpoint_dir is not None and restore_dir is not None:
+        raise RuntimeError('Simulator {0}: a checkpoint cannot be written while restoring one.'.format(sid))
+    if restore_dir is not None: return Checkpoint(sim, sid, restore_dir, restore=True)
+    if checkpoint_dir is not None: return Checkpoint(sim, sid, checkpoint_dir, checkpoint_time)
+    return None
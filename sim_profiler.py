@@ -0,0 +1,216 @@
+"""
+    Opt-in profiling of the LSS2 simulators: counts and times the calls of the mosaik API (step,
+    get_data) and of the FMUs (doStep, get*/set*), as well as inner iterations (e.g., the event
+    loop of the ns-3 network). A simulator started with parameter *profile* (a directory) writes
+    a report to <profile>/<sid>.json when it is finalized. Without this parameter, no call is
+    instrumented (the methods of the simulators only check whether they have a profiler).
+
+    The durations of the calls (measured with a monotonic clock) are counted in histograms with
+    pre-allocated logarithmic bins (bin k holds durations from 2^(k-1) to 2^k nanoseconds), which
+    yield approximate percentiles at a fixed memory cost. Calls are identified by their call path,
+    e.g., 'step;doStep' for calls of doStep during step.
+
+    Summarize the reports of a run or export them for flame graphs (folded stacks, e.g., for
+    flamegraph.pl or speedscope) with:
+        python sim_profiler.py report profile_dir
+        python sim_profiler.py folded profile_dir > profile.folded
+
+    This module is also used by the Python 2 adapter of the ns-3 network (see lss2_comm_ns3_fmu.py).
+"""
+
+import argparse
+import array
+import functools
+import glob
+import json
+import os
+import time
+
+# Monotonic clock (Python 2 has no perf_counter).
+clock = getattr(time, 'perf_counter', time.time)
+
+NUM_BINS = 48 # The last bin holds all durations above 2^46 ns (about 20 hours).
+
+
+class Histogram(object):
+    """
+        Number, total, minimum and maximum duration of calls and their distribution.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.min = float('inf')
+        self.max = 0.
+        self.bins = array.array('l', [0]*NUM_BINS)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min: self.min = seconds
+        if seconds > self.max: self.max = seconds
+        self.bins[min(NUM_BINS - 1, int(seconds*1e9).bit_length())] += 1
+
+    def to_dict(self):
+        return {'count': self.count, 'total': self.total, 'min': self.min if self.count else 0.,
+            'max': self.max, 'bins': list(self.bins)}
+
+
+def percentile(bins, q):
+    '''Returns the upper bound (in seconds) of the histogram bin holding the q-quantile of the durations.'''
+    total = sum(bins)
+    if not total: return 0.
+    cumulative = 0
+    for k, n in enumerate(bins):
+        cumulative += n
+        if cumulative >= q*total: return 2**k*1e-9
+    return 2**(len(bins) - 1)*1e-9
+
+
+class Profiler(object):
+    """
+        Collects the call statistics of one simulator. Instrumented calls form a call stack: the
+        histograms are indexed by call path and the time spent in a call path without its
+        instrumented sub-calls (self time) is accumulated for the flame graph export.
+    """
+
+    def __init__(self, sid, profile_dir):
+        self.sid = sid
+        self.filename = os.path.join(profile_dir, sid.replace('/', '_') + '.json')
+        self.histograms = {} # call path -> Histogram
+        self.self_time = {} # call path -> self time
+        self.counters = {} # name -> count
+        self.stack = [] # [call path, start time, time spent in sub-calls]
+        self.start = clock()
+        if not os.path.isdir(profile_dir): os.makedirs(profile_dir)
+
+    def call(self, name, func, *args, **kwargs):
+        '''Calls *func* and records the call under *name*.'''
+        path = self.stack[-1][0] + ';' + name if self.stack else name
+        frame = [path, clock(), 0.]
+        self.stack.append(frame)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            duration = clock() - frame[1]
+            self.stack.pop()
+            if self.stack: self.stack[-1][2] += duration
+            histogram = self.histograms.get(path)
+            if histogram is None: histogram = self.histograms[path] = Histogram()
+            histogram.add(duration)
+            self.self_time[path] = self.self_time.get(path, 0.) + duration - frame[2]
+
+    def timed(self, name, func):
+        '''Returns a wrapper of *func* that records its calls under *name*.'''
+        def wrapper(*args, **kwargs):
+            return self.call(name, func, *args, **kwargs)
+        return wrapper
+
+    def instrument(self, obj, names):
+        '''Replaces the methods of an object (given by name, missing ones are skipped) by timed wrappers.'''
+        for name in names:
+            if hasattr(obj, name): setattr(obj, name, self.timed(name, getattr(obj, name)))
+        return obj
+
+    def proxy(self, obj, names):
+        '''Returns a proxy of an object whose methods cannot be replaced (e.g., FMUs of fmipp).'''
+        return TimedProxy(self, obj, names)
+
+    def count(self, name, n=1):
+        '''Counts events that are not timed (e.g., iterations of an inner loop).'''
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def write(self):
+        '''Writes the report of the simulator (at the end of the simulation).'''
+        report = {
+            'sid': self.sid,
+            'wall_time': clock() - self.start,
+            'calls': dict((path, h.to_dict()) for path, h in self.histograms.items()),
+            'self_time': self.self_time,
+            'counters': self.counters,
+        }
+        with open(self.filename, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+
+
+class TimedProxy(object):
+    """
+        Forwards all attribute accesses to an object, calls of the given methods are timed.
+    """
+
+    def __init__(self, profiler, obj, names):
+        self._obj = obj
+        for name in names:
+            if hasattr(obj, name): setattr(self, name, profiler.timed(name, getattr(obj, name)))
+
+    def __getattr__(self, name):
+        return getattr(self._obj, name)
+
+
+# FMU methods that are instrumented (fmipp and fmi_cs_v1_standalone).
+FMU_METHODS = ['doStep', 'getRealValue', 'getIntegerValue', 'getBooleanValue', 'getStringValue',
+    'setRealValue', 'setIntegerValue', 'setBooleanValue', 'setStringValue',
+    'getReal', 'getInteger', 'setReal', 'setInteger']
+
+
+def profiled(method):
+    '''Decorator for methods of simulators (step, get_data): calls are recorded if the simulator has
+    a profiler (attribute *profiler*, None if profiling is turned off).'''
+    name = method.__name__
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.profiler is None: return method(self, *args, **kwargs)
+        return self.profiler.call(name, method, self, *args, **kwargs)
+    return wrapper
+
+
+def create(sid, profile_dir):
+    '''Returns a profiler for a simulator (None if profile_dir is None, i.e., profiling is turned off).'''
+    return Profiler(sid, profile_dir) if profile_dir is not None else None
+
+
+def read_reports(profile_dir):
+    reports = []
+    for filename in sorted(glob.glob(os.path.join(profile_dir, '*.json'))):
+        with open(filename) as f:
+            report = json.load(f)
+        if 'calls' in report: reports.append(report)
+    return reports
+
+
+def format_report(reports):
+    '''Returns a table of the call statistics of all simulators.'''
+    lines = ['{0:<28} {1:<32} {2:>10} {3:>10} {4:>10} {5:>10} {6:>10}'.format(
+        'simulator', 'call', 'count', 'total [s]', 'mean [us]', 'p50 [us]', 'p99 [us]')]
+    for report in reports:
+        lines.append('{0:<28} {1:<32} {2:>10} {3:>10.3f}'.format(report['sid'], '(wall time)', '', report['wall_time']))
+        for path, call in sorted(report['calls'].items(), key=lambda item: -item[1]['total']):
+            lines.append('{0:<28} {1:<32} {2:>10} {3:>10.3f} {4:>10.1f} {5:>10.1f} {6:>10.1f}'.format(
+                report['sid'], path, call['count'], call['total'], 1e6*call['total']/max(call['count'], 1),
+                1e6*percentile(call['bins'], 0.5), 1e6*percentile(call['bins'], 0.99)))
+        for name, n in sorted(report['counters'].items()):
+            lines.append('{0:<28} {1:<32} {2:>10}'.format(report['sid'], name, n))
+    return '\n'.join(lines)
+
+
+def folded_stacks(reports):
+    '''Returns the self times in folded stack format (one line per call path, in microseconds).'''
+    lines = []
+    for report in reports:
+        for path, seconds in sorted(report['self_time'].items()):
+            lines.append('{0};{1} {2}'.format(report['sid'], path, int(round(seconds*1e6))))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize the profiles of the LSS2 simulators')
+    parser.add_argument('command', choices=['report', 'folded'], help='print a table or folded stacks for flame graphs')
+    parser.add_argument('profile_dir', type=str, help='directory of the reports')
+    args = parser.parse_args()
+
+    reports = read_reports(args.profile_dir)
+    print(format_report(reports) if args.command == 'report' else folded_stacks(reports))
+
+
+if __name__ == '__main__':
+    main()
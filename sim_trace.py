@@ -0,0 +1,225 @@
+"""
+    Deterministic record and replay of single LSS2 simulators. A simulator started with parameter
+    *trace* (a directory) records all calls it receives from mosaik (init, create, step, get_data)
+    together with their results to <trace>/<sid>.trace. Without this parameter, nothing is
+    recorded (the methods of the simulators only check whether they have a tracer).
+
+    The trace is a gzip-compressed stream of pickled records (protocol 2, i.e., traces of the
+    Python 2 adapter of the ns-3 network can be read with Python 3 and vice versa): a header with
+    the simulator class, followed by one record (name, args, kwargs) and one result per call. The
+    arguments of a call are pickled before the call, so that simulators changing their inputs do
+    not change the trace.
+
+    The replay driver feeds a trace into a fresh instance of the simulator, without mosaik and
+    without the other simulators, and compares the results of all calls with the recorded ones.
+    The calls are read into memory before the replay starts, i.e., they are made as fast as the
+    simulator allows:
+        python sim_trace.py info traces/LoadFlowSim-0.trace
+        python sim_trace.py replay traces/LoadFlowSim-0.trace --set work_dir=\\"fmus\\"
+
+    Together with parameter *profile* (see sim_profiler.py, option --profile of the replay
+    driver), this allows to benchmark and tune a single simulator at full speed.
+"""
+
+import argparse
+import copy
+import functools
+import gzip
+import importlib
+import inspect
+import json
+import math
+import os
+import pickle
+import sys
+import time
+
+# Monotonic clock (Python 2 has no perf_counter).
+clock = getattr(time, 'perf_counter', time.time)
+
+FORMAT_VERSION = 1
+
+# Parameters of init that are not passed on when replaying a trace (a restored simulator computes
+# the results of the checkpoint again).
+REPLAY_EXCLUDE = ['trace', 'checkpoint', 'checkpoint_time', 'restore']
+
+
+class Tracer(object):
+    """
+        Writes the trace of one simulator.
+    """
+
+    def __init__(self, sim, sid, trace_dir):
+        self.filename = os.path.join(trace_dir, sid.replace('/', '_') + '.trace')
+        if not os.path.isdir(trace_dir): os.makedirs(trace_dir)
+        self.file = gzip.open(self.filename, 'wb')
+        cls = type(sim)
+        module = cls.__module__
+        if module == '__main__':
+            # Simulator started as script (e.g., by mosaik command 'python lss2_comm_ns3_fmu.py').
+            module = os.path.splitext(os.path.basename(inspect.getfile(cls)))[0]
+        self.dump({'format': FORMAT_VERSION, 'sid': sid, 'simulator': '{0}:{1}'.format(module, cls.__name__),
+            'python': sys.version_info[0]})
+
+    def dump(self, obj):
+        self.file.write(pickle.dumps(obj, 2))
+
+    def call(self, name, args, kwargs):
+        '''Returns the pickled record of a call (written with its result by method result).'''
+        return pickle.dumps((name, args, kwargs), 2)
+
+    def result(self, call, result):
+        self.file.write(call)
+        self.dump(result)
+
+    def close(self):
+        self.file.close()
+
+
+def traced(method):
+    '''Decorator for methods of simulators (init, create, step, get_data): calls are recorded if the
+    simulator has a tracer (attribute *tracer*, None if tracing is turned off). The tracer is created
+    by init, i.e., init is recorded after the call.'''
+    name = method.__name__
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        tracer = self.tracer
+        call = tracer.call(name, args, kwargs) if tracer is not None else None
+        result = method(self, *args, **kwargs)
+        if tracer is None and self.tracer is not None:
+            tracer = self.tracer
+            call = tracer.call(name, args, kwargs)
+        if tracer is not None: tracer.result(call, result)
+        return result
+    return wrapper
+
+
+def create(sim, sid, trace_dir):
+    '''Returns a tracer for a simulator (None if trace_dir is None, i.e., tracing is turned off).'''
+    return Tracer(sim, sid, trace_dir) if trace_dir is not None else None
+
+
+def read_trace(filename):
+    '''Returns the header and the list of calls (name, args, kwargs, result) of a trace.'''
+    calls = []
+    with gzip.open(filename, 'rb') as f:
+        header = pickle.load(f)
+        if header.get('format') != FORMAT_VERSION:
+            raise RuntimeError('Trace {0} has unknown format {1}.'.format(filename, header.get('format')))
+        while True:
+            try:
+                name, args, kwargs = pickle.load(f)
+            except EOFError:
+                break
+            try:
+                result = pickle.load(f)
+            except EOFError:
+                break # Incomplete trace (simulation aborted during the last call).
+            calls.append((name, args, kwargs, result))
+    return header, calls
+
+
+def differences(expected, actual, rtol=0., path=''):
+    '''Yields (path, expected, actual) of all values that differ (numbers up to relative tolerance rtol).'''
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        for key in sorted(set(expected) | set(actual), key=str):
+            sub_path = '{0}/{1}'.format(path, key)
+            if key not in actual or key not in expected:
+                yield sub_path, expected.get(key), actual.get(key)
+            else:
+                for diff in differences(expected[key], actual[key], rtol, sub_path): yield diff
+    elif isinstance(expected, (list, tuple)) and isinstance(actual, (list, tuple)) and len(expected) == len(actual):
+        for k, (e, a) in enumerate(zip(expected, actual)):
+            for diff in differences(e, a, rtol, '{0}/{1}'.format(path, k)): yield diff
+    elif isinstance(expected, float) or isinstance(actual, float):
+        try:
+            e, a = float(expected), float(actual)
+        except (TypeError, ValueError):
+            yield path, expected, actual
+            return
+        if not (e == a or (math.isnan(e) and math.isnan(a)) or abs(e - a) <= rtol*max(abs(e), abs(a))):
+            yield path, expected, actual
+    elif expected != actual:
+        yield path, expected, actual
+
+
+def load_simulator(spec):
+    '''Returns a new instance of a simulator given as <module>:<class>.'''
+    module, _, cls = spec.partition(':')
+    return getattr(importlib.import_module(module), cls)()
+
+
+def replay(header, calls, simulator=None, overrides=None, rtol=0., max_mismatches=10):
+    '''Makes the recorded calls on a new instance of the simulator and returns the wall time per call
+    name and the list of mismatches (index of call, name, path, expected, actual).'''
+    sim = load_simulator(simulator or header['simulator'])
+    times = {}
+    mismatches = []
+    for k, (name, args, kwargs, expected) in enumerate(calls):
+        if name == 'init':
+            kwargs = dict((key, value) for key, value in kwargs.items() if key not in REPLAY_EXCLUDE)
+            kwargs.update(overrides or {})
+        func = getattr(sim, name)
+        args, kwargs = copy.deepcopy((args, kwargs)) # The calls may change their inputs.
+        start = clock()
+        actual = func(*args, **kwargs)
+        times[name] = times.get(name, 0.) + clock() - start
+        if name == 'init': continue # Meta data (may differ with overrides).
+        for path, e, a in differences(expected, actual, rtol):
+            if len(mismatches) < max_mismatches: mismatches.append((k, name, path, e, a))
+            else: break
+    if hasattr(sim, 'finalize'): sim.finalize()
+    return times, mismatches
+
+
+def parse_setting(text):
+    '''Parses KEY=VALUE, the value is JSON (e.g., 10, true, "fmus") or a plain string.'''
+    key, sep, value = text.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError('expected <key>=<value>, got {0}'.format(text))
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def describe_call(name, args):
+    if name == 'step': return 'step at time {0}'.format(args[0])
+    return name
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or replay the trace of a LSS2 simulator')
+    parser.add_argument('command', choices=['info', 'replay'], help='print a summary of the trace or replay it')
+    parser.add_argument('trace', type=str, help='trace file')
+    parser.add_argument('--simulator', type=str, help='simulator to replay the trace with (<module>:<class>, default: the recorded one)', default=None)
+    parser.add_argument('--set', type=parse_setting, action='append', metavar='KEY=VALUE', help='change a parameter of init (e.g., work_dir=\\"fmus\\")', default=[])
+    parser.add_argument('--profile', type=str, help='profile the simulator (see sim_profiler.py)', default=None)
+    parser.add_argument('--rtol', type=float, help='relative tolerance when comparing numbers', default=0.)
+    args = parser.parse_args()
+
+    header, calls = read_trace(args.trace)
+    counts = {}
+    for name, _, _, _ in calls: counts[name] = counts.get(name, 0) + 1
+    steps = [call_args[0] for name, call_args, _, _ in calls if name == 'step']
+    print('{0} ({1}, recorded with Python {2}): {3}'.format(header['sid'], header['simulator'], header['python'],
+        ', '.join('{0} x {1}'.format(n, name) for name, n in sorted(counts.items()))))
+    if steps: print('steps from time {0} to {1}'.format(steps[0], steps[-1]))
+    if args.command == 'info': return
+
+    overrides = dict(args.set)
+    if args.profile is not None: overrides['profile'] = args.profile
+    # One replay per process: FMUs are extracted by init, which must not overwrite loaded shared libraries.
+    times, mismatches = replay(header, calls, args.simulator, overrides, args.rtol)
+    total = sum(t for name, t in times.items() if name != 'init')
+    print('replay: {0:.3f} s ({1})'.format(total, ', '.join(
+        '{0} {1:.3f} s, {2:.1f} us/call'.format(name, t, 1e6*t/counts[name]) for name, t in sorted(times.items()) if name != 'init')))
+    if mismatches:
+        for k, name, path, e, a in mismatches:
+            print('mismatch in call {0} ({1}) at {2}: expected {3!r}, got {4!r}'.format(k, describe_call(name, calls[k][1]), path or '/', e, a))
+        sys.exit(1)
+    print('all results match the trace')
+
+
+if __name__ == '__main__':
+    main()